@@ -0,0 +1,67 @@
+"""
+Benchmark of message encryption and decryption in msgs/s for small and large payloads. Compares the previous
+EncryptedMessage behaviour (two AES-EAX ciphers and PKCS7 padding per message) with the current single cipher per
+message, for every supported AEAD mode.
+
+Run from the repository root: python -m Benchmark.cipher_benchmark
+"""
+
+import argparse
+import time
+
+from Cryptodome.Cipher import AES
+from Cryptodome.Random import get_random_bytes
+from Cryptodome.Util import Padding
+
+from MessageTypes.message import EncryptedMessage, MODES
+
+
+def legacy_encrypt(key: bytes, text: str):
+    # What EncryptedMessage used to do: one cipher just to get a nonce, a second one to encrypt the padded text
+    nonce = AES.new(key, AES.MODE_EAX).nonce
+    return nonce, AES.new(key, AES.MODE_EAX, nonce=nonce).encrypt_and_digest(Padding.pad(bytes(text, "utf-8"), 16))
+
+
+def legacy_decrypt(key: bytes, nonce: bytes, ciphertext: bytes, tag: bytes) -> str:
+    cipher = AES.new(key, AES.MODE_EAX, nonce=nonce)
+    plaintext = Padding.unpad(cipher.decrypt(ciphertext), 16)
+    cipher.verify(tag)
+    return str(plaintext, "utf-8")
+
+
+def rate(func, count: int) -> float:
+    """
+    Runs func, which processes count messages, and returns messages per second
+    """
+    start = time.perf_counter()
+    func()
+    return count / (time.perf_counter() - start)
+
+
+def run(sizes: list, count: int):
+    key = get_random_bytes(32)
+    print(f"{'payload':>8}  {'mode':<19}{'method':<9}{'encrypt/s':>12}{'decrypt/s':>12}")
+
+    for size in sizes:
+        texts = ["x" * size] * count
+
+        sealed = [legacy_encrypt(key, text) for text in texts]
+        encrypt = rate(lambda: [legacy_encrypt(key, text) for text in texts], count)
+        decrypt = rate(lambda: [legacy_decrypt(key, nonce, c, t) for nonce, (c, t) in sealed], count)
+        print(f"{size:>8}  {'eax (padded)':<19}{'legacy':<9}{encrypt:>12,.0f}{decrypt:>12,.0f}")
+
+        for mode in MODES:
+            messages = [EncryptedMessage(key, text, mode=mode) for text in texts]
+            encrypt = rate(lambda: [EncryptedMessage(key, text, mode=mode) for text in texts], count)
+            decrypt = rate(lambda: [message.decrypt() for message in messages], count)
+            print(f"{size:>8}  {mode:<19}{'single':<9}{encrypt:>12,.0f}{decrypt:>12,.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="cipher-benchmark")
+    parser.add_argument("-s", "--sizes", type=int, nargs="+", default=[64, 65536],
+                        help="Payload sizes in bytes, defaults to 64 65536")
+    parser.add_argument("-n", "--count", type=int, default=2000, help="Messages per measurement, defaults to 2000")
+
+    args = parser.parse_args()
+    run(args.sizes, args.count)
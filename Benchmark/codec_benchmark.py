@@ -0,0 +1,69 @@
+"""
+Micro-benchmark comparing the binary codec in MessageTypes.codec with the YAML encoding it replaces. Reports encode
+and decode throughput and the size on the wire for every message class.
+
+Run from the repository root: python -m Benchmark.codec_benchmark
+"""
+
+import argparse
+import timeit
+
+import yaml
+from Cryptodome.Random import get_random_bytes
+
+from MessageTypes import codec
+from MessageTypes.message import EncryptedMessage, KeyExchangeMessage, LoginMessage, RegisterMessage, Message
+
+
+def sample_messages(text_size: int) -> dict:
+    """
+    Builds one representative instance of every message class
+    """
+    key = get_random_bytes(32)
+    prime = (1 << 2048) - 159  # Only the size matters here, not primality
+
+    return {
+        "Message": Message(prime - 1, "alice", "bob"),
+        "KeyExchangeMessage": KeyExchangeMessage("Request Key Exchange", prime, 2, prime - 3, "root", "bob",
+                                                 (codec.BINARY, codec.YAML)),
+        "EncryptedMessage": EncryptedMessage(key, "x" * text_size, recipient="alice", sender="bob"),
+        "LoginMessage": LoginMessage(key, "bob", "a" * 64, sender="bob"),
+        "RegisterMessage": RegisterMessage(key, "bob", "a" * 64, sender="bob"),
+    }
+
+
+def bench(func, number: int) -> float:
+    """
+    Returns operations per second for func, taking the best of three runs
+    """
+    return number / min(timeit.repeat(func, number=number, repeat=3))
+
+
+def run(number: int, text_size: int):
+    print(f"{'message':<20}{'format':<8}{'bytes':>8}{'encode/s':>14}{'decode/s':>14}")
+
+    for name, obj in sample_messages(text_size).items():
+        encoded_yaml = codec.encode(obj, codec.YAML)
+        encoded_binary = codec.encode(obj, codec.BINARY)
+
+        results = (
+            (codec.YAML, encoded_yaml,
+             bench(lambda: bytes(yaml.dump(obj), "utf-8"), number),
+             bench(lambda: yaml.load(encoded_yaml, Loader=yaml.Loader), number)),
+            (codec.BINARY, encoded_binary,
+             bench(lambda: codec.encode_binary(obj), number),
+             bench(lambda: codec.decode_binary(encoded_binary), number)),
+        )
+
+        for wire_format, encoded, encode_rate, decode_rate in results:
+            print(f"{name:<20}{wire_format:<8}{len(encoded):>8}{encode_rate:>14,.0f}{decode_rate:>14,.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="codec-benchmark")
+    parser.add_argument("-n", "--number", type=int, default=2000, help="Operations per timing run, defaults to 2000")
+    parser.add_argument("-s", "--text-size", type=int, default=256,
+                        help="Plain text length of the EncryptedMessage sample, defaults to 256")
+
+    args = parser.parse_args()
+    run(args.number, args.text_size)
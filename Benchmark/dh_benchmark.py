@@ -0,0 +1,81 @@
+"""
+Benchmark of server side Diffie-Hellman key exchanges per second at each group size. One exchange is generating a
+keypair and deriving the shared secret from the peer's public value, as ClientInfo.dh_key_exchange does. Compares the
+built-in pow for both steps with the fixed-base tables in Util.dh.
+
+The naive (root ** secret) % prime the server used before cannot finish at these sizes and is not measured.
+
+By default random odd moduli of each size are used, the cost of the arithmetic does not depend on the modulus being
+prime. Pass a parameters file to measure real groups instead.
+
+Run from the repository root: python -m Benchmark.dh_benchmark
+"""
+
+import argparse
+import time
+
+from Cryptodome.Random.random import getrandbits, randrange
+
+from Util import dh
+from Util.group_params import GroupStore, DHGroup
+
+
+def random_group(n_bits: int) -> DHGroup:
+    prime = getrandbits(n_bits) | (1 << (n_bits - 1)) | 1
+    return DHGroup(str(n_bits), prime, 2)
+
+
+def exchanges_per_second(func, seconds: float) -> float:
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        func()
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+def run(groups: list, window: int, seconds: float):
+    print(f"{'group':<10}{'bits':>6}{'table s':>10}{'pow/s':>10}{'table/s':>10}{'speedup':>9}")
+
+    for group in groups:
+        prime, root = group.prime, group.root
+        _, peer_public = dh.generate_keypair(prime, root, cached=False)
+
+        def builtin():
+            secret = randrange(1, prime - 1)
+            pow(root, secret, prime)
+            pow(peer_public, secret, prime)
+
+        start = time.perf_counter()
+        dh.fixed_base_table(prime, root, window)
+        build = time.perf_counter() - start
+
+        def fixed_base():
+            secret, _ = dh.generate_keypair(prime, root, window=window)
+            dh.shared_secret(prime, secret, peer_public)
+
+        baseline = exchanges_per_second(builtin, seconds)
+        optimised = exchanges_per_second(fixed_base, seconds)
+
+        print(f"{group.name:<10}{group.n_bits:>6}{build:>10.2f}{baseline:>10.1f}{optimised:>10.1f}"
+              f"{optimised / baseline:>8.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="dh-benchmark")
+    parser.add_argument("-b", "--bits", type=int, nargs="+", default=[2048, 3072, 4096],
+                        help="Group sizes to measure with random moduli, defaults to 2048 3072 4096")
+    parser.add_argument("-p", "--params", type=str, default=None,
+                        help="Parameters file to take the groups from instead of random moduli")
+    parser.add_argument("-w", "--window", type=int, default=dh.DEFAULT_WINDOW,
+                        help=f"Fixed-base table window in bits, defaults to {dh.DEFAULT_WINDOW}")
+    parser.add_argument("-s", "--seconds", type=float, default=3.0, help="Seconds per measurement, defaults to 3")
+
+    args = parser.parse_args()
+
+    if args.params:
+        groups = list(GroupStore(args.params).groups.values())
+    else:
+        groups = [random_group(n_bits) for n_bits in args.bits]
+
+    run(groups, args.window, args.seconds)
@@ -0,0 +1,153 @@
+"""
+Benchmark of delivering messages to many recipients. Compares sending to a room, where the sender encrypts each message
+once under the room key and the server fans it out, with the sender encrypting and sending a copy per recipient.
+
+Members other than one receiving socket are sessions at addresses nobody listens on, the kernel drops what the server
+sends them. Reports the sender's encryption time per message and the deliveries per second the server achieved,
+measured until the receiving member has every message (it may be served anywhere in the fan-out, so the last message
+is counted as fully delivered).
+
+Run from the repository root: python -m Benchmark.fanout_benchmark
+"""
+
+import argparse
+import os
+import socket
+import tempfile
+import threading
+import time
+
+from Cryptodome.Random import get_random_bytes
+
+from MessageTypes import codec
+from MessageTypes.message import EncryptedMessage
+from Server.server import ThreadedUDPServer, ThreadedUDPHandler, ClientInfo
+
+
+def start_server(db_path: str) -> ThreadedUDPServer:
+    server = ThreadedUDPServer(("localhost", 0), ThreadedUDPHandler, db_path)
+    server.init_db()
+    server.database.close()
+    server.database = None
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def add_members(server: ThreadedUDPServer, members: int, receiver: socket.socket) -> list:
+    """
+    Logs in members sessions directly, the last one at the receiving socket. Returns their usernames.
+    """
+    names = []
+    for i in range(members):
+        address = receiver.getsockname() if i == members - 1 else ("127.0.0.1", 20000 + i)
+        name = f"member{i}"
+        session = ClientInfo(address, username=name)
+        session.wire_format = codec.BINARY
+        server.client_list[address] = session
+        names.append(name)
+    return names
+
+
+def receive(receiver: socket.socket, count: int) -> int:
+    received = 0
+    while received < count:
+        try:
+            receiver.recv(65535)
+        except socket.timeout:
+            break
+        received += 1
+    return received
+
+
+def room(server: ThreadedUDPServer, sender: socket.socket, receiver: socket.socket, members: int, count: int,
+         size: int) -> dict:
+    names = add_members(server, members, receiver)
+
+    # The sender's session, the room and its members are set up without going through the protocol
+    address = sender.getsockname()
+    server.client_list[address] = ClientInfo(address, username="alice")
+    server.rooms.create("bench", "alice")
+    for name in names:
+        server.rooms.invite("bench", "alice", name)
+        server.rooms.join("bench", name)
+    # Members make room keys, the server never has one
+    key = get_random_bytes(32)
+
+    text = "x" * size
+    start = time.perf_counter()
+    encrypt = 0.0
+    for _ in range(count):
+        began = time.perf_counter()
+        frame = codec.encode(EncryptedMessage(key, text, recipient="#bench", sender="alice"))
+        encrypt += time.perf_counter() - began
+        sender.sendto(frame, server.server_address)
+    received = receive(receiver, count)
+    elapsed = time.perf_counter() - start
+
+    return {"encrypt ms": encrypt / count * 1000, "deliveries/s": received * members / elapsed}
+
+
+def per_member(server: ThreadedUDPServer, sender: socket.socket, receiver: socket.socket, members: int, count: int,
+               size: int) -> dict:
+    names = add_members(server, members, receiver)
+    keys = {name: get_random_bytes(32) for name in names}
+
+    # The server only relays for the session the sender field names
+    address = sender.getsockname()
+    server.client_list[address] = ClientInfo(address, username="alice")
+
+    text = "x" * size
+    start = time.perf_counter()
+    encrypt = 0.0
+    for _ in range(count):
+        for name in names:
+            began = time.perf_counter()
+            frame = codec.encode(EncryptedMessage(keys[name], text, recipient=name, sender="alice"))
+            encrypt += time.perf_counter() - began
+            sender.sendto(frame, server.server_address)
+    received = receive(receiver, count)
+    elapsed = time.perf_counter() - start
+
+    return {"encrypt ms": encrypt / count * 1000, "deliveries/s": received * members / elapsed}
+
+
+def run(members: list, count: int, size: int, timeout: float):
+    print(f"{'members':>8}  {'method':<11}{'encrypt ms/msg':>16}{'deliveries/s':>14}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        for method in (room, per_member):
+            for n in members:
+                server = start_server(os.path.join(directory, f"{method.__name__}-{n}.db"))
+                sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sender.bind(("localhost", 0))
+                receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                receiver.bind(("localhost", 0))
+                receiver.settimeout(timeout)
+                try:
+                    result = method(server, sender, receiver, n, count, size)
+                finally:
+                    sender.close()
+                    receiver.close()
+                    server.shutdown()
+                    server.server_close()
+
+                print(f"{n:>8}  {method.__name__:<11}{result['encrypt ms']:>16.3f}{result['deliveries/s']:>14,.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="fanout-benchmark")
+    parser.add_argument("-m", "--members", type=int, nargs="+", default=[100, 1000, 5000],
+                        help="Room sizes, defaults to 100 1000 5000")
+    parser.add_argument("-n", "--count", type=int, default=20, help="Messages per room size, defaults to 20")
+    parser.add_argument("-s", "--size", type=int, default=256, help="Message size in bytes, defaults to 256")
+    parser.add_argument("-t", "--timeout", type=float, default=5.0,
+                        help="Seconds to wait for the receiving member before giving up, defaults to 5")
+
+    args = parser.parse_args()
+
+    # The server reads its parameters relative to its own directory
+    os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "Server"))
+    run(args.members, args.count, args.size, args.timeout)
@@ -0,0 +1,90 @@
+"""
+Benchmark of the client's encrypted message history. Appends messages spread over a number of conversations with
+batched commits and with a commit per message, then times reading the latest page of a conversation, a page from
+deep in its past, streaming the whole conversation (with the peak memory it took, measured with tracemalloc) and
+finding the newest matches of a word.
+
+Run from the repository root: python -m Benchmark.history_benchmark
+"""
+
+import argparse
+import itertools
+import os
+import tempfile
+import time
+import tracemalloc
+
+from Client.history import History
+
+WORDS = ("lunch", "deploy", "meeting", "review", "coffee", "release", "budget", "holiday", "server", "ticket")
+
+
+def fill(history: History, messages: int, peers: int) -> float:
+    start = time.perf_counter()
+    futures = []
+    for i in range(messages):
+        text = f"message {i} about {WORDS[i % len(WORDS)]} and {WORDS[i * 7 % len(WORDS)]}"
+        futures.append(history.append(f"peer{i % peers}", "me" if i % 2 else f"peer{i % peers}", text, 1e9 + i))
+        if len(futures) >= 10000:
+            futures[-1].result()
+            futures.clear()
+    history.flush()
+    return time.perf_counter() - start
+
+
+def timed(func) -> (float, object):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def run(args, directory: str):
+    print(f"{'step':<32}{'time ms':>12}{'rate':>14}{'peak KB':>10}")
+
+    single = History(os.path.join(directory, "single.db"), "passphrase", args.search, batch_size=1)
+    count = min(args.messages, 5000)
+    elapsed = fill(single, count, args.peers)
+    print(f"{'append, commit per message':<32}{elapsed * 1e3:>12.1f}{count / elapsed:>12,.0f}/s")
+    single.close()
+
+    history = History(os.path.join(directory, "history.db"), "passphrase", args.search)
+    elapsed = fill(history, args.messages, args.peers)
+    print(f"{'append, batched':<32}{elapsed * 1e3:>12.1f}{args.messages / elapsed:>12,.0f}/s")
+
+    elapsed, latest = timed(lambda: history.page("peer0", size=50))
+    print(f"{'latest 50':<32}{elapsed * 1e3:>12.2f}")
+
+    # Scroll back half way through the conversation, one page at a time
+    page, pages = latest, args.messages // args.peers // 100
+    start = time.perf_counter()
+    for _ in range(pages):
+        page = history.page("peer0", before=page[0], size=50)
+    print(f"{f'{pages} pages back, per page':<32}{(time.perf_counter() - start) / max(pages, 1) * 1e3:>12.2f}")
+
+    elapsed, streamed = timed(lambda: sum(1 for _ in history.messages("peer0")))
+    # Again to measure memory, tracing slows everything down
+    tracemalloc.start()
+    sum(1 for _ in history.messages("peer0"))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{f'stream {streamed:,} messages':<32}{elapsed * 1e3:>12.1f}{streamed / elapsed:>12,.0f}/s"
+          f"{peak / 1024:>10.0f}")
+
+    if history.search_enabled:
+        elapsed, found = timed(lambda: list(itertools.islice(history.search("lunch"), 50)))
+        print(f"{'search, newest 50':<32}{elapsed * 1e3:>12.2f}")
+        elapsed, found = timed(lambda: list(itertools.islice(history.search("lunch deploy", "peer0"), 50)))
+        print(f"{'search in conversation, 50':<32}{elapsed * 1e3:>12.2f}")
+    history.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="history-benchmark")
+    parser.add_argument("-n", "--messages", type=int, default=200000, help="Messages to append, defaults to 200000")
+    parser.add_argument("-p", "--peers", type=int, default=20, help="Conversations to spread them over, defaults to 20")
+    parser.add_argument("--no-search", dest="search", action="store_false", help="Leave out the word index")
+
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        run(args, directory)
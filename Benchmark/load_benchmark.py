@@ -0,0 +1,393 @@
+"""
+Headless load test of the whole protocol. Starts a server in a child process on a temporary database, then drives
+simulated UDPClient sessions through the same phases a user goes through: key exchange with the server, register,
+login, resuming the session from a new address with the server's ticket, and relaying encrypted messages to a peer.
+Sessions run concurrently on a pool of driver threads.
+
+Every phase reports throughput, p50/p90/p99/max latency and the share of operations that failed or timed out (the
+drop rate). The server's CPU time and peak RSS are sampled from /proc (Linux only) alongside the harness's own.
+Results can be written as JSON and compared against an earlier run, which exits with status 1 if any phase got
+slower by more than the threshold.
+
+Run from the repository root: python -m Benchmark.load_benchmark -n 1000 -o results.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from Cryptodome.Random import get_random_bytes
+
+from Client.client import UDPClient
+from MessageTypes.message import EncryptedMessage
+
+PHASES = ("key_exchange", "register", "login", "resume", "relay")
+
+RESULTS_VERSION = 1
+
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else float("nan")
+
+
+def serve(settings: dict, workers: int):
+    """
+    Entry point of the server process
+    """
+    from Server.server import create_server
+
+    if workers > 1:
+        from Server.supervisor import Supervisor
+
+        Supervisor(workers, settings).run()
+        return
+
+    server = create_server(**settings)
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+class ProcessStats(object):
+    """
+    CPU time and memory of a process and its descendants, read from /proc. Every value is None on other platforms.
+    """
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+        self.peak_rss_kb = None
+
+    def _tree(self) -> list:
+        pids, pending = [], [self.pid]
+        while pending:
+            pid = pending.pop()
+            pids.append(pid)
+            try:
+                for task in os.listdir(f"/proc/{pid}/task"):
+                    with open(f"/proc/{pid}/task/{task}/children") as f:
+                        pending.extend(int(child) for child in f.read().split())
+            except OSError:
+                pass
+        return pids
+
+    def cpu_seconds(self) -> float:
+        total = 0
+        try:
+            for pid in self._tree():
+                with open(f"/proc/{pid}/stat") as f:
+                    # The command name may contain spaces, fields are counted from after its closing parenthesis
+                    fields = f.read().rsplit(")", 1)[1].split()
+                total += int(fields[11]) + int(fields[12])
+        except (OSError, IndexError, ValueError):
+            return None
+        return total / self.ticks
+
+    def rss_kb(self) -> int:
+        total = 0
+        try:
+            for pid in self._tree():
+                with open(f"/proc/{pid}/status") as f:
+                    for line in f:
+                        if line.startswith("VmRSS:"):
+                            total += int(line.split()[1])
+        except (OSError, ValueError):
+            return None
+
+        self.peak_rss_kb = max(self.peak_rss_kb or 0, total)
+        return total
+
+
+class Session(object):
+    """
+    One simulated user, a UDPClient driven without prompts or a receiving thread
+    """
+
+    def __init__(self, host: str, port: int, name: str, timeout: float, reliable: bool):
+        self.name = name
+        self.address = host, port
+        self.reliable = reliable
+        self.timeout = timeout
+        self.client = self.new_client()
+
+    def new_client(self) -> UDPClient:
+        client = UDPClient(*self.address, reliable=self.reliable, exchange_timeout=self.timeout)
+        client.prompt = lambda: (self.name, "password")
+        return client
+
+    def expect(self, reply: str):
+        """
+        Reads until the server sends reply, raises TimeoutError if it does not in time
+        """
+        deadline = time.monotonic() + self.timeout
+        while self.client.receive_single(deadline) != reply:
+            pass
+
+    def key_exchange(self):
+        self.client.keys["root"] = self.client.dh_key_exchange().digest()
+
+    def register(self):
+        self.client.login("register")
+        self.expect("Successfully Registered.")
+
+    def login(self):
+        # Logging in replaces the ticket the registration got
+        self.client.ticket = None
+        self.client.login("login")
+        self.expect("Login Successful.")
+
+    def reconnect(self) -> (bool, float):
+        """
+        Moves the session to a new socket, as after a client restart or NAT rebinding, and resumes it there. Only the
+        resumption is timed.
+        """
+        try:
+            # The ticket follows the login reply
+            deadline = time.monotonic() + self.timeout
+            while self.client.ticket is None:
+                self.client.receive_single(deadline)
+        except (TimeoutError, ValueError):
+            return False, 0.0
+
+        client = self.new_client()
+        client.ticket = self.client.ticket
+        self.client.close()
+        self.client = client
+
+        def resume():
+            key = client.resume()
+            if key is None:
+                raise ValueError("Ticket rejected")
+            client.keys["root"] = key
+
+        return timed(resume)
+
+    def close(self):
+        self.client.close()
+
+
+def timed(func) -> (bool, float):
+    start = time.perf_counter()
+    try:
+        func()
+    except (TimeoutError, ValueError, OSError):
+        return False, time.perf_counter() - start
+    return True, time.perf_counter() - start
+
+
+def relay_pair(sender: Session, receiver: Session, messages: int) -> list:
+    """
+    Sends messages from sender to receiver one at a time, returns (ok, latency) per message
+    """
+    # Peers would agree on a key with a key exchange through the server, the relay phase measures relaying only
+    key = get_random_bytes(32)
+    sender.client.keys[receiver.name] = key
+    receiver.client.keys[sender.name] = key
+
+    results = []
+    for sequence in range(messages):
+        text = f"{sender.name} {sequence}"
+
+        def send_and_receive():
+            sender.client.send_object(EncryptedMessage(key, text, recipient=receiver.name, sender=sender.name,
+                                                       mode=sender.client.cipher_mode))
+            receiver.expect(text)
+
+        results.append(timed(send_and_receive))
+    return results
+
+
+def summarize(results: list, elapsed: float) -> dict:
+    latencies = [latency for ok, latency in results if ok]
+    failed = len(results) - len(latencies)
+    return {
+        "operations": len(results),
+        "failed": failed,
+        "drop_rate": failed / len(results) if results else 0.0,
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p90_ms": percentile(latencies, 0.90) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": max(latencies) * 1000 if latencies else float("nan"),
+        "elapsed_s": elapsed,
+    }
+
+
+def run_phase(name: str, executor: ThreadPoolExecutor, jobs: list, server: ProcessStats) -> dict:
+    cpu = server.cpu_seconds()
+    start = time.perf_counter()
+    results = []
+    for outcome in executor.map(lambda job: job(), jobs):
+        if isinstance(outcome, list):
+            results.extend(outcome)
+        else:
+            results.append(outcome)
+    elapsed = time.perf_counter() - start
+
+    summary = summarize(results, elapsed)
+    after = server.cpu_seconds()
+    summary["server_cpu_s"] = None if cpu is None or after is None else after - cpu
+    summary["server_rss_kb"] = server.rss_kb()
+
+    print(f"{name:<14}{summary['operations']:>8}{summary['throughput']:>12,.0f}{summary['p50_ms']:>10.2f}"
+          f"{summary['p90_ms']:>10.2f}{summary['p99_ms']:>10.2f}{summary['drop_rate']:>9.2%}")
+    return summary
+
+
+def wait_ready(host: str, port: int, timeout: float):
+    """
+    Blocks until the server answers a key exchange
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        with UDPClient(host, port, exchange_timeout=0.5) as probe:
+            try:
+                probe.dh_key_exchange()
+                return
+            except TimeoutError:
+                if time.monotonic() > deadline:
+                    raise TimeoutError("Server did not start")
+
+
+def revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args) -> dict:
+    host = "localhost"
+    directory = tempfile.mkdtemp(prefix="jam-load-")
+    db_path = os.path.join(directory, "users.db")
+    with open("data/schema.sql") as f:
+        connection = sqlite3.connect(db_path)
+        connection.executescript(f.read())
+        connection.close()
+
+    settings = {"engine": args.engine, "server_address": (host, args.port), "db_path": db_path}
+    process = multiprocessing.Process(target=serve, args=(settings, args.workers), name="load-benchmark-server")
+    process.start()
+    server = ProcessStats(process.pid)
+
+    sessions = []
+    phases = {}
+    try:
+        wait_ready(host, args.port, 10.0)
+        sessions = [Session(host, args.port, f"user{i}", args.timeout, args.reliable) for i in range(args.sessions)]
+
+        print(f"{'phase':<14}{'ops':>8}{'ops/s':>12}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'dropped':>9}")
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            phases["key_exchange"] = run_phase("key_exchange", executor,
+                                               [lambda s=s: timed(s.key_exchange) for s in sessions], server)
+            ready = [s for s in sessions if "root" in s.client.keys]
+            phases["register"] = run_phase("register", executor, [lambda s=s: timed(s.register) for s in ready],
+                                           server)
+            phases["login"] = run_phase("login", executor, [lambda s=s: timed(s.login) for s in ready], server)
+            phases["resume"] = run_phase("resume", executor, [s.reconnect for s in ready], server)
+
+            pairs = list(zip(ready[0::2], ready[1::2]))
+            phases["relay"] = run_phase("relay", executor,
+                                        [lambda a=a, b=b: relay_pair(a, b, args.messages) for a, b in pairs], server)
+    finally:
+        for session in sessions:
+            session.close()
+
+        server_cpu = server.cpu_seconds()
+        server.rss_kb()
+        process.terminate()
+        process.join(timeout=10)
+        shutil.rmtree(directory, ignore_errors=True)
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return {
+        "version": RESULTS_VERSION,
+        "timestamp": time.time(),
+        "revision": revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "settings": {key: getattr(args, key) for key in ("engine", "workers", "sessions", "concurrency", "messages",
+                                                           "timeout", "reliable")},
+        "phases": phases,
+        "server": {"cpu_s": server_cpu, "peak_rss_kb": server.peak_rss_kb},
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        "harness": {"cpu_s": usage.ru_utime + usage.ru_stime,
+                    "peak_rss_kb": usage.ru_maxrss // (1024 if sys.platform == "darwin" else 1)},
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    Returns a description of every phase whose throughput dropped, or p99 latency or drop rate rose, by more than
+    threshold (a fraction) compared to baseline
+    """
+    regressions = []
+    for phase in PHASES:
+        new, old = results["phases"].get(phase), baseline.get("phases", {}).get(phase)
+        if not new or not old:
+            continue
+        if old["throughput"] and new["throughput"] < old["throughput"] * (1 - threshold):
+            regressions.append(f"{phase}: throughput {old['throughput']:,.0f} -> {new['throughput']:,.0f} ops/s")
+        if old["p99_ms"] and new["p99_ms"] > old["p99_ms"] * (1 + threshold):
+            regressions.append(f"{phase}: p99 {old['p99_ms']:.2f} -> {new['p99_ms']:.2f} ms")
+        if new["drop_rate"] > old["drop_rate"] + threshold / 10:
+            regressions.append(f"{phase}: drop rate {old['drop_rate']:.2%} -> {new['drop_rate']:.2%}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="load-benchmark")
+    parser.add_argument("-e", "--engine", choices=("threaded", "async"), default="threaded",
+                        help="Server engine, defaults to threaded")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="Server worker processes, defaults to 1")
+    parser.add_argument("-n", "--sessions", type=int, default=1000, help="Simulated sessions, defaults to 1000")
+    parser.add_argument("-c", "--concurrency", type=int, default=64,
+                        help="Sessions driven at the same time, defaults to 64")
+    parser.add_argument("-m", "--messages", type=int, default=10,
+                        help="Messages each sender relays to its peer, defaults to 10")
+    parser.add_argument("-t", "--timeout", type=float, default=5.0,
+                        help="Seconds to wait for a reply before an operation counts as dropped, defaults to 5")
+    parser.add_argument("-r", "--reliable", action="store_true", help="Use reliable delivery for every session")
+    parser.add_argument("-p", "--port", type=int, default=9998, help="Port for the server, defaults to 9998")
+    parser.add_argument("-o", "--output", help="Write the results as JSON to this file")
+    parser.add_argument("-b", "--baseline", help="Compare with the JSON results of an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="Relative change that counts as a regression, defaults to 0.1")
+
+    args = parser.parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+
+    # Server and clients read their parameters relative to the server's directory
+    os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "Server"))
+    results = run(args)
+
+    print(f"server cpu {results['server']['cpu_s']}s, peak rss {results['server']['peak_rss_kb']} kB; "
+          f"harness cpu {results['harness']['cpu_s']:.2f}s, peak rss {results['harness']['peak_rss_kb']} kB")
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if baseline:
+        with open(baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if regressions else 0)
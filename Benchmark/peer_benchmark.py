@@ -0,0 +1,105 @@
+"""
+Benchmark of the event driven client engine. One process and one event loop run a hub client and a number of peer
+clients against an in-process server: all of them log in at once, then the hub sends every peer a message at once,
+each of which starts a key exchange of its own, and every peer answers. Reports how long logging in, the concurrent
+key exchanges with their first deliveries and a second round over established keys took.
+
+Passwords are hashed with cheap PBKDF2 parameters so that logging in hundreds of clients measures the clients rather
+than the KDF.
+
+Run from the repository root: python -m Benchmark.peer_benchmark
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from Benchmark.fanout_benchmark import start_server
+from Client.engine import ClientEngine
+from Server.passwords import PasswordHasher
+
+
+async def login_all(engines: list, timeout: float) -> int:
+    names = [f"peer{i}" for i in range(len(engines) - 1)] + ["hub"]
+    replies = await asyncio.wait_for(asyncio.gather(*[engine.login(name, "password", register=True)
+                                                      for engine, name in zip(engines, names)]), timeout)
+    return sum(reply == "Successfully Registered." for reply in replies)
+
+
+async def exchange(hub: ClientEngine, peers: list, received: dict, timeout: float):
+    """
+    Sends one message from the hub to every peer and waits until every peer's answer is back
+    """
+    received.clear()
+    done = asyncio.get_running_loop().create_future()
+
+    def answered(sender, text, room):
+        received[sender] = text
+        if len(received) == len(peers) and not done.done():
+            done.set_result(None)
+
+    hub.on_message = answered
+    # Peers the hub could not agree a key with are left out of the count
+    await asyncio.gather(*[hub.send(peer.username, "ping") for peer in peers], return_exceptions=True)
+    await asyncio.wait_for(done, timeout)
+
+
+async def run(args, port: int):
+    engines = [ClientEngine("127.0.0.1", port, reliable=args.reliable, handshake_timeout=args.timeout)
+               for _ in range(args.peers + 1)]
+    *peers, hub = engines
+
+    for peer in peers:
+        await peer.start()
+
+        def answer(sender, text, room, peer=peer):
+            if sender == "hub":
+                peer.send(sender, f"pong from {peer.username}")
+        peer.on_message = answer
+    await hub.start()
+
+    received = {}
+    try:
+        start = time.perf_counter()
+        registered = await login_all(engines, args.timeout)
+        logged_in = time.perf_counter() - start
+        print(f"{'login':<12}{registered:>8}{logged_in:>10.2f}s{registered / logged_in:>12,.0f}/s")
+
+        for phase in ("handshakes", "established"):
+            start = time.perf_counter()
+            try:
+                await exchange(hub, peers, received, args.timeout)
+            except asyncio.TimeoutError:
+                pass
+            elapsed = time.perf_counter() - start
+            print(f"{phase:<12}{len(received):>8}{elapsed:>10.2f}s{len(received) / elapsed:>12,.0f}/s")
+    finally:
+        for engine in engines:
+            engine.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="peer-benchmark")
+    parser.add_argument("-n", "--peers", type=int, default=200, help="Peers the hub talks to, defaults to 200")
+    parser.add_argument("-t", "--timeout", type=float, default=30.0,
+                        help="Seconds to wait for each phase before giving up, defaults to 30")
+    parser.add_argument("-r", "--reliable", action="store_true",
+                        help="Acknowledge and retransmit every datagram, bursts of hundreds of key exchanges can "
+                             "overflow socket buffers without")
+
+    args = parser.parse_args()
+
+    # The server and the clients read their parameters relative to the server's directory
+    os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "Server"))
+
+    with tempfile.TemporaryDirectory() as directory:
+        server = start_server(os.path.join(directory, "peers.db"))
+        server.passwords = PasswordHasher("pbkdf2_sha256:iterations=1000", workers=0)
+        try:
+            print(f"{'phase':<12}{'clients':>8}{'time':>11}{'rate':>14}")
+            asyncio.run(run(args, server.server_address[1]))
+        finally:
+            server.shutdown()
+            server.server_close()
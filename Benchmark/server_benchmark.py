@@ -0,0 +1,127 @@
+"""
+Load benchmark for the server engines. Starts each engine on a temporary database, registers a sender and a
+recipient session, then relays numbered messages between them with a bounded number in flight. Reports relayed
+messages per second, p50/p99 latency and the number of datagrams lost.
+
+Run from the repository root: python -m Benchmark.server_benchmark
+"""
+
+import argparse
+import os
+import socket
+import tempfile
+import threading
+import time
+
+from MessageTypes import codec
+from MessageTypes.message import Message
+from Server.admission import Admission, parse_limits
+from Server.async_server import AsyncUDPServer, AsyncUDPHandler
+from Server.server import ThreadedUDPServer, ThreadedUDPHandler, ClientInfo
+
+ENGINES = {
+    "threaded": (ThreadedUDPServer, ThreadedUDPHandler),
+    "async": (AsyncUDPServer, AsyncUDPHandler),
+}
+
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else float("nan")
+
+
+def start_server(engine: str, db_path: str):
+    server_class, handler_class = ENGINES[engine]
+    server = server_class(("localhost", 0), handler_class, db_path)
+    # One sender relaying as fast as it can is exactly what the per-address and per-user limits are there to stop
+    server.admission = Admission(parse_limits(["packets=off", "messages=off"]), max_in_flight=None)
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def relay(server, count: int, window: int, timeout: float) -> dict:
+    """
+    Sends count messages from one session to another through the server, keeping at most window in flight
+    """
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender.bind(("localhost", 0))
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(("localhost", 0))
+    receiver.settimeout(timeout)
+
+    # Register both sessions directly, the benchmark measures relay rather than login
+    address = receiver.getsockname()
+    server.client_list[address] = ClientInfo(address, username="bob")
+    server.client_list[address].wire_format = codec.BINARY
+    server.client_list[sender.getsockname()] = ClientInfo(sender.getsockname(), username="alice")
+
+    frames = [codec.encode(Message(i, "bob", "alice")) for i in range(count)]
+    sent_at = {}
+    latencies = []
+    lost = 0
+    sent = 0
+
+    start = time.perf_counter()
+    while sent < count or sent_at:
+        while sent < count and len(sent_at) < window:
+            sent_at[sent] = time.perf_counter()
+            sender.sendto(frames[sent], server.server_address)
+            sent += 1
+
+        try:
+            data = receiver.recv(65535)
+        except socket.timeout:
+            # Everything still in flight is considered lost
+            lost += len(sent_at)
+            sent_at.clear()
+            continue
+
+        sequence = codec.decode(data).text
+        if sequence in sent_at:
+            latencies.append(time.perf_counter() - sent_at.pop(sequence))
+    elapsed = time.perf_counter() - start
+
+    sender.close()
+    receiver.close()
+
+    return {
+        "msgs/s": len(latencies) / elapsed,
+        "p50 ms": percentile(latencies, 0.50) * 1000,
+        "p99 ms": percentile(latencies, 0.99) * 1000,
+        "lost": lost,
+    }
+
+
+def run(engines: list, count: int, window: int, timeout: float):
+    print(f"{'engine':<10}{'msgs/s':>12}{'p50 ms':>10}{'p99 ms':>10}{'lost':>8}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        for engine in engines:
+            server = start_server(engine, os.path.join(directory, f"{engine}.db"))
+            try:
+                result = relay(server, count, window, timeout)
+            finally:
+                server.shutdown()
+                server.server_close()
+
+            print(f"{engine:<10}{result['msgs/s']:>12,.0f}{result['p50 ms']:>10.2f}{result['p99 ms']:>10.2f}"
+                  f"{result['lost']:>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="server-benchmark")
+    parser.add_argument("-e", "--engine", choices=tuple(ENGINES), action="append",
+                        help="Engine to benchmark, may be repeated, defaults to all engines")
+    parser.add_argument("-n", "--count", type=int, default=20000, help="Messages to relay, defaults to 20000")
+    parser.add_argument("-w", "--window", type=int, default=64, help="Messages in flight, defaults to 64")
+    parser.add_argument("-t", "--timeout", type=float, default=1.0,
+                        help="Seconds without a reply before in flight messages count as lost, defaults to 1")
+
+    args = parser.parse_args()
+
+    # The server reads its parameters relative to its own directory
+    os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "Server"))
+    run(args.engine or list(ENGINES), args.count, args.window, args.timeout)
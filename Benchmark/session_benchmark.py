@@ -0,0 +1,64 @@
+"""
+Benchmark of the session registry at large client populations. Creates sessions for distinct addresses the way the
+server does for every new source address, logs a share of them in, and reports the memory each session takes
+(measured with tracemalloc, so it includes the registry's indexes and the address tuples) and the time per new
+session. With a cap below the number of addresses it also shows that memory stays at the cap.
+
+Run from the repository root: python -m Benchmark.session_benchmark
+"""
+
+import argparse
+import gc
+import time
+import tracemalloc
+
+from Server.server import ClientInfo
+from Server.sessions import SessionRegistry
+
+
+def fill(sessions: int, logged_in: float, max_sessions: int = None) -> dict:
+    registry = SessionRegistry(max_sessions=max_sessions, anonymous_ttl=300.0)
+    every = round(1 / logged_in) if logged_in else 0
+
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    for i in range(sessions):
+        # Distinct source addresses, as a flood from spoofed or many real clients would bring
+        address = (f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}", 1024 + i % 60000)
+        session = registry.get_or_create(address, lambda: ClientInfo(address))
+        if every and i % every == 0:
+            session.key = bytes(32)
+            registry.bind(session, f"user{i}")
+    elapsed = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    stats = registry.stats()
+    return {"held": stats["sessions"], "evicted": stats["evicted"], "bytes": size,
+            "us/session": elapsed / sessions * 1e6}
+
+
+def run(counts: list, logged_in: float, max_sessions: int):
+    print(f"{'addresses':>10}{'cap':>10}{'held':>10}{'evicted':>10}{'MB':>9}{'B/session':>11}{'us/new':>8}")
+    for count in counts:
+        for cap in (None, max_sessions):
+            if cap is not None and cap >= count:
+                continue
+            result = fill(count, logged_in, cap)
+            print(f"{count:>10,}{cap or '-':>10}{result['held']:>10,}{result['evicted']:>10,}"
+                  f"{result['bytes'] / 2 ** 20:>9.1f}{result['bytes'] / result['held']:>11.0f}"
+                  f"{result['us/session']:>8.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="session-benchmark")
+    parser.add_argument("-n", "--sessions", type=int, nargs="+", default=[100000, 1000000],
+                        help="Distinct addresses to create sessions for, defaults to 100000 1000000")
+    parser.add_argument("-l", "--logged-in", type=float, default=0.5,
+                        help="Share of sessions that log in, defaults to 0.5")
+    parser.add_argument("-c", "--cap", type=int, default=250000,
+                        help="Session cap to compare with, defaults to 250000")
+
+    args = parser.parse_args()
+    run(args.sessions, args.logged_in, args.cap)
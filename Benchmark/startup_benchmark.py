@@ -0,0 +1,100 @@
+"""
+Benchmark of cold start. Imports the client and server modules in fresh interpreters and reports the median time, then
+times reading group parameters from a pickle file as older versions wrote them against the binary format of
+Util.group_params, and a first key exchange's keypair with and without building the group's fixed-base table. The
+group has a random odd modulus as in Benchmark.dh_benchmark.
+
+Run from the repository root: python -m Benchmark.startup_benchmark
+"""
+
+import argparse
+import os
+import pickle
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from Benchmark.dh_benchmark import random_group
+from Util import dh
+from Util.group_params import CACHE_SUFFIX, DHGroup, read_groups, write_groups
+
+
+def cold_import(module: str, runs: int) -> float:
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in sys.path if path))
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", f"import {module}"], env=env, check=True)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def best_of(func, runs: int) -> float:
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def parameter_loads(group: DHGroup, runs: int) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        legacy = os.path.join(directory, "legacy.bin")
+        with open(legacy, mode="wb") as file:
+            pickle.dump({"prime": group.prime, "root": group.root}, file)
+        binary = os.path.join(directory, "prime.bin")
+        write_groups(binary, [group])
+
+        def unpickle():
+            with open(legacy, mode="rb") as file:
+                pickle.load(file)
+
+        def convert():
+            # The first read of a pickle file, which writes the converted copy next to it
+            if os.path.exists(legacy + CACHE_SUFFIX):
+                os.remove(legacy + CACHE_SUFFIX)
+            read_groups(legacy)
+
+        return {
+            "unpickle": best_of(unpickle, runs),
+            "convert": best_of(convert, runs),
+            "cached": best_of(lambda: read_groups(legacy), runs),
+            "binary": best_of(lambda: read_groups(binary), runs),
+        }
+
+
+def first_keypair(group: DHGroup, runs: int) -> dict:
+    def with_table():
+        dh._tables.clear()
+        dh.fixed_base_table(group.prime, group.root)
+        dh.generate_keypair(group.prime, group.root)
+
+    return {"table": best_of(with_table, runs),
+            "pow": best_of(lambda: dh.generate_keypair(group.prime, group.root, cached=False), runs)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="startup-benchmark")
+    parser.add_argument("-m", "--modules", nargs="+", default=["Client.api", "Client.client", "Server.server"],
+                        help="Modules to import cold, defaults to Client.api Client.client Server.server")
+    parser.add_argument("-n", "--n_bits", type=int, default=2048, help="Size of the group's modulus, defaults to 2048")
+    parser.add_argument("-r", "--runs", type=int, default=7, help="Runs of every measurement, defaults to 7")
+
+    args = parser.parse_args()
+
+    print(f"{'cold import':<28}{'ms':>10}")
+    for module in args.modules:
+        print(f"{module:<28}{cold_import(module, args.runs) * 1e3:>10.1f}")
+
+    group = random_group(args.n_bits)
+
+    print(f"\n{'group parameters':<28}{'ms':>10}")
+    for name, seconds in parameter_loads(group, args.runs).items():
+        print(f"{name:<28}{seconds * 1e3:>10.3f}")
+
+    print(f"\n{'first keypair':<28}{'ms':>10}")
+    for name, seconds in first_keypair(group, args.runs).items():
+        print(f"{name:<28}{seconds * 1e3:>10.1f}")
@@ -0,0 +1,274 @@
+"""
+Client library for programs talking to a JAM server, such as bots and bridges. Nothing is read from stdin or printed,
+received messages arrive through a callback or by iterating over the client:
+
+    async with Client("localhost", 9999, ticket_path="data/bot_ticket.json") as client:
+        await client.login("bot", "password")
+        await client.send("alice", "Hello")
+        async for message in client:
+            await client.send(message.sender, message.text.upper())
+
+BlockingClient offers the same methods for programs without an event loop of their own. Pass a Client.history.History
+as history to keep every message sent and received on disk instead of in memory.
+"""
+
+import asyncio
+import threading
+from typing import NamedTuple
+
+from Client.tickets import read_ticket, write_ticket
+from Client.engine import ClientEngine, HandshakeError, ROOT
+
+
+class Received(NamedTuple):
+    sender: str
+    text: str
+
+    # "#" + room for messages to a room, None for direct messages and replies from the server
+    room: str = None
+
+
+class LoginError(Exception):
+    """
+    Raised when the server refuses a registration or login, the message is the server's reply
+    """
+
+
+class Client(object):
+    """
+    Asynchronous client, options not listed here are passed on to ClientEngine. With ticket_path the session
+    resumption ticket is kept in that file, connect then picks up the last session without logging in again.
+
+    Received messages are passed to the callback set with on_message if there is one, and queued for iteration
+    otherwise. At most max_received messages are queued, older ones are dropped and counted in dropped. With history
+    every message sent or received is appended to it as well, the client does not close it.
+    """
+
+    def __init__(self, host: str, port: int, ticket_path: str = None, max_received: int = 10000, history=None,
+                 **options):
+        self.engine = ClientEngine(host, port, **options)
+        self.engine.on_message = self._received
+        self.engine.on_error = self._error
+
+        self.ticket_path = ticket_path
+        if ticket_path is not None:
+            self.engine.on_ticket = lambda ticket: write_ticket(ticket_path, (host, port), ticket)
+
+        self.history = history
+
+        self.received = None
+        self.max_received = max_received
+        self.dropped = 0
+
+        self.callback = None
+        self.error_callback = None
+
+        self.connected = False
+        self.resumed = False
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def username(self) -> str:
+        return self.engine.username
+
+    def on_message(self, callback):
+        """
+        Passes every received message to callback(message) instead of queuing it, None queues them again
+        """
+        self.callback = callback
+
+    def on_error(self, callback):
+        """
+        Passes errors that do not belong to a particular call (such as undecryptable messages) to callback(error)
+        """
+        self.error_callback = callback
+
+    def _received(self, sender: str, text: str, room: str = None):
+        message = Received(sender, text, room)
+        if self.history is not None and sender != ROOT:
+            self.history.append(room or sender, sender, text)
+        if self.callback is not None:
+            self.callback(message)
+            return
+
+        if self.received.full():
+            self.received.get_nowait()
+            self.dropped += 1
+        self.received.put_nowait(message)
+
+    def _error(self, error: Exception):
+        if self.error_callback is not None:
+            self.error_callback(error)
+
+    async def connect(self):
+        """
+        Opens the socket and agrees a key with the server, resuming the stored session instead if there is one
+        (resumed is set if so, the client is then logged in as that session's user)
+        """
+        if self.connected:
+            return
+        self.received = asyncio.Queue(self.max_received)
+        await self.engine.start()
+        self.connected = True
+
+        ticket = None
+        if self.ticket_path is not None:
+            ticket = read_ticket(self.ticket_path, self.engine.address)
+        self.resumed = ticket is not None and await self.engine.resume(ticket)
+        if not self.resumed:
+            await self.engine.key_for(ROOT)
+
+    async def register(self, username: str, password: str):
+        """
+        Registers a new user, which also logs it in. Raises LoginError if the server refuses.
+        """
+        reply = await self.engine.login(username, password, register=True)
+        if reply != "Successfully Registered.":
+            raise LoginError(reply)
+
+    async def login(self, username: str, password: str):
+        """
+        Logs in, raises LoginError if the server refuses
+        """
+        reply = await self.engine.login(username, password)
+        if reply != "Login Successful.":
+            raise LoginError(reply)
+
+    async def send(self, recipient: str, text: str):
+        """
+        Sends text to a user or to "#" + room, waiting for a key exchange with the user first if there is no key.
+        Raises HandshakeError if no key could be agreed.
+        """
+        await self.engine.send(recipient, text)
+        if self.history is not None:
+            self.history.append(recipient, self.username, text)
+
+    async def send_many(self, messages: list):
+        """
+        Sends a list of (recipient, text) pairs, several per datagram where they fit
+        """
+        messages = list(messages)
+        await self.engine.send_many(messages)
+        if self.history is not None:
+            for recipient, text in messages:
+                self.history.append(recipient, self.username, text)
+
+    def create(self, room: str):
+        self.engine.room_request("create", room)
+
+    def join(self, room: str):
+        self.engine.room_request("join", room)
+
+    def invite(self, room: str, username: str):
+        self.engine.room_request("invite", room, username)
+
+    def leave(self, room: str):
+        self.engine.room_request("leave", room)
+
+    async def receive(self) -> Received:
+        """
+        Waits for the next received message
+        """
+        return await self.received.get()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Received:
+        return await self.received.get()
+
+    def close(self):
+        self.engine.close()
+        self.connected = False
+
+
+class BlockingClient(object):
+    """
+    Client for programs without an event loop, runs one in a background thread. Methods block until done, callbacks
+    are called from the loop's thread and must not block.
+    """
+
+    def __init__(self, host: str, port: int, timeout: float = 30.0, **options):
+        self.timeout = timeout
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="client-loop")
+        self._thread.daemon = True
+        self._thread.start()
+
+        self.client = self._call_soon(lambda: Client(host, port, **options))
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _run(self, coroutine, timeout: float = None):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(timeout)
+
+    def _call_soon(self, func, *args):
+        async def call():
+            return func(*args)
+        return self._run(call(), self.timeout)
+
+    @property
+    def username(self) -> str:
+        return self.client.username
+
+    @property
+    def resumed(self) -> bool:
+        return self.client.resumed
+
+    def on_message(self, callback):
+        self.client.on_message(callback)
+
+    def on_error(self, callback):
+        self.client.on_error(callback)
+
+    def connect(self):
+        self._run(self.client.connect(), self.timeout)
+
+    def register(self, username: str, password: str):
+        self._run(self.client.register(username, password), self.timeout)
+
+    def login(self, username: str, password: str):
+        self._run(self.client.login(username, password), self.timeout)
+
+    def send(self, recipient: str, text: str):
+        self._run(self.client.send(recipient, text), self.timeout)
+
+    def send_many(self, messages: list):
+        self._run(self.client.send_many(messages), self.timeout)
+
+    def create(self, room: str):
+        self._call_soon(self.client.create, room)
+
+    def join(self, room: str):
+        self._call_soon(self.client.join, room)
+
+    def invite(self, room: str, username: str):
+        self._call_soon(self.client.invite, room, username)
+
+    def leave(self, room: str):
+        self._call_soon(self.client.leave, room)
+
+    def receive(self, timeout: float = None) -> Received:
+        """
+        Waits for the next received message, raises TimeoutError if none arrives within timeout seconds
+        """
+        if timeout is None:
+            return self._run(self.client.receive())
+        return self._run(asyncio.wait_for(self.client.receive(), timeout))
+
+    def close(self):
+        self._call_soon(self.client.close)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
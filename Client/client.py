@@ -1,12 +1,19 @@
+import collections
+import queue
+import select
 import socket
 import threading
+import time
 
-import yaml
 from Cryptodome.Hash import SHA3_256
-from Cryptodome.Random.random import randrange
+from Cryptodome.Random import get_random_bytes
 
-from MessageTypes.message import EncryptedMessage, KeyExchangeMessage, LoginMessage, RegisterMessage, Message
-from Util.prime_helper import PrimeHelper
+from Client.tickets import keep_ticket, read_ticket, resume_request, resumed, write_ticket
+from MessageTypes import codec, framing, reliability
+from MessageTypes.message import EncryptedMessage, KeyExchangeMessage, LoginMessage, RegisterMessage, RoomMessage, \
+    ResumeMessage, Message, EAX
+from Util import dh, startup
+from Util.group_params import load_groups
 
 
 # TODO: Make sure to replace prime.bin with larger prime
@@ -14,31 +21,75 @@ from Util.prime_helper import PrimeHelper
 
 class UDPClient(object):
     """
-    Connect to Server, send/receive data
+    Connect to Server, send/receive data. Blocks during key exchanges and runs one at a time, see
+    Client.engine.ClientEngine for a client that talks to many peers at once.
     """
 
-    def __init__(self, host: str, port: int):
+    def __init__(self, host: str, port: int, group: str = None, cipher_mode: str = EAX,
+                 compress_threshold: int = None, reliable: bool = False, exchange_timeout: float = 10.0,
+                 ticket_path: str = None, history=None):
         self.host = host
         self.port = port
 
         # setup socket to send and receive data
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sock.bind(("localhost", 0))  # bind socket to local host and any available port
+        startup.mark("socket")
 
-        # read prime for use in key exchange
+        # read group parameters for use in key exchange, defaults to the file's default group
         self.prime_dump = "data/prime.bin"
-        self.helper = PrimeHelper(self.prime_dump)
-        self.helper.read()
+        self.groups = load_groups(self.prime_dump)
+        self.group = self.groups.get(group)
+        startup.mark("group parameters")
 
-        # setup event to pause receiving thread during key exchange
-        self.wait = threading.Event()
-        self.exchange = False
+        # Name of the peer a key exchange or resumption in progress is with, one runs at a time
+        self.exchange = None
+        self._exchanging = threading.Lock()
+
+        # Once receive_forever owns the socket it hands replies to a key exchange in progress through this queue
+        self.receiving = False
+        self.replies = queue.Queue()
 
         self.keys = {}
 
+        # Messages to a room that arrived before its key, held per room until it does
+        self.held = {}
+
+        # Start out speaking YAML, switch to the binary codec once the server shows it understands it
+        self.formats = (codec.BINARY, codec.YAML)
+        self.wire_format = codec.YAML
+
+        # AEAD mode for outgoing messages, see MessageTypes.message.MODES
+        self.cipher_mode = cipher_mode
+
+        # Texts at least this long are compressed before encryption, None turns compression off
+        self.compress_threshold = compress_threshold
+
+        # Messages larger than one datagram are split on the way out and put back together on the way in
+        self.fragmenter = framing.Fragmenter()
+        self.reassembler = framing.Reassembler()
+
+        # Optionally have every datagram acknowledged and retransmitted until it is
+        self.reliability = None
+        if reliable:
+            self.reliability = reliability.ReliableEndpoint(self.sock.sendto)
+            self.reliability.start()
+
+        # Seconds to wait for the other side of a key exchange before giving up
+        self.exchange_timeout = exchange_timeout
+
         self.recipient = "root"
         self.username = None
 
+        # Resumption ticket from the server as (identifier, secret, username), kept in ticket_path if specified so
+        # that the session survives a restart of the client
+        self.ticket_path = ticket_path
+        self.ticket = self.load_ticket()
+        startup.mark("client state and ticket")
+
+        # Client.history.History keeping the messages sent and received, None keeps nothing
+        self.history = history
+
     # functions to allow with ... as ... paradigm
     def __enter__(self):
         return self
@@ -57,18 +108,97 @@ class UDPClient(object):
     def hash_password(password):
         return SHA3_256.new(password)
 
-    @staticmethod
-    def format(msg: bytes) -> (str, object):
+    def format(self, msg: bytes) -> (str, object):
         """
         Decrypts and decodes encrypted messages, decodes non-encrypted messages
         """
-        obj = yaml.load(msg)
+        if codec.is_binary(msg) and codec.BINARY in self.formats:
+            self.wire_format = codec.BINARY
+
+        obj = codec.decode(msg)
 
         if type(obj) is EncryptedMessage:
-            return obj.decrypt()
+            # Messages to a room may arrive before another member sent its key
+            if obj.recipient is not None and obj.recipient.startswith("#") and obj.recipient not in self.keys:
+                self.held.setdefault(obj.recipient, collections.deque(maxlen=256)).append(obj)
+                return None
+            return self.read_encrypted(obj)
+        elif type(obj) is RoomMessage:
+            return self.receive_room(obj)
+        elif type(obj) is ResumeMessage and obj.request == "ticket":
+            codec.attach_key(obj, self.keys.get("root"))
+            self.store_ticket(keep_ticket(obj.ticket.decrypt(), self.keys["root"], obj.recipient))
+            return None
         else:
             return obj
 
+    def read_encrypted(self, obj: EncryptedMessage) -> str:
+        """
+        Decrypts a message and keeps it in the history. Binary frames do not carry keys, messages without a sender
+        come from the server and messages to a room are encrypted under the room's key.
+        """
+        if obj.recipient is not None and obj.recipient.startswith("#"):
+            codec.attach_key(obj, self.keys.get(obj.recipient))
+            peer = obj.recipient
+        else:
+            codec.attach_key(obj, self.keys.get(obj.sender or "root"))
+            peer = obj.sender
+        text = obj.decrypt()
+        if self.history is not None and peer is not None:
+            self.history.append(peer, obj.sender, text)
+        return text
+
+    def receive_room(self, obj: RoomMessage) -> str:
+        """
+        Handles the server's answers to room requests and room keys from other members, see RoomMessage. Sending a key
+        may need a key exchange first, which waits for replies, so it runs in a thread of its own.
+        """
+        room = "#" + obj.room
+        if obj.request == "key" and obj.sender is not None:
+            codec.attach_key(obj, self.keys.get(obj.sender))
+            return self.set_room_key(room, bytes.fromhex(obj.room_key.decrypt()))
+        elif obj.request == "rekey":
+            text = self.set_room_key(room, get_random_bytes(32))
+            members = [member for member in (obj.text or "").split("\0") if member]
+        elif obj.request == "share":
+            # Only members hold a key, a member whose own key has not arrived yet has nothing to share
+            text, members = None, [obj.text] if obj.text and room in self.keys else []
+        else:
+            return f"{room}: {obj.text}"
+
+        if members:
+            sender = threading.Thread(target=self.share_room_key, args=(room, members))
+            sender.daemon = True
+            sender.start()
+        return text
+
+    def set_room_key(self, room: str, key: bytes) -> str:
+        joined = room not in self.keys
+        self.keys[room] = key
+
+        lines = [f"Joined {room}" if joined else f"New key for {room}"]
+        for obj in self.held.pop(room, ()):
+            try:
+                lines.append(self.read_encrypted(obj))
+            except ValueError as e:  # Sent under an older key
+                lines.append(f"Dropped a message to {room}: {e}")
+        return "\n".join(lines)
+
+    def share_room_key(self, room: str, members: list):
+        """
+        Sends our key for room to every one of members, encrypted under the key we share with each
+        """
+        for member in members:
+            try:
+                if member not in self.keys:
+                    self.keys[member] = self.dh_key_exchange(peer=member).digest()
+            except (TimeoutError, ValueError) as e:
+                print(f"Could not send the key for {room} to {member}: {e}")
+                continue
+            if room in self.keys:
+                room_key = EncryptedMessage(self.keys[member], self.keys[room].hex(), mode=self.cipher_mode)
+                self.send_object(RoomMessage("key", room[1:], room_key, recipient=member, sender=self.username))
+
     @staticmethod
     def prompt():
         print("Enter Username")
@@ -79,63 +209,172 @@ class UDPClient(object):
 
         return username, password
 
-    def dh_key_exchange(self, received: KeyExchangeMessage = None) -> SHA3_256:
+    def load_ticket(self) -> tuple:
+        if self.ticket_path is None:
+            return None
+        return read_ticket(self.ticket_path, (self.host, self.port))
+
+    def store_ticket(self, ticket: tuple):
+        """
+        Keeps a ticket the server issued, see Client.tickets.keep_ticket
+        """
+        self.ticket = ticket
+        if self.ticket_path is not None:
+            write_ticket(self.ticket_path, (self.host, self.port), self.ticket)
+
+    def connect(self) -> bytes:
+        """
+        Establishes the key shared with the server, resuming the previous session if there is a ticket for it and
+        falling back to a key exchange otherwise
+        """
+        key = self.resume() if self.ticket is not None else None
+        if key is None:
+            key = self.dh_key_exchange().digest()
+        self.keys["root"] = key
+        return key
+
+    def resume(self) -> bytes:
+        """
+        Presents the resumption ticket to the server, one round trip instead of a key exchange. Returns the new
+        session key, or None if the server no longer accepts the ticket.
+        """
+        ticket = self.ticket
+        self.ticket = None  # Tickets can be used once
+        request, nonce = resume_request(ticket)
+
+        # Tickets are only issued to clients speaking the binary codec, resume in it to pick up where the session was
+        self.wire_format = codec.BINARY
+
+        with self._exchanging:
+            while not self.replies.empty():
+                self.replies.get_nowait()
+            self.exchange = "root"
+            self.send_object(request)
+
+            deadline = time.monotonic() + self.exchange_timeout
+            try:
+                response = self.receive_single(deadline)
+                while type(response) is not ResumeMessage:
+                    response = self.receive_single(deadline)
+            finally:
+                self.exchange = None
+
+        accepted = resumed(response, ticket, nonce)
+        if accepted is None:
+            return None
+
+        key, next_ticket = accepted
+        self.store_ticket(next_ticket)
+        self.username = next_ticket[2]
+        return key
+
+    def dh_key_exchange(self, received: KeyExchangeMessage = None, peer: str = None) -> SHA3_256:
         """
         Facilitates both sides of a basic Diffie-Hellman key exchange and generates a shared secret, the hash of this
-        secret is returned to be used as a key for the cipher
+        secret is returned to be used as a key for the cipher. Requests go to peer, the current recipient unless
+        specified.
         """
 
         # TODO: Fix key exchange. Probably by keeping a key for every other user.
         if not received:
-            secret = randrange(1, self.helper.prime)  # Random integer between 1 and prime - 1: to be kept secret
-
-            public = (self.helper.root ** secret) % self.helper.prime  # Public part, shared in the clear
-
-            # Send public information
-            self.exchange = True
-            self.send_yaml(KeyExchangeMessage("Request Key Exchange", self.helper.prime, self.helper.root, public,
-                                              self.recipient, self.username))
-
-            # response = yaml.load(self.receive_single()).text
-            response = self.receive_single().text
-
-            self.exchange = False
-            self.wait.set()
+            peer = peer or self.recipient
+            secret, public = dh.generate_keypair(self.group.prime, self.group.root)  # Public part, shared in the clear
+
+            with self._exchanging:
+                # Send public information
+                while not self.replies.empty():
+                    self.replies.get_nowait()
+                self.exchange = peer
+                self.send_object(KeyExchangeMessage("Request Key Exchange", self.group.prime, self.group.root, public,
+                                                    peer, self.username, self.formats))
+
+                # Skip the "Key Exchange Accepted" notice, the public part follows it
+                deadline = time.monotonic() + self.exchange_timeout
+                try:
+                    response = self.receive_single(deadline)
+                    while type(response) is KeyExchangeMessage:
+                        if response.request == "Key Exchange Rejected":
+                            raise ValueError(f"{peer} does not accept group {self.group.name}")
+                        response = self.receive_single(deadline)
+                    response = response.text
+                finally:
+                    self.exchange = None
 
             # Calculate and return shared secret
-            return SHA3_256.new(self.int_to_bytes((response ** secret) % self.helper.prime))
+            return SHA3_256.new(self.int_to_bytes(dh.shared_secret(self.group.prime, secret, response)))
         else:
-            self.send_yaml(KeyExchangeMessage("Key Exchange Accepted", recipient=self.recipient, sender=self.username))
+            try:
+                group = dh.accept_request(self.groups, received.prime, received.root, received.public)
+            except ValueError:
+                self.send_object(KeyExchangeMessage("Key Exchange Rejected", recipient=received.sender,
+                                                    sender=self.username))
+                raise
 
-            secret = randrange(1, received.prime)  # Random integer between 1 and prime - 1: to be kept secret
+            self.send_object(KeyExchangeMessage("Key Exchange Accepted", recipient=received.sender,
+                                                sender=self.username))
 
-            public = (received.root ** secret) % received.prime  # Public part, shared in the clear
+            secret, public = dh.generate_keypair(group.prime, group.root)  # Public part, shared in the clear
 
-            self.send_yaml(Message(public, self.recipient, self.username))  # Send public information
+            self.send_object(Message(public, received.sender, self.username))  # Send public information
 
             # Calculate and return shared secret
-            return SHA3_256.new(self.int_to_bytes((received.public ** secret) % self.helper.prime))
+            return SHA3_256.new(self.int_to_bytes(dh.shared_secret(group.prime, secret, received.public)))
 
-    def send_message(self, msg: str):
+    def send_message(self, msg: str or bytes):
         """
         Sends encoded message to connected server
         """
-        self.sock.sendto(bytes(msg, "utf-8"), (self.host, self.port))
+        if isinstance(msg, str):
+            msg = bytes(msg, "utf-8")
+        for datagram in self.fragmenter.fragment(msg):
+            if self.reliability is not None:
+                self.reliability.send(datagram, (self.host, self.port))
+            else:
+                self.sock.sendto(datagram, (self.host, self.port))
+
+    def send_object(self, obj: object):
+        """
+        Encodes obj with the negotiated wire format and sends it to connected server
+        """
+        self.send_message(codec.encode(obj, self.wire_format))
 
     def send_yaml(self, obj: object):
+        import yaml
+
         self.send_message(yaml.dump(obj))
 
     def send_many(self, *args):
         """
         Encodes tuple then sends to connected server
         """
-        self.sock.sendto(bytes(yaml.dump(args), "utf-8"), (self.host, self.port))
+        import yaml
+
+        self.send_message(yaml.dump(args))
 
     def send_encrypted_message(self, msg: str):
         """
         Encrypts and sends message if key is established or begins key exchange if no key exists
         """
-        if self.recipient not in self.keys:
+        command = msg.split(" ", 1)[0]
+        if command in ("~create", "~join", "~leave"):
+            if command == "~leave":
+                self.keys.pop("#" + msg[len(command) + 1:], None)
+            self.send_object(RoomMessage(command[1:], msg[len(command) + 1:], sender=self.username))
+            return
+        if command == "~invite":
+            # ~invite room username
+            room, _, username = msg[len(command) + 1:].partition(" ")
+            self.send_object(RoomMessage("invite", room, text=username, sender=self.username))
+            return
+
+        if self.recipient.startswith("#"):
+            # Room keys come from another member after joining, there is nobody to exchange keys with
+            if self.recipient not in self.keys and not msg.startswith("~"):
+                print(f"Not a member of {self.recipient}, ~join {self.recipient[1:]} first")
+                return
+        elif self.recipient == "root" and "root" not in self.keys:
+            self.connect()
+        elif self.recipient not in self.keys:
             self.keys[self.recipient] = self.dh_key_exchange().digest()
 
         if msg.startswith("~"):
@@ -144,39 +383,99 @@ class UDPClient(object):
             elif msg.startswith("~set"):
                 self.recipient = msg[5:]
         else:
-            self.send_message(yaml.dump(EncryptedMessage(self.keys[self.recipient], msg, recipient=self.recipient,
-                                                         sender=self.username)))
+            self.send_object(EncryptedMessage(self.keys[self.recipient], msg, recipient=self.recipient,
+                                              sender=self.username, mode=self.cipher_mode,
+                                              compress_threshold=self.compress_threshold))
+            if self.history is not None and self.recipient != "root":
+                self.history.append(self.recipient, self.username, msg)
 
     def login(self, msg):
         self.username, password = self.prompt()
         hashed = SHA3_256.new(bytes(password, "utf-8")).hexdigest()
 
         if msg == "login":
-            self.send_yaml(LoginMessage(self.keys[self.recipient], self.username, hashed, sender=self.username))
+            self.send_object(LoginMessage(self.keys[self.recipient], self.username, hashed, sender=self.username,
+                                          mode=self.cipher_mode))
         elif msg == "register":
-            self.send_yaml(RegisterMessage(self.keys[self.recipient], self.username, hashed, sender=self.username))
+            self.send_object(RegisterMessage(self.keys[self.recipient], self.username, hashed, sender=self.username,
+                                             mode=self.cipher_mode))
 
-    def receive_single(self):
+    def receive_single(self, deadline: float = None):
         """
-        Blocks until a message is received on the socket, returns decoded text
+        Blocks until a message is received on the socket, returns decoded text. If deadline (a time.monotonic value)
+        is specified raises TimeoutError once it passes.
         """
-        return self.format(self.sock.recv(1024))
+        if not self.receiving:
+            return self.format(self.receive_raw(deadline))
+
+        # Another thread is reading the socket, wait for it to pass the reply on
+        try:
+            return self.replies.get(timeout=None if deadline is None else max(deadline - time.monotonic(), 0))
+        except queue.Empty:
+            raise TimeoutError("Timed out waiting for a reply")
 
-    def receive_forever(self, event):
+    def receive_raw(self, deadline: float = None) -> bytes:
+        """
+        Blocks until a whole message is received, collecting fragments if it was split and acknowledging it if it was
+        sent reliably
+        """
+        while True:
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not select.select([self.sock], [], [], remaining)[0]:
+                    raise TimeoutError("Timed out waiting for a reply")
+
+            data, address = self.sock.recvfrom(framing.RECEIVE_SIZE)
+            try:
+                if self.reliability is not None:
+                    data = self.reliability.receive(data, address)
+                if data is not None:
+                    data = self.reassembler.feed(address, data)
+            except ValueError as e:  # FramingError or ReliabilityError
+                print(f"Dropped malformed datagram from {address}: {e}")
+                continue
+            if data is not None:
+                return data
+
+    def exchange_reply(self, obj) -> bool:
+        """
+        Whether obj answers the key exchange or resumption in progress: a key exchange message or public part from
+        whoever it is with, or the server's answer to a resumption
+        """
+        if type(obj) in (KeyExchangeMessage, Message):
+            return obj.sender in (None, self.exchange)
+        return type(obj) is ResumeMessage
+
+    def receive_forever(self):
         """
         Prints data received from Server. To be run in a separate
         daemon thread.
         """
+        self.receiving = True
         while True:
-            received = self.format(self.sock.recv(1024))
-
-            if self.exchange:
-                event.wait()
+            data = self.receive_raw()
+            try:
+                received = self.format(data)
+            except (ValueError, TypeError) as e:  # Malformed, or encrypted under a key we do not have
+                print(f"Dropped a message that failed to decode: {e}")
+                continue
+            if received is None:
+                continue  # Handled entirely by format, such as a resumption ticket
+
+            # Only replies go to the exchange waiting for them, anything else arriving meanwhile is shown as usual
+            if self.exchange and self.exchange_reply(received):
+                self.replies.put(received)
+                continue
 
             if type(received) == KeyExchangeMessage:
                 if received.request == "Request Key Exchange":
-                    self.recipient = received.sender
-                    self.keys[self.recipient] = self.dh_key_exchange(received).digest()
+                    # Switching now would pull the exchange in progress over to the requester
+                    if not self.exchange:
+                        self.recipient = received.sender
+                    try:
+                        self.keys[received.sender] = self.dh_key_exchange(received).digest()
+                    except ValueError as e:
+                        print(f"Refused key exchange from {received.sender}: {e}")
                 elif received.request == "Key Exchange Accepted":
                     continue
             else:
@@ -186,16 +485,49 @@ class UDPClient(object):
         """
         Shuts down client gracefully, usually called from the __exit__ method
         """
+        if self.history is not None:
+            self.history.flush()
+        if self.reliability is not None:
+            self.reliability.close()
         self.sock.close()
 
 
 if __name__ == "__main__":
+    # Imported here rather than at the top, programs using the client as a library have no command line to parse
+    import argparse
+
     HOST, PORT = "localhost", 9999
 
-    with UDPClient(HOST, PORT) as client:
-        receive_thread = threading.Thread(target=client.receive_forever, args=(client.wait,))
+    parser = argparse.ArgumentParser(prog="client")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="Report how long importing each module and every initialization step took")
+    parser.add_argument("--history", type=str, default=None,
+                        help="Keep messages in this encrypted database, e.g. data/history.db, asks for its passphrase")
+    parser.add_argument("--search", action="store_true", help="Index the words of kept messages for searching")
+    args = parser.parse_args()
+
+    if args.profile_startup:
+        startup.report_imports("Client.client")
+        startup.begin()
+
+    history = None
+    if args.history:
+        from getpass import getpass
+
+        from Client.history import History
+
+        history = History(args.history, getpass("History passphrase: "), search=args.search)
+
+    with UDPClient(HOST, PORT, ticket_path="data/ticket.json", history=history) as client:
+        if args.profile_startup:
+            startup.report_init()
+
+        receive_thread = threading.Thread(target=client.receive_forever)
         receive_thread.daemon = True
         receive_thread.start()
 
         while True:
-            client.send_encrypted_message(input("=> "))
+            try:
+                client.send_encrypted_message(input("=> "))
+            except (TimeoutError, ValueError) as e:
+                print(f"Key exchange failed: {e}")
@@ -0,0 +1,583 @@
+"""
+Event driven client core on asyncio. One socket and one event loop carry every conversation: key exchanges with the
+server and with any number of peers run at the same time, each tracked by its own handshake state machine, and
+messages to a peer whose key is still being negotiated wait in that peer's outbound queue until the handshake ends.
+
+Handshake states of a peer (the server is the peer "root"):
+
+    IDLE --send request--> REQUESTED --public part received--> ESTABLISHED
+    IDLE --request received--> ANSWERING --public part sent--> ESTABLISHED
+
+A request from a peer we are waiting on ourselves (both sides started at once) is settled by name, the side with the
+smaller username keeps its request and the other answers it. A handshake that does not finish within the timeout
+fails the messages queued for it and returns to IDLE, the next send starts over.
+
+The protocol is the one UDPClient speaks, so engine clients and UDPClients can talk to each other.
+"""
+
+import asyncio
+import collections
+import socket
+
+from Cryptodome.Hash import SHA3_256
+from Cryptodome.Random import get_random_bytes
+
+from Client import tickets
+from MessageTypes import codec, framing, reliability
+from MessageTypes.message import EncryptedMessage, KeyExchangeMessage, LoginMessage, RegisterMessage, RoomMessage, \
+    ResumeMessage, BatchMessage, Message, EAX
+from Util import dh
+from Util.group_params import load_groups
+
+ROOT = "root"
+
+# Handshake states
+IDLE = "idle"
+REQUESTED = "requested"
+ANSWERING = "answering"
+ESTABLISHED = "established"
+
+
+class HandshakeError(Exception):
+    """
+    Raised to senders whose messages could not be sent because no key could be agreed with the recipient
+    """
+
+
+class Peer(object):
+    """
+    Handshake state, key and queued outbound messages of one conversation
+    """
+
+    __slots__ = ("name", "state", "key", "secret", "attempt", "timer", "waiters", "outbox")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = IDLE
+        self.key = None
+
+        # Our secret exponent while a request we sent is outstanding
+        self.secret = None
+
+        # Bumped whenever a handshake starts or is abandoned, work finishing for an older attempt is discarded
+        self.attempt = 0
+        self.timer = None
+
+        # Futures waiting for the key, and (text, future) pairs waiting to be encrypted under it
+        self.waiters = []
+        self.outbox = collections.deque()
+
+
+class ClientProtocol(asyncio.DatagramProtocol):
+    def __init__(self, engine):
+        self.engine = engine
+
+    def datagram_received(self, data: bytes, address: tuple):
+        self.engine.datagram_received(data, address)
+
+    def error_received(self, exc: Exception):
+        self.engine.report(exc)
+
+
+class ClientEngine(object):
+    """
+    Client for one server, driven by the running event loop. Call start before anything else and close when done.
+
+    Received messages are passed to on_message(sender, text, room), room is None for direct messages and replies
+    from the server come from "root". Problems that do not belong to a particular send (undecryptable messages,
+    failed handshakes started by peers) are passed to on_error. Both default to printing.
+    """
+
+    def __init__(self, host: str, port: int, group: str = None, cipher_mode: str = EAX,
+                 compress_threshold: int = None, reliable: bool = False, handshake_timeout: float = 10.0,
+                 max_queued: int = 1024, receive_buffer: int = 4 * 1024 * 1024,
+                 params_path: str = "data/prime.bin"):
+        self.address = host, port
+
+        self.groups = load_groups(params_path)
+        self.group = self.groups.get(group)
+
+        self.cipher_mode = cipher_mode
+        self.compress_threshold = compress_threshold
+        self.handshake_timeout = handshake_timeout
+
+        # Messages queued per peer while its handshake is in progress, sends beyond that fail right away
+        self.max_queued = max_queued
+
+        self.formats = (codec.BINARY, codec.YAML)
+        self.wire_format = codec.YAML
+
+        self.fragmenter = framing.Fragmenter()
+        self.reassembler = framing.Reassembler()
+        self.reliable = reliable
+        self.reliability = None
+
+        self.peers = {}
+        self.room_keys = {}
+
+        # Messages to a room that arrived before its key, at most max_queued per room
+        self.held = {}
+        self.username = None
+
+        # Latest resumption ticket from the server as (identifier, secret, username), passed to on_ticket as well
+        self.ticket = None
+        self.on_ticket = None
+        self._resuming = None
+
+        # Futures waiting for the server's answer to a login or registration, oldest first
+        self._replies = collections.deque()
+
+        self.on_message = None
+        self.on_error = None
+
+        # Answers to a burst of key exchanges arrive together and can outpace the loop, the kernel caps the size at
+        # net.core.rmem_max
+        self.receive_buffer = receive_buffer
+
+        self.loop = None
+        self.transport = None
+
+        # The loop only keeps weak references to tasks, handshakes in flight are kept here until they finish
+        self._tasks = set()
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.transport, _ = await self.loop.create_datagram_endpoint(lambda: ClientProtocol(self),
+                                                                     local_addr=("localhost", 0))
+        if self.receive_buffer:
+            sock = self.transport.get_extra_info("socket")
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.receive_buffer)
+        if self.reliable:
+            # The endpoint retransmits from its own thread, transports may only be used from the loop's
+            self.reliability = reliability.ReliableEndpoint(
+                lambda data, address: self.loop.call_soon_threadsafe(self.transport.sendto, data, address))
+            self.reliability.start()
+
+    def close(self):
+        error = HandshakeError("Client closed")
+        for peer in self.peers.values():
+            if peer.timer is not None:
+                peer.timer.cancel()
+            for future in peer.waiters + [future for _, future in peer.outbox]:
+                if not future.done():
+                    future.set_exception(error)
+        for task in self._tasks:
+            task.cancel()
+        if self.reliability is not None:
+            self.reliability.close()
+        if self.transport is not None:
+            self.transport.close()
+
+    def report(self, error: Exception):
+        if self.on_error is not None:
+            self.on_error(error)
+        else:
+            print(f"Client error: {error}")
+
+    def _spawn(self, coroutine):
+        task = self.loop.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._finished)
+
+    def _finished(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self.report(task.exception())
+
+    def deliver(self, sender: str, text: str, room: str = None):
+        if self.on_message is not None:
+            self.on_message(sender, text, room)
+        else:
+            print(f"{room}/{sender}: {text}" if room else f"{sender}: {text}")
+
+    # Sending
+
+    def send_object(self, obj: Message):
+        """
+        Encodes obj with the negotiated wire format and sends it to the server
+        """
+        self.send_payload(codec.encode(obj, self.wire_format))
+
+    def send_payload(self, payload: bytes):
+        for datagram in self.fragmenter.fragment(payload):
+            if self.reliability is not None:
+                self.reliability.send(datagram, self.address)
+            else:
+                self.transport.sendto(datagram, self.address)
+
+    def _send_text(self, recipient: str, key: bytes, text: str):
+        self.send_object(EncryptedMessage(key, text, recipient=recipient, sender=self.username, mode=self.cipher_mode,
+                                          compress_threshold=self.compress_threshold))
+
+    def send(self, recipient: str, text: str) -> asyncio.Future:
+        """
+        Encrypts text for recipient (a username or "#" + room) and sends it, once a key is agreed if there is none
+        yet. Returns a future that resolves when the message was sent or fails with HandshakeError.
+        """
+        future = self.loop.create_future()
+
+        if recipient.startswith("#"):
+            # Room keys come from another member after joining, there is nobody to exchange keys with
+            key = self.room_keys.get(recipient)
+            if key is None:
+                future.set_exception(HandshakeError(f"Not a member of {recipient}"))
+            else:
+                self._send_text(recipient, key, text)
+                future.set_result(None)
+            return future
+
+        peer = self.peer(recipient)
+        if peer.state == ESTABLISHED:
+            self._send_text(recipient, peer.key, text)
+            future.set_result(None)
+        elif len(peer.outbox) >= self.max_queued:
+            future.set_exception(HandshakeError(f"Too many messages waiting for a key with {recipient}"))
+        else:
+            peer.outbox.append((text, future))
+            if peer.state == IDLE:
+                self._request(peer)
+        return future
+
+    async def send_many(self, messages: list):
+        """
+        Sends (recipient, text) pairs in as few datagrams as possible, packing several messages into each once the
+        server speaks the binary format. Keys missing for any of the recipients are agreed first, all at once.
+        """
+        names = {recipient for recipient, _ in messages if not recipient.startswith("#")}
+        keys = dict(self.room_keys)
+        keys.update(zip(names, await asyncio.gather(*[self.key_for(name) for name in names])))
+
+        frames = []
+        for recipient, text in messages:
+            if recipient not in keys:
+                raise HandshakeError(f"Not a member of {recipient}")
+            frames.append(codec.encode(EncryptedMessage(keys[recipient], text, recipient=recipient,
+                                                        sender=self.username, mode=self.cipher_mode,
+                                                        compress_threshold=self.compress_threshold), self.wire_format))
+
+        if self.wire_format == codec.BINARY:
+            frames = codec.pack(frames, self.fragmenter.fragment_size)
+        for frame in frames:
+            self.send_payload(frame)
+
+    def peer(self, name: str) -> Peer:
+        peer = self.peers.get(name)
+        if peer is None:
+            peer = self.peers[name] = Peer(name)
+        return peer
+
+    def key_for(self, name: str) -> asyncio.Future:
+        """
+        Returns a future for the key shared with name, starting a key exchange if there is none yet
+        """
+        peer = self.peer(name)
+        future = self.loop.create_future()
+        if peer.state == ESTABLISHED:
+            future.set_result(peer.key)
+            return future
+
+        peer.waiters.append(future)
+        if peer.state == IDLE:
+            self._request(peer)
+        return future
+
+    # Handshake state machine
+
+    def _begin(self, peer: Peer, state: str) -> int:
+        """
+        Moves peer into a new handshake attempt, returns the attempt's number
+        """
+        if peer.timer is not None:
+            peer.timer.cancel()
+        peer.attempt += 1
+        peer.state = state
+        peer.secret = None
+        peer.timer = self.loop.call_later(self.handshake_timeout, self._expire, peer, peer.attempt)
+        return peer.attempt
+
+    def _request(self, peer: Peer):
+        attempt = self._begin(peer, REQUESTED)
+        self._spawn(self._send_request(peer, attempt))
+
+    async def _send_request(self, peer: Peer, attempt: int):
+        group = self.group
+        secret, public = await self.loop.run_in_executor(None, dh.generate_keypair, group.prime, group.root)
+        if peer.attempt != attempt:
+            return  # Timed out or the peer's own request took over meanwhile
+
+        peer.secret = secret
+        self.send_object(KeyExchangeMessage("Request Key Exchange", group.prime, group.root, public, peer.name,
+                                            self.username, self.formats))
+
+    async def _receive_public(self, peer: Peer, public: object):
+        attempt, secret = peer.attempt, peer.secret
+        if peer.state != REQUESTED or secret is None:
+            return  # Answer to a request we abandoned
+
+        try:
+            shared = await self.loop.run_in_executor(None, dh.shared_secret, self.group.prime, secret, public)
+        except (ValueError, TypeError) as e:
+            self._fail(peer, HandshakeError(f"Key exchange with {peer.name} failed: {e}"))
+            return
+        if peer.attempt == attempt:
+            self._establish(peer, self.derive_key(shared))
+
+    async def _answer(self, peer: Peer, request: KeyExchangeMessage):
+        if peer.state == REQUESTED and self.username is not None and self.username < peer.name:
+            return  # Both sides asked at once and ours wins, they will answer it
+
+        attempt = self._begin(peer, ANSWERING)
+        try:
+            group = dh.accept_request(self.groups, request.prime, request.root, request.public)
+        except ValueError as e:
+            self.send_object(KeyExchangeMessage("Key Exchange Rejected", recipient=peer.name, sender=self.username))
+            self._fail(peer, HandshakeError(f"Refused key exchange from {peer.name}: {e}"))
+            return
+
+        self.send_object(KeyExchangeMessage("Key Exchange Accepted", recipient=peer.name, sender=self.username))
+
+        def compute():
+            secret, public = dh.generate_keypair(group.prime, group.root)
+            return public, dh.shared_secret(group.prime, secret, request.public)
+
+        public, shared = await self.loop.run_in_executor(None, compute)
+        if peer.attempt != attempt:
+            return
+
+        # The key is in place before the peer can use it, our public part is sent before anything queued for them
+        self._establish(peer, self.derive_key(shared), Message(public, peer.name, self.username))
+
+    @staticmethod
+    def derive_key(shared: int) -> bytes:
+        """
+        Cipher key for a Diffie-Hellman shared secret, the same as UDPClient's
+        """
+        return SHA3_256.new(shared.to_bytes((shared.bit_length() + 7) // 8, "big")).digest()
+
+    def _establish(self, peer: Peer, key: bytes, reply: Message = None):
+        peer.key = key
+        peer.state = ESTABLISHED
+        peer.secret = None
+        if peer.timer is not None:
+            peer.timer.cancel()
+            peer.timer = None
+
+        if reply is not None:
+            self.send_object(reply)
+
+        for future in peer.waiters:
+            if not future.done():
+                future.set_result(peer.key)
+        peer.waiters = []
+
+        while peer.outbox:
+            text, future = peer.outbox.popleft()
+            self._send_text(peer.name, peer.key, text)
+            if not future.done():
+                future.set_result(None)
+
+    def _expire(self, peer: Peer, attempt: int):
+        if peer.attempt == attempt and peer.state != ESTABLISHED:
+            self._fail(peer, HandshakeError(f"Key exchange with {peer.name} timed out"))
+
+    def _fail(self, peer: Peer, error: Exception):
+        if peer.timer is not None:
+            peer.timer.cancel()
+            peer.timer = None
+        peer.attempt += 1
+        peer.state = IDLE if peer.key is None else ESTABLISHED
+        peer.secret = None
+
+        waiting = [future for future in peer.waiters if not future.done()]
+        waiting += [future for _, future in peer.outbox if not future.done()]
+        peer.waiters = []
+        peer.outbox.clear()
+
+        for future in waiting:
+            future.set_exception(error)
+        if not waiting:
+            self.report(error)
+
+    # Receiving
+
+    def datagram_received(self, data: bytes, address: tuple):
+        try:
+            if self.reliability is not None:
+                data = self.reliability.receive(data, address)
+            if data is not None:
+                data = self.reassembler.feed(address, data)
+            if data is None:
+                return
+
+            if codec.is_binary(data):
+                self.wire_format = codec.BINARY
+            self.dispatch(codec.decode(data))
+        except ValueError as e:  # Malformed frames and messages that fail to decrypt
+            self.report(e)
+
+    def dispatch(self, obj: object):
+        if not isinstance(obj, Message):
+            self.report(ValueError(f"Dropped unexpected {type(obj).__name__} from the server"))
+            return
+
+        # The server sends without a sender
+        sender = obj.sender or ROOT
+
+        if type(obj) is BatchMessage:
+            for message in obj.messages:
+                self.dispatch(message)
+        elif type(obj) is KeyExchangeMessage:
+            if obj.request == "Request Key Exchange":
+                self._spawn(self._answer(self.peer(sender), obj))
+            elif obj.request == "Key Exchange Rejected":
+                self._fail(self.peer(sender), HandshakeError(f"{sender} rejected group {self.group.name}"))
+            # Key Exchange Accepted only announces the public part that follows
+        elif type(obj) is Message:
+            peer = self.peers.get(sender)
+            if peer is not None:
+                self._spawn(self._receive_public(peer, obj.text))
+        elif type(obj) is EncryptedMessage:
+            self.receive_encrypted(sender, obj)
+        elif type(obj) is RoomMessage:
+            self.receive_room(sender, obj)
+        elif type(obj) is ResumeMessage:
+            self.receive_resume(obj)
+
+    def receive_encrypted(self, sender: str, obj: EncryptedMessage):
+        room = obj.recipient if obj.recipient is not None and obj.recipient.startswith("#") else None
+        peer = self.peers.get(sender)
+        key = self.room_keys.get(room) if room else peer.key if peer is not None else None
+        if key is None and room is not None:
+            # Another member may not have sent the key yet
+            self.held.setdefault(room, collections.deque(maxlen=self.max_queued)).append((sender, obj))
+            return
+        if key is None:
+            self.report(HandshakeError(f"Dropped a message from {sender}, no key for {sender}"))
+            return
+
+        codec.attach_key(obj, key)
+        text = obj.decrypt()
+
+        if sender == ROOT:
+            while self._replies:
+                future = self._replies.popleft()
+                if not future.done():
+                    future.set_result(text)
+                    return
+        self.deliver(sender, text, room)
+
+    def receive_room(self, sender: str, obj: RoomMessage):
+        """
+        Handles the server's answers to room requests and room keys, see RoomMessage
+        """
+        room = "#" + obj.room
+        if obj.request == "key" and sender != ROOT:
+            peer = self.peers.get(sender)
+            if peer is None or peer.key is None:
+                self.report(HandshakeError(f"Dropped the key for {room} from {sender}, no key for {sender}"))
+                return
+            codec.attach_key(obj, peer.key)
+            self.set_room_key(room, bytes.fromhex(obj.room_key.decrypt()))
+        elif obj.request == "rekey":
+            self.set_room_key(room, get_random_bytes(32))
+            for member in (obj.text or "").split("\0"):
+                if member:
+                    self._spawn(self._share_room_key(room, member))
+        elif obj.request == "share":
+            # Only members hold a key, a member whose own key has not arrived yet has nothing to share
+            if obj.text and room in self.room_keys:
+                self._spawn(self._share_room_key(room, obj.text))
+        else:
+            self.deliver(ROOT, f"{room}: {obj.text}")
+
+    def set_room_key(self, room: str, key: bytes):
+        joined = room not in self.room_keys
+        self.room_keys[room] = key
+        self.deliver(ROOT, f"Joined {room}" if joined else f"New key for {room}")
+
+        for sender, obj in self.held.pop(room, ()):
+            try:
+                self.receive_encrypted(sender, obj)
+            except ValueError as e:  # Sent under an older key
+                self.report(e)
+
+    async def _share_room_key(self, room: str, member: str):
+        """
+        Sends our key for room to member, encrypted under the key we share with them
+        """
+        key = await self.key_for(member)
+        if room in self.room_keys:
+            room_key = EncryptedMessage(key, self.room_keys[room].hex(), mode=self.cipher_mode)
+            self.send_object(RoomMessage("key", room[1:], room_key, recipient=member, sender=self.username))
+
+    def receive_resume(self, obj: ResumeMessage):
+        root = self.peer(ROOT)
+        if obj.request == "ticket":
+            codec.attach_key(obj, root.key)
+            self.store_ticket(tickets.keep_ticket(obj.ticket.decrypt(), root.key, obj.recipient))
+            return
+
+        if self._resuming is None:
+            return  # Answer to a resumption we gave up on
+        future, ticket, nonce = self._resuming
+        self._resuming = None
+
+        accepted = tickets.resumed(obj, ticket, nonce)
+        if accepted is not None:
+            # Set the key right away, room keys and stored messages follow the answer without waiting for the caller
+            key, next_ticket = accepted
+            self.store_ticket(next_ticket)
+            self.username = next_ticket[2]
+            root.attempt += 1  # Supersedes a key exchange with the server that may be in progress
+            self._establish(root, key)
+        if not future.done():
+            future.set_result(accepted is not None)
+
+    def store_ticket(self, ticket: tuple):
+        self.ticket = ticket
+        if self.on_ticket is not None:
+            self.on_ticket(self.ticket)
+
+    # Requests to the server
+
+    async def resume(self, ticket: tuple) -> bool:
+        """
+        Resumes the session a ticket from an earlier connection belongs to instead of exchanging keys and logging in
+        again. Returns whether the server accepted the ticket, tickets can be used once.
+        """
+        request, nonce = tickets.resume_request(ticket)
+        future = self.loop.create_future()
+        self._resuming = future, ticket, nonce
+
+        # Tickets are only issued to clients speaking the binary codec
+        self.wire_format = codec.BINARY
+        self.send_object(request)
+        try:
+            return await asyncio.wait_for(future, self.handshake_timeout)
+        except asyncio.TimeoutError:
+            self._resuming = None
+            return False
+
+    async def login(self, username: str, password: str, register: bool = False) -> str:
+        """
+        Logs in, or registers if register is set, and returns the server's reply
+        """
+        key = await self.key_for(ROOT)
+        self.username = username
+        hashed = SHA3_256.new(bytes(password, "utf-8")).hexdigest()
+
+        reply = self.loop.create_future()
+        self._replies.append(reply)
+        message = RegisterMessage if register else LoginMessage
+        self.send_object(message(key, username, hashed, sender=username, mode=self.cipher_mode))
+        return await asyncio.wait_for(reply, self.handshake_timeout)
+
+    def room_request(self, request: str, room: str, text: str = None):
+        """
+        Creates, joins or leaves a room, or invites the user named by text to it. The outcome arrives as a message from
+        root, the key for a room created or joined from the member that sends it.
+        """
+        if request == "leave":
+            self.room_keys.pop("#" + room, None)
+            self.held.pop("#" + room, None)
+        self.send_object(RoomMessage(request, room, text=text, sender=self.username))
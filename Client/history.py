@@ -0,0 +1,260 @@
+"""
+Message history kept by the client in SQLite, an append-only log of every conversation with a user or room. Texts,
+senders and conversation names are encrypted at rest with ChaCha20-Poly1305 under a key derived from a passphrase.
+Rows are indexed by a keyed hash of the conversation and the time, so the latest messages of a conversation or the
+page before a given message are one index range scan, and longer reads stream page by page: memory stays flat however
+long the history grows.
+
+With search on, the words of every message are indexed in an FTS5 table as keyed hashes as well. Searches match whole
+words and the index holds no plaintext, it does show which messages share words.
+
+    history = History("data/history.db", passphrase, search=True)
+    history.append("bob", "alice", "Lunch at noon?")
+    latest = history.page("bob", size=50)
+    older = history.page("bob", before=latest[0])
+    for entry in history.search("lunch"):
+        ...
+"""
+
+import hashlib
+import hmac
+import re
+import sqlite3
+import struct
+import time
+from concurrent.futures import Future
+from typing import NamedTuple
+
+from Cryptodome.Cipher import ChaCha20_Poly1305
+from Cryptodome.Random import get_random_bytes
+
+from Util.db import BatchWriter, ConnectionPool
+
+CREATE_TABLES = """
+create table if not exists history_meta (
+    name text primary key,
+    value blob not null
+);
+create table if not exists history (
+    id integer primary key,
+    peer blob not null,
+    sent real not null,
+    nonce blob not null,
+    body blob not null
+);
+create index if not exists history_by_peer on history (peer, sent, id);
+"""
+CREATE_WORDS = "CREATE VIRTUAL TABLE IF NOT EXISTS history_words USING fts5(words, content='', detail=none)"
+HAS_WORDS = "SELECT 1 FROM sqlite_master WHERE name='history_words'"
+
+SELECT_META = "SELECT value FROM history_meta WHERE name=?"
+INSERT_META = "INSERT OR IGNORE INTO history_meta(name, value) VALUES (?,?)"
+INSERT_ENTRY = "INSERT INTO history(peer, sent, nonce, body) VALUES (?,?,?,?)"
+INSERT_WORDS = "INSERT INTO history_words(rowid, words) VALUES (?,?)"
+SELECT_LATEST = "SELECT id, peer, sent, nonce, body FROM history WHERE peer=? ORDER BY sent DESC, id DESC LIMIT ?"
+SELECT_BEFORE = "SELECT id, peer, sent, nonce, body FROM history WHERE peer=? AND (sent, id) < (?,?) " \
+                "ORDER BY sent DESC, id DESC LIMIT ?"
+SELECT_AFTER = "SELECT id, peer, sent, nonce, body FROM history WHERE peer=? AND (sent, id) > (?,?) AND sent<? " \
+               "ORDER BY sent, id LIMIT ?"
+SELECT_MATCHES = "SELECT id, peer, sent, nonce, body FROM history WHERE id IN (SELECT rowid FROM history_words " \
+                 "WHERE history_words MATCH ? AND rowid<? ORDER BY rowid DESC LIMIT ?) ORDER BY id DESC"
+
+# scrypt cost for deriving the history key, about 50ms and 16MB once per open
+KDF_PARAMS = {"n": 2 ** 14, "r": 8, "p": 1}
+
+# Conversation hashes remembered, beyond that the memo starts over
+MAX_PEER_TAGS = 10000
+
+_TAG_SIZE = 16
+_WORD = re.compile(r"\w+")
+
+# Marks a flush request in the write queue
+_FLUSH = object()
+
+
+class Entry(NamedTuple):
+    id: int
+    # Username or "#" + room the conversation is with
+    peer: str
+    sender: str
+    text: str
+    # Seconds since the epoch the message was sent or received at
+    sent: float
+
+
+class History(BatchWriter):
+    """
+    Encrypted message history in the SQLite database at path. Appends are queued to a writer thread that commits many
+    per transaction, reads run on the calling thread with a pooled connection and see appends once their batch is
+    committed (flush waits for that).
+
+    search creates the word index if the database has none. Only messages appended while it exists can be found.
+    Opening an existing history with the wrong passphrase raises ValueError.
+    """
+
+    def __init__(self, path: str, passphrase: str or bytes, search: bool = False, batch_size: int = 256,
+                 page_size: int = 500, pool_size: int = 2):
+        super(History, self).__init__(ConnectionPool(path, pool_size), batch_size, "history-writer")
+        self.page_size = page_size
+
+        with self.pool.connection() as connection:
+            connection.executescript(CREATE_TABLES)
+            if search:
+                connection.execute(CREATE_WORDS)
+            connection.execute(INSERT_META, ("salt", get_random_bytes(16)))
+            connection.commit()
+            self.search_enabled = connection.execute(HAS_WORDS).fetchone() is not None
+            salt = connection.execute(SELECT_META, ("salt",)).fetchone()["value"]
+
+        if isinstance(passphrase, str):
+            passphrase = bytes(passphrase, "utf-8")
+        keys = hashlib.scrypt(passphrase, salt=salt, dklen=64, **KDF_PARAMS)
+        self._key, self._index_key = keys[:32], keys[32:]
+        self._peer_tags = {}
+
+        check = self._blind(b"check", "")
+        with self.pool.connection() as connection:
+            connection.execute(INSERT_META, ("check", check))
+            connection.commit()
+            if connection.execute(SELECT_META, ("check",)).fetchone()["value"] != check:
+                raise ValueError("Wrong passphrase for this history")
+
+    def _blind(self, kind: bytes, value: str) -> bytes:
+        """
+        Keyed hash standing in for a conversation name or word in the indexes
+        """
+        return hmac.new(self._index_key, kind + b":" + bytes(value, "utf-8"), hashlib.sha256).digest()[:16]
+
+    def _peer_tag(self, peer: str) -> bytes:
+        tag = self._peer_tags.get(peer)
+        if tag is None:
+            if len(self._peer_tags) >= MAX_PEER_TAGS:
+                self._peer_tags.clear()
+            tag = self._peer_tags[peer] = self._blind(b"peer", peer)
+        return tag
+
+    def _words(self, text: str) -> list:
+        return [self._blind(b"word", word).hex() for word in dict.fromkeys(_WORD.findall(text.lower()))]
+
+    def _seal(self, peer: str, sender: str, text: str, sent: float) -> tuple:
+        peer_tag = self._peer_tag(peer)
+        record = b"".join(struct.pack(">H", len(field)) + field
+                          for field in (bytes(peer, "utf-8"), bytes(sender, "utf-8"))) + bytes(text, "utf-8")
+
+        nonce = get_random_bytes(12)
+        cipher = ChaCha20_Poly1305.new(key=self._key, nonce=nonce)
+        # Binds the row to its conversation and time, a row moved or redated fails to decrypt
+        cipher.update(peer_tag + struct.pack(">d", sent))
+        body, tag = cipher.encrypt_and_digest(record)
+        return peer_tag, sent, nonce, body + tag
+
+    def _open(self, row: sqlite3.Row) -> Entry:
+        cipher = ChaCha20_Poly1305.new(key=self._key, nonce=row["nonce"])
+        cipher.update(row["peer"] + struct.pack(">d", row["sent"]))
+        body = row["body"]
+        record = cipher.decrypt_and_verify(body[:-_TAG_SIZE], body[-_TAG_SIZE:])
+
+        fields, offset = [], 0
+        for _ in range(2):
+            size, = struct.unpack_from(">H", record, offset)
+            fields.append(record[offset + 2:offset + 2 + size].decode("utf-8"))
+            offset += 2 + size
+        peer, sender = fields
+        return Entry(row["id"], peer, sender, record[offset:].decode("utf-8"), row["sent"])
+
+    def append(self, peer: str, sender: str, text: str, sent: float = None) -> Future:
+        """
+        Queues a message of the conversation with peer (a username or "#" + room) for the next batch, the returned
+        future resolves to its id
+        """
+        return self.submit((peer, sender or "", text, time.time() if sent is None else sent))
+
+    def flush(self):
+        """
+        Blocks until every message appended so far is committed
+        """
+        self.submit(_FLUSH).result()
+
+    def _write(self, connection: sqlite3.Connection, batch: list):
+        ids = []
+        try:
+            for item, _ in batch:
+                if item is _FLUSH:
+                    ids.append(None)
+                    continue
+
+                peer, sender, text, sent = item
+                row = self._seal(peer, sender, text, sent)
+                row_id = connection.execute(INSERT_ENTRY, row).lastrowid
+                if self.search_enabled:
+                    # The conversation is indexed as a word too, searches within one conversation stay in the index
+                    words = [row[0].hex()] + self._words(text)
+                    connection.execute(INSERT_WORDS, (row_id, " ".join(words)))
+                ids.append(row_id)
+            connection.commit()
+        except sqlite3.Error as e:
+            connection.rollback()
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        for (_, future), row_id in zip(batch, ids):
+            future.set_result(row_id)
+
+    def page(self, peer: str, before: Entry = None, size: int = 50) -> list:
+        """
+        Returns up to size messages of the conversation with peer, oldest first: the latest ones, or the ones right
+        before the entry before (the first entry of the previous page when scrolling back)
+        """
+        peer_tag = self._peer_tag(peer)
+        with self.pool.connection() as connection:
+            if before is None:
+                rows = connection.execute(SELECT_LATEST, (peer_tag, size)).fetchall()
+            else:
+                rows = connection.execute(SELECT_BEFORE, (peer_tag, before.sent, before.id, size)).fetchall()
+        return [self._open(row) for row in reversed(rows)]
+
+    def messages(self, peer: str, since: float = 0.0, until: float = float("inf")):
+        """
+        Iterates over the messages of the conversation with peer sent from since until before until, oldest first,
+        reading page_size rows at a time
+        """
+        peer_tag = self._peer_tag(peer)
+        position = (since, 0)
+        while True:
+            with self.pool.connection() as connection:
+                rows = connection.execute(SELECT_AFTER, (peer_tag, *position, until, self.page_size)).fetchall()
+            for row in rows:
+                yield self._open(row)
+            if len(rows) < self.page_size:
+                return
+            position = rows[-1]["sent"], rows[-1]["id"]
+
+    def search(self, text: str, peer: str = None):
+        """
+        Iterates over the messages containing every word of text, newest first, within the conversation with peer if
+        specified. Needs search to have been on when the messages were appended.
+        """
+        if not self.search_enabled:
+            raise ValueError("This history has no word index, open it with search=True")
+
+        words = self._words(text)
+        if peer is not None:
+            words.append(self._peer_tag(peer).hex())
+        if not words:
+            return
+        query = " ".join(f'"{word}"' for word in words)
+
+        below = (1 << 63) - 1
+        while True:
+            with self.pool.connection() as connection:
+                rows = connection.execute(SELECT_MATCHES, (query, below, self.page_size)).fetchall()
+            for row in rows:
+                yield self._open(row)
+            if len(rows) < self.page_size:
+                return
+            below = rows[-1]["id"]
+
+    def close(self):
+        super(History, self).close()
+        self.pool.close()
@@ -0,0 +1,85 @@
+"""
+Resumption tickets on the client side, shared by UDPClient and ClientEngine: keeping the tickets the server issues, in a
+file if wanted, and resuming with them (see Util.resumption).
+"""
+
+import os
+
+from Cryptodome.Random import get_random_bytes
+
+from MessageTypes import codec
+from MessageTypes.message import ResumeMessage
+from Util import resumption
+
+
+def keep_ticket(ticket: str, key: bytes, username: str) -> tuple:
+    """
+    Returns what a client keeps of a ticket the server sent for the session with key, as (identifier, secret,
+    username). The server sends the identifier hex encoded.
+    """
+    return bytes.fromhex(ticket), resumption.resumption_secret(key), username
+
+
+def resume_request(ticket: tuple) -> (ResumeMessage, bytes):
+    """
+    Returns the request resuming the session a ticket was issued for, with the nonce it carries
+    """
+    ticket_id, secret, username = ticket
+    nonce = get_random_bytes(resumption.NONCE_SIZE)
+    mac = resumption.resume_mac(secret, ticket_id, nonce, username)
+    return ResumeMessage("resume", ticket_id=ticket_id, nonce=nonce, sender=username, mac=mac), nonce
+
+
+def resumed(response: ResumeMessage, ticket: tuple, nonce: bytes) -> (bytes, tuple):
+    """
+    Returns the new session key and the next ticket from the server's answer to resume_request, None if the server
+    rejected the ticket or does not know its secret
+    """
+    if response.request != "resumed":
+        return None
+
+    _, secret, username = ticket
+    key = resumption.resumed_key(secret, nonce, bytes(response.nonce))
+    codec.attach_key(response, key)
+    try:
+        # Decrypting the next ticket also proves the server knew the secret
+        return key, keep_ticket(response.ticket.decrypt(), key, username)
+    except (ValueError, TypeError):
+        return None
+
+
+def read_ticket(path: str, address: tuple) -> tuple:
+    """
+    Returns the resumption ticket stored in path as (identifier, secret, username), None if there is none for the
+    server at address
+    """
+    if not os.path.exists(path):
+        return None
+
+    # json (and the re module under it) is only needed by clients that keep a ticket
+    import json
+
+    try:
+        with open(path) as f:
+            stored = json.load(f)
+        if (stored["host"], stored["port"]) != tuple(address):
+            return None
+        return bytes.fromhex(stored["ticket"]), bytes.fromhex(stored["secret"]), stored["username"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def write_ticket(path: str, address: tuple, ticket: tuple):
+    """
+    Stores a resumption ticket for the server at address in path, replacing the previous one
+    """
+    import json
+
+    ticket_id, secret, username = ticket
+    stored = {"host": address[0], "port": address[1], "ticket": ticket_id.hex(), "secret": secret.hex(),
+              "username": username}
+    # The secret is as good as the session key, keep it from other users
+    temporary = path + ".tmp"
+    with open(os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+        json.dump(stored, f)
+    os.replace(temporary, path)
@@ -0,0 +1,514 @@
+"""
+Compact binary wire format for the classes in MessageTypes.message, with YAML kept as a fallback for peers that have
+not negotiated the binary format.
+
+Every binary frame starts with a fixed header followed by the routing fields, then the type specific fields. Routing
+needs only the former, see peek:
+
+    magic (2 bytes) | version (1 byte) | type (1 byte) | recipient | sender | ...
+
+Encrypted fields start with one byte naming the cipher mode (with the high bit set if the text is padded, as older
+senders did, and the next bit set if it was compressed), followed by nonce, tag and ciphertext. Version 1 frames had no
+mode byte and always meant padded AES-EAX, they are still accepted.
+
+Short fields (names, integers, nonces, tags) are prefixed with an unsigned 16 bit length, long fields (ciphertext and
+plain text) with an unsigned 32 bit length. The all ones length marks a field that is None. Integers are unsigned and
+written big-endian. The magic starts with a null byte, which YAML never emits, so both formats can share a socket.
+
+A batch frame carries complete frames of other types, each prefixed like a long field, up to the end of the frame.
+
+Decoding never copies the ciphertext, tag or nonce, they are returned as memoryview slices of the received buffer.
+"""
+
+import struct
+
+from MessageTypes.message import EncryptedMessage, KeyExchangeMessage, LoginMessage, RegisterMessage, RoomMessage, \
+    ResumeMessage, BatchMessage, Message, EAX, GCM, CHACHA20_POLY1305
+
+BINARY = "binary"
+YAML = "yaml"
+
+MAGIC = b"\x00J"
+VERSION = 2
+SUPPORTED_VERSIONS = (1, 2)
+
+# Message type identifiers, stored in the frame header
+MESSAGE = 1
+KEY_EXCHANGE = 2
+ENCRYPTED = 3
+LOGIN = 4
+REGISTER = 5
+ROOM = 6
+RESUME = 7
+BATCH = 8
+
+HEADER = struct.Struct(">2sBB")
+
+_SHORT = struct.Struct(">H")
+_LONG = struct.Struct(">I")
+_NONE_SHORT = 0xFFFF
+_NONE_LONG = 0xFFFFFFFF
+
+# Cipher mode identifiers for encrypted fields
+_MODES = {EAX: 0, GCM: 1, CHACHA20_POLY1305: 2}
+_MODE_NAMES = {value: name for name, value in _MODES.items()}
+_PADDED = 0x80
+_COMPRESSED = 0x40
+_FLAGS = _PADDED | _COMPRESSED
+
+# The only classes a YAML document may build, see yaml_loader
+YAML_CLASSES = (Message, KeyExchangeMessage, EncryptedMessage, LoginMessage, RegisterMessage, RoomMessage,
+                ResumeMessage)
+_yaml_loader = None
+
+# Attributes that only matter to the process holding the message and are never written to a frame, like keys
+LOCAL_FIELDS = frozenset(("key",))
+
+# Tags for the loosely typed Message.text field
+_TEXT_NONE = 0
+_TEXT_STR = 1
+_TEXT_INT = 2
+_TEXT_BYTES = 3
+
+
+class CodecError(ValueError):
+    """
+    Raised when an object cannot be encoded or a frame cannot be decoded
+    """
+
+
+def is_binary(data: bytes) -> bool:
+    """
+    Checks whether a received datagram is a binary frame rather than a YAML document
+    """
+    return data[:2] == MAGIC
+
+
+def detect(data: bytes) -> str:
+    """
+    Returns the wire format a datagram was encoded with
+    """
+    return BINARY if is_binary(data) else YAML
+
+
+def encode(obj: Message, wire_format: str = BINARY) -> bytes:
+    """
+    Encodes a message with the specified wire format
+    """
+    if wire_format == YAML:
+        # PyYAML is only imported once a peer speaks YAML, it takes longer to import than the rest of the codec
+        import yaml
+
+        return bytes(yaml.dump(_materialize(obj)), "utf-8")
+    return encode_binary(obj)
+
+
+def decode(data: bytes, key: bytes = None) -> object:
+    """
+    Decodes a datagram in whichever format it was sent, if key is specified it is attached to any encrypted fields that
+    arrived without one (binary frames never carry keys). Raises CodecError, and nothing else, for anything that is
+    not a message.
+    """
+    if is_binary(data):
+        return decode_binary(data, key)
+
+    import yaml
+
+    try:
+        obj = yaml.load(bytes(data).strip(), Loader=yaml_loader())
+    except yaml.YAMLError as e:
+        raise CodecError(f"Malformed YAML document: {e}")
+    if not isinstance(obj, Message):
+        raise CodecError(f"YAML document holds {type(obj).__name__}, not a message")
+
+    if key is not None:
+        attach_key(obj, key)
+    return obj
+
+
+def yaml_loader():
+    """
+    Returns a yaml.SafeLoader that also builds tuples and the classes in YAML_CLASSES, from the tags yaml.dump writes
+    for them, and nothing else. yaml.Loader would build any object a peer names and let it run code on the receiver,
+    documents with any other python tag are rejected with a YAMLError instead.
+    """
+    global _yaml_loader
+    if _yaml_loader is not None:
+        return _yaml_loader
+
+    import yaml
+
+    class MessageLoader(yaml.SafeLoader):
+        pass
+
+    def message_constructor(cls):
+        def construct(loader, node):
+            if not isinstance(node, yaml.MappingNode):
+                raise yaml.constructor.ConstructorError(None, None, f"expected a mapping for {cls.__name__}",
+                                                        node.start_mark)
+            state = loader.construct_mapping(node, deep=True)
+            if not all(isinstance(name, str) for name in state):
+                raise yaml.constructor.ConstructorError(None, None, "attribute names must be strings", node.start_mark)
+
+            # Bypass __init__, which would encrypt, the same way the full loader restores objects
+            obj = cls.__new__(cls)
+            obj.__dict__.update(state)
+            return obj
+        return construct
+
+    for cls in YAML_CLASSES:
+        MessageLoader.add_constructor(f"tag:yaml.org,2002:python/object:{cls.__module__}.{cls.__name__}",
+                                      message_constructor(cls))
+    MessageLoader.add_constructor("tag:yaml.org,2002:python/tuple",
+                                  lambda loader, node: tuple(loader.construct_sequence(node, deep=True)))
+
+    _yaml_loader = MessageLoader
+    return _yaml_loader
+
+
+def _materialize(obj: object) -> object:
+    """
+    Returns a copy of a message fit for YAML, with any memoryview fields converted to bytes (YAML cannot represent
+    views) and the fields in LOCAL_FIELDS left out, also from the messages it holds
+    """
+    if not isinstance(obj, Message):
+        return obj
+    if not any(name in LOCAL_FIELDS or isinstance(value, (memoryview, Message)) for name, value in vars(obj).items()):
+        return obj
+
+    copy = obj.__class__.__new__(obj.__class__)
+    for name, value in vars(obj).items():
+        if name in LOCAL_FIELDS:
+            continue
+        if isinstance(value, memoryview):
+            value = bytes(value)
+        elif isinstance(value, Message):
+            value = _materialize(value)
+        setattr(copy, name, value)
+    return copy
+
+
+def attach_key(obj: object, key: bytes):
+    """
+    Sets the key used for decryption on encrypted messages and on the encrypted fields of login/register messages if
+    they do not have one already
+    """
+    if isinstance(obj, LoginMessage):
+        attach_key(obj.username, key)
+        attach_key(obj.password, key)
+    elif isinstance(obj, RoomMessage) and obj.room_key is not None:
+        attach_key(obj.room_key, key)
+    elif isinstance(obj, ResumeMessage) and obj.ticket is not None:
+        attach_key(obj.ticket, key)
+    elif isinstance(obj, EncryptedMessage) and getattr(obj, "key", None) is None:
+        obj.key = key
+
+
+def _put_short(parts: list, value: bytes):
+    if value is None:
+        parts.append(_SHORT.pack(_NONE_SHORT))
+    else:
+        if len(value) >= _NONE_SHORT:
+            raise CodecError(f"Field of {len(value)} bytes is too long for a short field")
+        parts.append(_SHORT.pack(len(value)))
+        parts.append(value)
+
+
+def _put_long(parts: list, value: bytes):
+    if value is None:
+        parts.append(_LONG.pack(_NONE_LONG))
+    else:
+        if len(value) >= _NONE_LONG:
+            raise CodecError(f"Field of {len(value)} bytes is too long for a long field")
+        parts.append(_LONG.pack(len(value)))
+        parts.append(value)
+
+
+def _put_str(parts: list, value: str):
+    _put_short(parts, None if value is None else bytes(value, "utf-8"))
+
+
+def _put_int(parts: list, value: int):
+    if value is None:
+        _put_short(parts, None)
+    elif value < 0:
+        raise CodecError("Only non-negative integers can be encoded")
+    else:
+        _put_short(parts, value.to_bytes((value.bit_length() + 7) // 8, "big"))
+
+
+def _put_text(parts: list, value: object):
+    if value is None:
+        parts.append(bytes((_TEXT_NONE,)))
+        return
+    if isinstance(value, str):
+        parts.append(bytes((_TEXT_STR,)))
+        value = bytes(value, "utf-8")
+    elif isinstance(value, int) and not isinstance(value, bool) and value >= 0:
+        parts.append(bytes((_TEXT_INT,)))
+        value = value.to_bytes((value.bit_length() + 7) // 8, "big")
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        parts.append(bytes((_TEXT_BYTES,)))
+    else:
+        raise CodecError(f"Cannot encode message text of type {type(value).__name__}")
+    _put_long(parts, value)
+
+
+def _put_encrypted(parts: list, obj: EncryptedMessage):
+    flags = (_PADDED if obj.padded else 0) | (_COMPRESSED if obj.compressed else 0)
+    parts.append(bytes((_MODES[obj.mode] | flags,)))
+    _put_short(parts, obj.nonce)
+    _put_short(parts, obj.tag)
+    _put_long(parts, obj.text)
+
+
+def encode_binary(obj: Message) -> bytes:
+    """
+    Encodes a message as a binary frame, keys are never written to the frame
+    """
+    # Check subclasses before their parents
+    if isinstance(obj, BatchMessage):
+        msg_type = BATCH
+    elif isinstance(obj, RegisterMessage):
+        msg_type = REGISTER
+    elif isinstance(obj, LoginMessage):
+        msg_type = LOGIN
+    elif isinstance(obj, EncryptedMessage):
+        msg_type = ENCRYPTED
+    elif isinstance(obj, KeyExchangeMessage):
+        msg_type = KEY_EXCHANGE
+    elif isinstance(obj, RoomMessage):
+        msg_type = ROOM
+    elif isinstance(obj, ResumeMessage):
+        msg_type = RESUME
+    elif isinstance(obj, Message):
+        msg_type = MESSAGE
+    else:
+        raise CodecError(f"Cannot encode object of type {type(obj).__name__}")
+
+    parts = [HEADER.pack(MAGIC, VERSION, msg_type)]
+    _put_str(parts, obj.recipient)
+    _put_str(parts, obj.sender)
+
+    if msg_type == MESSAGE:
+        _put_text(parts, obj.text)
+    elif msg_type == KEY_EXCHANGE:
+        _put_str(parts, obj.request)
+        _put_int(parts, obj.prime)
+        _put_int(parts, obj.root)
+        _put_int(parts, obj.public)
+        formats = getattr(obj, "formats", None)
+        _put_str(parts, None if formats is None else ",".join(formats))
+    elif msg_type == ENCRYPTED:
+        _put_encrypted(parts, obj)
+    elif msg_type == ROOM:
+        _put_str(parts, obj.request)
+        _put_str(parts, obj.room)
+        _put_text(parts, obj.text)
+        if obj.room_key is None:
+            parts.append(b"\x00")
+        else:
+            parts.append(b"\x01")
+            _put_encrypted(parts, obj.room_key)
+    elif msg_type == BATCH:
+        for message in obj.messages:
+            if isinstance(message, BatchMessage):
+                raise CodecError("Batches cannot be nested")
+            _put_long(parts, encode_binary(message))
+    elif msg_type == RESUME:
+        _put_str(parts, obj.request)
+        _put_short(parts, obj.ticket_id)
+        _put_short(parts, obj.nonce)
+        if obj.ticket is None:
+            parts.append(b"\x00")
+        else:
+            parts.append(b"\x01")
+            _put_encrypted(parts, obj.ticket)
+        _put_short(parts, getattr(obj, "mac", None))
+    else:
+        _put_encrypted(parts, obj.username)
+        _put_encrypted(parts, obj.password)
+
+    return b"".join(parts)
+
+
+def pack(frames: list, size: int) -> list:
+    """
+    Combines encoded binary frames, in order, into as few batch frames of at most size bytes as possible. Frames that
+    do not fit into a batch with others are returned as they are.
+    """
+    payloads, parts = [], []
+    empty = HEADER.size + 2 * _SHORT.size
+    length = empty
+
+    def flush():
+        if len(parts) == 2:
+            payloads.append(parts[1])  # A batch of one is just the frame
+        elif parts:
+            payloads.append(HEADER.pack(MAGIC, VERSION, BATCH) + _SHORT.pack(_NONE_SHORT) * 2 + b"".join(parts))
+        parts.clear()
+
+    for frame in frames:
+        if length + _LONG.size + len(frame) > size:
+            flush()
+            length = empty
+        if empty + _LONG.size + len(frame) > size:
+            payloads.append(frame)
+            continue
+        parts.append(_LONG.pack(len(frame)))
+        parts.append(frame)
+        length += _LONG.size + len(frame)
+    flush()
+    return payloads
+
+
+class _Reader(object):
+    """
+    Cursor over a received frame, slices returned are views of the original buffer
+    """
+
+    def __init__(self, data: bytes, offset: int = 0, version: int = VERSION):
+        self.view = memoryview(data)
+        self.offset = offset
+        self.version = version
+
+    def _take(self, length: int) -> memoryview:
+        end = self.offset + length
+        if end > len(self.view):
+            raise CodecError("Frame is truncated")
+        chunk = self.view[self.offset:end]
+        self.offset = end
+        return chunk
+
+    def short(self) -> memoryview:
+        length, = _SHORT.unpack(self._take(_SHORT.size))
+        return None if length == _NONE_SHORT else self._take(length)
+
+    def long(self) -> memoryview:
+        length, = _LONG.unpack(self._take(_LONG.size))
+        return None if length == _NONE_LONG else self._take(length)
+
+    def byte(self) -> int:
+        return self._take(1)[0]
+
+    def str(self) -> str:
+        value = self.short()
+        return None if value is None else self._utf8(value)
+
+    @staticmethod
+    def _utf8(value: memoryview) -> str:
+        try:
+            return str(value, "utf-8")
+        except UnicodeDecodeError as e:
+            raise CodecError(f"Text field is not UTF-8: {e}")
+
+    def int(self) -> int:
+        value = self.short()
+        return None if value is None else int.from_bytes(value, "big")
+
+    def text(self) -> object:
+        tag = self.byte()
+        if tag == _TEXT_NONE:
+            return None
+        value = self.long()
+        if value is None:
+            raise CodecError("Text field is missing")
+        if tag == _TEXT_STR:
+            return self._utf8(value)
+        elif tag == _TEXT_INT:
+            return int.from_bytes(value, "big")
+        elif tag == _TEXT_BYTES:
+            return value
+        raise CodecError(f"Unknown text tag {tag}")
+
+    def encrypted(self, key: bytes, recipient: str = None, sender: str = None) -> EncryptedMessage:
+        # Bypass __init__, which would encrypt or decrypt, the same way yaml.load restores objects
+        obj = EncryptedMessage.__new__(EncryptedMessage)
+        obj.recipient = recipient
+        obj.sender = sender
+        obj.key = key
+        if self.version == 1:
+            obj.mode, obj.padded, obj.compressed = EAX, True, False
+        else:
+            flags = self.byte()
+            try:
+                obj.mode = _MODE_NAMES[flags & ~_FLAGS]
+            except KeyError:
+                raise CodecError(f"Unknown cipher mode {flags & ~_FLAGS}")
+            obj.padded = bool(flags & _PADDED)
+            obj.compressed = bool(flags & _COMPRESSED)
+        obj.nonce = self.short()
+        obj.tag = self.short()
+        obj.text = self.long()
+        return obj
+
+
+def read_header(data: bytes) -> (int, _Reader):
+    """
+    Validates the frame header and returns the message type with a reader positioned after it
+    """
+    if len(data) < HEADER.size:
+        raise CodecError("Frame is truncated")
+    magic, version, msg_type = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise CodecError("Not a binary frame")
+    if version not in SUPPORTED_VERSIONS:
+        raise CodecError(f"Unsupported wire format version {version}")
+    return msg_type, _Reader(data, HEADER.size, version)
+
+
+def peek(data: bytes) -> (int, str, str):
+    """
+    Reads only the header and routing fields of a binary frame, returns its message type, recipient and sender
+    """
+    msg_type, reader = read_header(data)
+    return msg_type, reader.str(), reader.str()
+
+
+def decode_binary(data: bytes, key: bytes = None) -> Message:
+    """
+    Decodes a binary frame back into the matching class from MessageTypes.message
+    """
+    msg_type, reader = read_header(data)
+    recipient = reader.str()
+    sender = reader.str()
+
+    if msg_type == MESSAGE:
+        return Message(reader.text(), recipient, sender)
+    elif msg_type == KEY_EXCHANGE:
+        request = reader.str()
+        prime, root, public = reader.int(), reader.int(), reader.int()
+        formats = reader.str()
+        return KeyExchangeMessage(request, prime, root, public, recipient, sender,
+                                  formats=None if formats is None else tuple(formats.split(",")))
+    elif msg_type == ENCRYPTED:
+        return reader.encrypted(key, recipient, sender)
+    elif msg_type == ROOM:
+        request, room, text = reader.str(), reader.str(), reader.text()
+        room_key = reader.encrypted(key) if reader.byte() else None
+        return RoomMessage(request, room, room_key, text, recipient, sender)
+    elif msg_type == BATCH:
+        messages = []
+        while reader.offset < len(reader.view):
+            frame = reader.long()
+            if frame is None or read_header(frame)[0] == BATCH:
+                raise CodecError("Batches cannot be nested or hold empty frames")
+            messages.append(decode_binary(frame, key))
+        return BatchMessage(messages, recipient, sender)
+    elif msg_type == RESUME:
+        request, ticket_id, nonce = reader.str(), reader.short(), reader.short()
+        ticket = reader.encrypted(key) if reader.byte() else None
+        # Frames from before resume requests carried a MAC end here
+        mac = reader.short() if reader.offset < len(reader.view) else None
+        return ResumeMessage(request, ticket, ticket_id, nonce, recipient, sender, mac)
+    elif msg_type in (LOGIN, REGISTER):
+        cls = RegisterMessage if msg_type == REGISTER else LoginMessage
+        obj = cls.__new__(cls)
+        obj.recipient = recipient
+        obj.sender = sender
+        obj.text = None
+        obj.username = reader.encrypted(key)
+        obj.password = reader.encrypted(key)
+        return obj
+
+    raise CodecError(f"Unknown message type {msg_type}")
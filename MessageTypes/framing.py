@@ -0,0 +1,204 @@
+"""
+Splits encoded messages that do not fit in one datagram into fragments and puts them back together on arrival.
+
+Payloads up to the fragment size are sent unchanged. Larger ones are cut into pieces that each carry a small header:
+
+    magic (2 bytes) | version (1 byte) | message id (4 bytes) | index (2 bytes) | count (2 bytes) | data
+
+The default fragment size keeps datagrams under the 1280 byte IPv6 minimum MTU, so routers never have to fragment
+them at the IP layer. Like the binary codec's magic this one starts with a null byte, fragments can therefore share a
+socket with whole YAML or binary frames.
+"""
+
+import itertools
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+from Cryptodome.Random.random import getrandbits
+
+MAGIC = b"\x00F"
+VERSION = 1
+
+HEADER = struct.Struct(">2sBIHH")
+
+FRAGMENT_SIZE = 1200
+MAX_FRAGMENTS = 0xFFFF
+
+# Large enough for any single datagram, including a whole unfragmented frame
+RECEIVE_SIZE = 65535
+
+
+class FramingError(ValueError):
+    """
+    Raised when a payload cannot be fragmented or a fragment is malformed
+    """
+
+
+def is_fragment(data: bytes) -> bool:
+    return data[:2] == MAGIC
+
+
+class Fragmenter(object):
+    """
+    Cuts payloads into fragments, numbering them with message ids unique to this sender
+    """
+
+    def __init__(self, fragment_size: int = FRAGMENT_SIZE):
+        if fragment_size <= HEADER.size:
+            raise FramingError(f"Fragment size must be larger than the {HEADER.size} byte header")
+
+        self.fragment_size = fragment_size
+        self._ids = itertools.count(getrandbits(31))
+        self._lock = threading.Lock()
+
+    def fragment(self, payload: bytes) -> list:
+        """
+        Returns the datagrams to send for payload, just the payload itself if it fits in one
+        """
+        if len(payload) <= self.fragment_size:
+            return [payload]
+
+        chunk = self.fragment_size - HEADER.size
+        count = (len(payload) + chunk - 1) // chunk
+        if count > MAX_FRAGMENTS:
+            raise FramingError(f"Payload of {len(payload)} bytes needs more than {MAX_FRAGMENTS} fragments")
+
+        with self._lock:
+            message_id = next(self._ids) & 0xFFFFFFFF
+
+        view = memoryview(payload)
+        return [HEADER.pack(MAGIC, VERSION, message_id, index, count) + view[index * chunk:(index + 1) * chunk]
+                for index in range(count)]
+
+
+class _Partial(object):
+    # parts maps index to chunk, the count comes from the peer and nothing is allocated for fragments not yet received
+    __slots__ = ("count", "parts", "size", "started")
+
+    def __init__(self, count: int):
+        self.count = count
+        self.parts = {}
+        self.size = 0
+        self.started = time.monotonic()
+
+
+class Reassembler(object):
+    """
+    Collects fragments per sender until a message is complete. Memory is bounded: each sender may have at most
+    max_pending incomplete messages holding at most max_bytes between them, counting the fragments' headers, all
+    senders together hold at most max_total_bytes, and incomplete messages are dropped after timeout seconds. When a
+    sender's bound is hit its oldest incomplete message is dropped first, when the total is hit the oldest of any
+    sender is. A message whose fragment count could never fit in max_bytes is refused outright.
+    """
+
+    def __init__(self, max_pending: int = 16, max_bytes: int = 4 * 1024 * 1024, timeout: float = 10.0,
+                 max_senders: int = 10000, max_total_bytes: int = 64 * 1024 * 1024):
+        self.max_pending = max_pending
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.max_senders = max_senders
+        self.max_total_bytes = max_total_bytes
+
+        self._senders = OrderedDict()
+        # Every incomplete message keyed by (sender, message id) in the order it started, oldest first
+        self._order = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.total = 0
+        self.dropped = 0
+
+    def feed(self, sender, data: bytes) -> bytes:
+        """
+        Takes one received datagram, returns the complete payload if it finished a message (or was never fragmented),
+        otherwise None
+        """
+        if not is_fragment(data):
+            return data
+
+        if len(data) < HEADER.size:
+            raise FramingError("Fragment is truncated")
+        magic, version, message_id, index, count = HEADER.unpack_from(data)
+        if version != VERSION:
+            raise FramingError(f"Unsupported framing version {version}")
+        if count == 0 or index >= count:
+            raise FramingError(f"Fragment {index} of {count} is out of range")
+
+        # Every fragment but the last carries a full chunk, so the whole message takes at least this much
+        if index < count - 1 and (count - 1) * len(data) > self.max_bytes:
+            raise FramingError(f"Message of {count} fragments exceeds the {self.max_bytes} byte limit")
+
+        chunk = bytes(memoryview(data)[HEADER.size:])
+        with self._lock:
+            pending = self._pending(sender)
+            partial = pending.get(message_id)
+            if partial is None:
+                partial = pending[message_id] = self._order[(sender, message_id)] = _Partial(count)
+            elif partial.count != count:
+                raise FramingError("Fragment count changed mid message")
+
+            if index not in partial.parts:
+                partial.parts[index] = chunk
+                partial.size += len(data)
+                self.total += len(data)
+
+            if len(partial.parts) == count:
+                self._discard(sender, message_id)
+                return b"".join(partial.parts[i] for i in range(count))
+
+            self._enforce_limits(sender, pending)
+        return None
+
+    def _pending(self, sender) -> OrderedDict:
+        pending = self._senders.get(sender)
+        if pending is None:
+            pending = self._senders[sender] = OrderedDict()
+            while len(self._senders) > self.max_senders:
+                evicted_sender, evicted = self._senders.popitem(last=False)
+                for message_id, partial in evicted.items():
+                    del self._order[(evicted_sender, message_id)]
+                    self.total -= partial.size
+                self.dropped += len(evicted)
+        else:
+            self._senders.move_to_end(sender)
+        return pending
+
+    def _discard(self, sender, message_id):
+        pending = self._senders[sender]
+        partial = pending.pop(message_id)
+        del self._order[(sender, message_id)]
+        self.total -= partial.size
+        if not pending:
+            del self._senders[sender]
+
+    def _enforce_limits(self, sender, pending: OrderedDict):
+        deadline = time.monotonic() - self.timeout
+        while pending:
+            message_id, oldest = next(iter(pending.items()))
+            if (oldest.started > deadline and len(pending) <= self.max_pending
+                    and sum(partial.size for partial in pending.values()) <= self.max_bytes):
+                break
+            self._discard(sender, message_id)
+            self.dropped += 1
+
+        while self.total > self.max_total_bytes:
+            self._discard(*next(iter(self._order)))
+            self.dropped += 1
+
+    def expire(self) -> int:
+        """
+        Drops every incomplete message older than timeout, returns how many were dropped
+        """
+        deadline = time.monotonic() - self.timeout
+        dropped = 0
+        with self._lock:
+            # Messages start in order, so the expired ones are all at the front
+            while self._order:
+                key, oldest = next(iter(self._order.items()))
+                if oldest.started > deadline:
+                    break
+                self._discard(*key)
+                dropped += 1
+            self.dropped += dropped
+        return dropped
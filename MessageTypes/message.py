@@ -1,12 +1,55 @@
-from Cryptodome.Cipher import AES
+import zlib
+
+from Cryptodome.Cipher import AES, ChaCha20_Poly1305
 from Cryptodome.Util import Padding
 
+# Supported AEAD modes for EncryptedMessage
+EAX = "eax"
+GCM = "gcm"
+CHACHA20_POLY1305 = "chacha20-poly1305"
+MODES = (EAX, GCM, CHACHA20_POLY1305)
+
+# Upper bound on a decompressed message, a small compressed payload must not be able to exhaust memory
+MAX_PLAINTEXT = 16 * 1024 * 1024
+
+
+def new_cipher(key: bytes, mode: str = EAX, nonce: bytes = None):
+    """
+    Creates a cipher for one message, if nonce is not specified it will be generated by the cipher
+    """
+    if mode == EAX:
+        return AES.new(key, AES.MODE_EAX, nonce=nonce)
+    elif mode == GCM:
+        return AES.new(key, AES.MODE_GCM, nonce=nonce)
+    elif mode == CHACHA20_POLY1305:
+        return ChaCha20_Poly1305.new(key=key, nonce=nonce)
+    raise ValueError(f"Unsupported cipher mode {mode!r}, expected one of {', '.join(MODES)}")
+
+
+def decompress(data: bytes) -> bytes:
+    """
+    Inflates a compressed message text, raises ValueError if it would exceed MAX_PLAINTEXT
+    """
+    decompressor = zlib.decompressobj()
+    try:
+        plaintext = decompressor.decompress(data, MAX_PLAINTEXT)
+    except zlib.error as e:
+        raise ValueError(f"Corrupt compressed message: {e}")
+    if decompressor.unconsumed_tail:
+        raise ValueError(f"Compressed message expands to more than {MAX_PLAINTEXT} bytes")
+    return plaintext
+
 
 class Message(object):
     """
     Stores message information, ready for encoding
     """
 
+    # Messages restored by yaml.load skip __init__, fields a document leaves out are None
+    text = None
+    recipient = None
+    sender = None
+
     def __init__(self, text: object = None, recipient: str = None, sender: str = None):
         self.text = text
         self.recipient = recipient
@@ -19,7 +62,7 @@ class KeyExchangeMessage(Message):
     """
 
     def __init__(self, request: str, prime: int = None, root: int = None, public: int = None, recipient: str = None,
-                 sender: str = None):
+                 sender: str = None, formats: tuple = None):
         super(KeyExchangeMessage, self).__init__(recipient=recipient, sender=sender)
 
         self.request = request
@@ -27,70 +70,151 @@ class KeyExchangeMessage(Message):
         self.root = root
         self.public = public
 
+        # Wire formats supported by the sender, used to negotiate the codec (see MessageTypes.codec)
+        self.formats = formats
+
 
 class EncryptedMessage(Message):
     """
     Encrypted message information, ready for encoding
+
+    Messages are sealed with an AEAD cipher, AES-EAX by default or AES-GCM or ChaCha20-Poly1305 if specified by mode.
+    A single cipher object both encrypts and authenticates, and since all three are stream modes the text is not
+    padded.
+
+    If compress_threshold is specified, texts at least that long are compressed before they are encrypted (if that
+    makes them smaller). Compression lets long messages fit in fewer datagrams, but it makes the ciphertext length
+    depend on the content, so it is off by default.
     """
 
+    # Messages restored by yaml.load skip __init__, anything without these attributes came from an older sender that
+    # always used padded, uncompressed AES-EAX
+    mode = EAX
+    padded = True
+    compressed = False
+
     def __init__(self, key: bytes, text: str, tag: bytes = None, nonce: bytes = None, recipient: str = None,
-                 sender: str = None):
+                 sender: str = None, mode: str = EAX, compress_threshold: int = None):
         super(EncryptedMessage, self).__init__(text, recipient, sender)
         self.key = key
         self.tag = tag
-
-        self.nonce = self.set_key(nonce).nonce
+        self.nonce = nonce
+        self.mode = mode
+        self.padded = False
+        self.compressed = False
 
         if not nonce:
-            self.text, self.tag = self.encrypt()
+            self.text, self.tag = self.encrypt(compress_threshold)
         else:
             self.text = self.decrypt()
 
-    def set_key(self, nonce: bytes = None) -> AES:
+    def set_key(self, nonce: bytes = None):
         """
         Helper function to setup cipher
 
         If nonce is not specified it will be generated by the cipher
         """
-        return AES.new(self.key, AES.MODE_EAX, nonce=nonce)
+        return new_cipher(self.key, self.mode, nonce)
 
-    def encrypt(self) -> (bytes, bytes):
+    def encrypt(self, compress_threshold: int = None) -> (bytes, bytes):
         """
-        Encrypts input text with input key and nonce using cipher specified on the instance and generates a tag that
-        can be used to verify message integrity
+        Encrypts input text with input key using cipher specified on the instance and generates a tag that can be used
+        to verify message integrity. The nonce is generated by the cipher and stored on the instance.
 
-        Returns a tuple with the encrypted text, hash for checking integrity, and nonce
+        Returns a tuple with the encrypted text and hash for checking integrity
         """
+        plaintext = bytes(self.text, "utf-8")
 
-        ciphertext, tag = self.set_key(self.nonce).encrypt_and_digest(Padding.pad(bytes(self.text, "utf-8"), 16))
-        return ciphertext, tag
+        if compress_threshold is not None and len(plaintext) >= compress_threshold:
+            compressed = zlib.compress(plaintext)
+            if len(compressed) < len(plaintext):
+                plaintext = compressed
+                self.compressed = True
+
+        cipher = self.set_key()
+        self.nonce = cipher.nonce
+
+        return cipher.encrypt_and_digest(plaintext)
 
     def decrypt(self) -> str:
         """
-        Decrypts encrypted text with cipher specified on the instance and checks tag to verify message integrity
+        Decrypts encrypted text with cipher specified on the instance and checks tag to verify message integrity,
+        raises ValueError if the message was tampered with
         """
+        plaintext = self.set_key(self.nonce).decrypt_and_verify(self.text, self.tag)
 
-        cipher = self.set_key(self.nonce)
-
-        plaintext = Padding.unpad(cipher.decrypt(self.text), 16)
-
-        # Verify message integrity
-        try:
-            cipher.verify(self.tag)
-        except ValueError:
-            raise
+        if self.padded:
+            plaintext = Padding.unpad(plaintext, 16)
+        if self.compressed:
+            plaintext = decompress(plaintext)
 
         return str(plaintext, "utf-8")
 
 
 class LoginMessage(Message):
-    def __init__(self, key: bytes, username: str, password: str, recipient: str = "root", sender: str = None):
+    def __init__(self, key: bytes, username: str, password: str, recipient: str = "root", sender: str = None,
+                 mode: str = EAX):
         super(LoginMessage, self).__init__(recipient=recipient, sender=sender)
 
-        self.username = EncryptedMessage(key, username)
-        self.password = EncryptedMessage(key, password)
+        self.username = EncryptedMessage(key, username, mode=mode)
+        self.password = EncryptedMessage(key, password, mode=mode)
 
 
 class RegisterMessage(LoginMessage):
-    def __init__(self, key: bytes, username: str, password: str, recipient: str = "root", sender: str = None):
-        super(RegisterMessage, self).__init__(key, username, password, recipient, sender)
+    def __init__(self, key: bytes, username: str, password: str, recipient: str = "root", sender: str = None,
+                 mode: str = EAX):
+        super(RegisterMessage, self).__init__(key, username, password, recipient, sender, mode)
+
+
+class RoomMessage(Message):
+    """
+    Creates, joins or leaves a room, sent to root with request create, join or leave, or invites the user named in
+    text with request invite. Only invited users can join. The server answers with request error and the reason (or
+    outcome) as text.
+
+    Room keys are made by members and never seen by the server. It asks a member to send its key to the member named
+    in text with request share, or to make a new key with request rekey (when a member joins with nobody else online,
+    or after a member left), text then names the members to send it to separated by null bytes. A member sends the key
+    to another with request key, room_key holds it encrypted under the key the two share.
+
+    Messages to a room are ordinary EncryptedMessages, encrypted once under the room key and addressed to "#" + room.
+    """
+
+    def __init__(self, request: str, room: str, room_key: EncryptedMessage = None, text: str = None,
+                 recipient: str = "root", sender: str = None):
+        super(RoomMessage, self).__init__(text, recipient, sender)
+
+        self.request = request
+        self.room = room
+        self.room_key = room_key
+
+
+class ResumeMessage(Message):
+    """
+    Session resumption (see Util.resumption). The server sends request ticket with the ticket's identifier encrypted
+    under the session key. A client resumes by sending request resume with the identifier, a nonce and a MAC under the
+    ticket's secret (Util.resumption.resume_mac), the server answers with request resumed, its own nonce and the next
+    ticket encrypted under the new key, or with request rejected.
+    """
+
+    def __init__(self, request: str, ticket: EncryptedMessage = None, ticket_id: bytes = None, nonce: bytes = None,
+                 recipient: str = "root", sender: str = None, mac: bytes = None):
+        super(ResumeMessage, self).__init__(recipient=recipient, sender=sender)
+
+        self.request = request
+        self.ticket = ticket
+        self.ticket_id = ticket_id
+        self.nonce = nonce
+        self.mac = mac
+
+
+class BatchMessage(Message):
+    """
+    Several messages sent in one datagram, each is handled as if it arrived on its own. Only sent in the binary format
+    and never nested.
+    """
+
+    def __init__(self, messages: list, recipient: str = None, sender: str = None):
+        super(BatchMessage, self).__init__(recipient=recipient, sender=sender)
+
+        self.messages = messages
@@ -0,0 +1,381 @@
+"""
+Optional reliable delivery of datagrams over UDP. Every datagram sent through a ReliableEndpoint gets a sequence
+number and is kept until the peer acknowledges it, unacknowledged datagrams are sent again after a retransmission
+timeout that adapts to the measured round trip time (RFC 6298, with exponential backoff and Karn's rule).
+
+    data: magic (2 bytes) | version (1 byte) | kind (1 byte) | epoch (4 bytes) | sequence (4 bytes) | datagram
+    ack:  magic (2 bytes) | version (1 byte) | kind (1 byte) | epoch (4 bytes) | cumulative (4 bytes) | bitmap (4 bytes)
+
+Acknowledgements are selective: cumulative is the lowest sequence number not yet received and bit n of the bitmap
+marks cumulative + 1 + n as received, so one lost datagram does not cause everything after it to be sent again, and
+three acknowledgements that skip it trigger an early retransmission. Received datagrams are handed on as soon as they
+arrive (fragments are reassembled by MessageTypes.framing, and messages are independent of each other), duplicates
+are dropped.
+
+Sequence numbers wrap around after 2^32 and are compared with serial number arithmetic (RFC 1982), a number comes
+before another if it is less than 2^31 behind it.
+
+Each sender picks a random epoch, a receiver that sees a new epoch from an address starts counting from zero again,
+so either side can restart without confusing the other. The magic starts with a null byte like the other frame types,
+peers that do not use reliable delivery can share a socket with ones that do.
+"""
+
+import struct
+import threading
+import time
+from collections import OrderedDict, deque
+
+from Cryptodome.Random.random import getrandbits
+
+MAGIC = b"\x00R"
+VERSION = 1
+
+# Frame kinds
+DATA = 0
+ACK = 1
+
+HEADER = struct.Struct(">2sBBII")
+_BITMAP = struct.Struct(">I")
+SACK_BITS = 32
+
+# Number of acknowledgements skipping a datagram before it is sent again without waiting for the timeout
+FAST_RETRANSMIT = 3
+
+INITIAL_RTO = 1.0
+
+_SEQ_MASK = 0xFFFFFFFF
+_SEQ_HALF = 0x80000000
+
+
+class ReliabilityError(ValueError):
+    """
+    Raised when a reliability frame is malformed
+    """
+
+
+def is_reliable(data: bytes) -> bool:
+    return data[:2] == MAGIC
+
+
+def _distance(a: int, b: int) -> int:
+    """
+    How far sequence number a is ahead of b, modulo 2^32
+    """
+    return (a - b) & _SEQ_MASK
+
+
+def _before(a: int, b: int) -> bool:
+    return 0 < _distance(b, a) < _SEQ_HALF
+
+
+def _acknowledged(seq: int, cumulative: int, bitmap: int) -> bool:
+    offset = _distance(seq, cumulative) - 1
+    return _before(seq, cumulative) or 0 <= offset < SACK_BITS and bool(bitmap >> offset & 1)
+
+
+class _Outgoing(object):
+    __slots__ = ("frame", "sent", "retries", "skipped")
+
+    def __init__(self, frame: bytes, sent: float):
+        self.frame = frame
+        self.sent = sent
+        self.retries = 0
+        self.skipped = 0
+
+
+class _Channel(object):
+    """
+    State kept for one peer, datagrams sent to it that are not yet acknowledged and the sequence numbers received
+    from it
+    """
+
+    def __init__(self, initial_rto: float):
+        # Sending
+        self.epoch = getrandbits(32)
+        self.next_seq = 0
+        self.unacked = OrderedDict()
+        self.backlog = deque()
+        self.srtt = None
+        self.rttvar = None
+        self.rto = initial_rto
+
+        # Receiving
+        self.peer_epoch = None
+        self.expected = 0
+        self.seen = set()
+
+    def sample(self, rtt: float, min_rto: float, max_rto: float):
+        """
+        Updates the round trip estimate and the retransmission timeout from one measurement
+        """
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(max(self.srtt + 4 * self.rttvar, min_rto), max_rto)
+
+    def accept(self, epoch: int, seq: int, max_gap: int) -> bool:
+        """
+        Records a received sequence number, returns False if it was received before
+        """
+        if epoch != self.peer_epoch:
+            self.peer_epoch = epoch
+            self.expected = 0
+            self.seen.clear()
+
+        if _before(seq, self.expected) or seq in self.seen:
+            return False
+
+        if _distance(seq, self.expected) >= max_gap:
+            # The sender gave up on the missing datagrams long ago, stop waiting for them
+            self.expected = (seq - max_gap + 1) & _SEQ_MASK
+            self.seen = {received for received in self.seen if not _before(received, self.expected)}
+
+        self.seen.add(seq)
+        while self.expected in self.seen:
+            self.seen.remove(self.expected)
+            self.expected = (self.expected + 1) & _SEQ_MASK
+        return True
+
+    def bitmap(self) -> int:
+        # expected itself is never in seen, bit n stands for expected + 1 + n
+        bits = 0
+        for n in range(SACK_BITS):
+            if (self.expected + 1 + n) & _SEQ_MASK in self.seen:
+                bits |= 1 << n
+        return bits
+
+
+class ReliableEndpoint(object):
+    """
+    Sends and receives datagrams reliably for any number of peers sharing one socket, sendto is the socket's sendto
+    (or anything with the same signature) and may be set after construction.
+
+    At most window datagrams per peer are in flight, further sends wait in a backlog of at most max_backlog datagrams
+    and are dropped beyond that. A datagram that is still not acknowledged after max_retries retransmissions is given
+    up on, the peer's other datagrams are not held up by it. Call start to retransmit from a background thread.
+    """
+
+    def __init__(self, sendto=None, window: int = 64, max_backlog: int = 4096, max_retries: int = 8,
+                 min_rto: float = 0.2, max_rto: float = 10.0, max_gap: int = 1024, max_peers: int = 10000,
+                 tick: float = 0.02):
+        self.sendto = sendto
+        self.window = window
+        self.max_backlog = max_backlog
+        self.max_retries = max_retries
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.max_gap = max_gap
+        self.max_peers = max_peers
+        self.tick = tick
+
+        self._channels = OrderedDict()
+        self._active = set()
+        self._lock = threading.Lock()
+
+        self._thread = None
+        self._stopped = threading.Event()
+
+        self.retransmitted = 0
+        self.duplicates = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def _channel(self, address) -> _Channel:
+        channel = self._channels.get(address)
+        if channel is None:
+            channel = self._channels[address] = _Channel(INITIAL_RTO)
+            while len(self._channels) > self.max_peers:
+                evicted, _ = self._channels.popitem(last=False)
+                self._active.discard(evicted)
+        else:
+            self._channels.move_to_end(address)
+        return channel
+
+    def _stamp(self, address, channel: _Channel, datagram: bytes) -> bytes:
+        seq = channel.next_seq
+        channel.next_seq = (seq + 1) & _SEQ_MASK
+
+        frame = HEADER.pack(MAGIC, VERSION, DATA, channel.epoch, seq) + datagram
+        channel.unacked[seq] = _Outgoing(frame, time.monotonic())
+        self._active.add(address)
+        return frame
+
+    def _retry(self, outgoing: _Outgoing, now: float) -> bytes:
+        outgoing.retries += 1
+        outgoing.sent = now
+        self.retransmitted += 1
+        return outgoing.frame
+
+    def _refill(self, address, channel: _Channel, frames: list):
+        while channel.backlog and len(channel.unacked) < self.window:
+            frames.append(self._stamp(address, channel, channel.backlog.popleft()))
+
+    def send(self, datagram: bytes, address) -> bool:
+        """
+        Sends datagram to address, or queues it if the window is full. Returns False if it had to be dropped.
+        """
+        with self._lock:
+            channel = self._channel(address)
+            if len(channel.unacked) >= self.window:
+                if len(channel.backlog) >= self.max_backlog:
+                    self.dropped += 1
+                    return False
+                channel.backlog.append(datagram)
+                return True
+            frame = self._stamp(address, channel, datagram)
+
+        self.sendto(frame, address)
+        return True
+
+    def prepare(self, datagrams: list) -> list:
+        """
+        Numbers (datagram, address) pairs the way send does, under one acquisition of the lock, and returns the
+        (frame, address) pairs to send now instead of sending them, so that a burst to many peers can be sent at once.
+        Datagrams beyond a peer's window are queued or dropped as by send.
+        """
+        frames = []
+        with self._lock:
+            for datagram, address in datagrams:
+                channel = self._channel(address)
+                if len(channel.unacked) < self.window:
+                    frames.append((self._stamp(address, channel, datagram), address))
+                elif len(channel.backlog) < self.max_backlog:
+                    channel.backlog.append(datagram)
+                else:
+                    self.dropped += 1
+        return frames
+
+    def receive(self, data: bytes, address) -> bytes:
+        """
+        Takes one received datagram and returns what it carries, or None for acknowledgements and duplicates.
+        Datagrams that were not sent reliably are returned unchanged.
+        """
+        if not is_reliable(data):
+            return data
+
+        if len(data) < HEADER.size:
+            raise ReliabilityError("Frame is truncated")
+        magic, version, kind, epoch, number = HEADER.unpack_from(data)
+        if version != VERSION:
+            raise ReliabilityError(f"Unsupported reliability version {version}")
+
+        if kind == ACK:
+            if len(data) < HEADER.size + _BITMAP.size:
+                raise ReliabilityError("Acknowledgement is truncated")
+            bitmap, = _BITMAP.unpack_from(data, HEADER.size)
+            self._acknowledge(address, epoch, number, bitmap)
+            return None
+        elif kind != DATA:
+            raise ReliabilityError(f"Unknown frame kind {kind}")
+
+        with self._lock:
+            channel = self._channel(address)
+            fresh = channel.accept(epoch, number, self.max_gap)
+            if not fresh:
+                self.duplicates += 1
+            ack = HEADER.pack(MAGIC, VERSION, ACK, epoch, channel.expected) + _BITMAP.pack(channel.bitmap())
+
+        # Duplicates are acknowledged again, the first acknowledgement may have been lost
+        self.sendto(ack, address)
+        return bytes(memoryview(data)[HEADER.size:]) if fresh else None
+
+    def _acknowledge(self, address, epoch: int, cumulative: int, bitmap: int):
+        now = time.monotonic()
+        frames = []
+        with self._lock:
+            channel = self._channels.get(address)
+            if channel is None or epoch != channel.epoch:
+                return
+
+            for seq in [seq for seq in channel.unacked if _acknowledged(seq, cumulative, bitmap)]:
+                outgoing = channel.unacked.pop(seq)
+                # Karn's rule, a retransmitted datagram's acknowledgement could belong to either copy
+                if not outgoing.retries:
+                    channel.sample(now - outgoing.sent, self.min_rto, self.max_rto)
+
+            outgoing = channel.unacked.get(cumulative)
+            if bitmap and outgoing is not None and not outgoing.retries:
+                outgoing.skipped += 1
+                if outgoing.skipped == FAST_RETRANSMIT:
+                    frames.append(self._retry(outgoing, now))
+
+            self._refill(address, channel, frames)
+            if not channel.unacked:
+                self._active.discard(address)
+
+        for frame in frames:
+            self.sendto(frame, address)
+
+    def retransmit(self) -> int:
+        """
+        Sends every datagram whose retransmission timeout has passed again, returns how many were sent
+        """
+        now = time.monotonic()
+        frames = []
+        with self._lock:
+            for address in list(self._active):
+                channel = self._channels[address]
+                # Each retransmission of the same datagram waits twice as long as the one before
+                expired = [seq for seq, outgoing in channel.unacked.items()
+                           if now - outgoing.sent >= min(channel.rto * 2 ** outgoing.retries, self.max_rto)]
+                if not expired:
+                    continue
+
+                for seq in expired:
+                    outgoing = channel.unacked[seq]
+                    if outgoing.retries >= self.max_retries:
+                        del channel.unacked[seq]
+                        self.failed += 1
+                    else:
+                        frames.append((self._retry(outgoing, now), address))
+
+                refilled = []
+                self._refill(address, channel, refilled)
+                frames.extend((frame, address) for frame in refilled)
+                if not channel.unacked:
+                    self._active.discard(address)
+
+        for frame, address in frames:
+            self.sendto(frame, address)
+        return len(frames)
+
+    def remove(self, address):
+        """
+        Forgets a peer, including anything still waiting to be acknowledged
+        """
+        with self._lock:
+            self._channels.pop(address, None)
+            self._active.discard(address)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="reliability")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.tick):
+            self.retransmit()
+
+    def close(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def stats(self) -> dict:
+        """
+        Counters for introspection
+        """
+        with self._lock:
+            return {
+                "peers": len(self._channels),
+                "in_flight": sum(len(self._channels[address].unacked) for address in self._active),
+                "retransmitted": self.retransmitted,
+                "duplicates": self.duplicates,
+                "failed": self.failed,
+                "dropped": self.dropped,
+            }
@@ -0,0 +1,82 @@
+"""
+Serves a server's metrics and sampling profiler (see Server.metrics) as JSON over HTTP, meant for localhost only:
+
+    GET  /metrics           snapshot of every counter, gauge and histogram
+    GET  /profile           hottest stacks and functions sampled so far
+    POST /profile/start     starts sampling (clearing earlier samples), optionally ?interval=seconds
+    POST /profile/stop      stops sampling, the samples stay readable
+
+Kept apart from Server.metrics so that servers without an admin port never import the HTTP server.
+"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from Server.metrics import Metrics
+
+
+class AdminHandler(BaseHTTPRequestHandler):
+    """
+    Serves the metrics and profiler of the server the admin server belongs to
+    """
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/metrics":
+            self.reply(200, self.server.metrics.snapshot())
+        elif url.path == "/profile":
+            limit = int(parse_qs(url.query).get("limit", ["25"])[0])
+            self.reply(200, self.server.metrics.profiler.report(limit))
+        else:
+            self.reply(404, {"error": f"Unknown path {url.path}"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        profiler = self.server.metrics.profiler
+        if url.path == "/profile/start":
+            interval = parse_qs(url.query).get("interval")
+            profiler.start(float(interval[0]) if interval else None)
+            self.reply(200, {"running": profiler.running, "interval_s": profiler.interval})
+        elif url.path == "/profile/stop":
+            profiler.stop()
+            self.reply(200, {"running": profiler.running, "samples": profiler.samples})
+        else:
+            self.reply(404, {"error": f"Unknown path {url.path}"})
+
+    def reply(self, status: int, body: dict):
+        data = bytes(json.dumps(body, indent=2, default=str), "utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # Scraping every few seconds would flood the server's output
+
+
+class AdminServer(ThreadingHTTPServer):
+    """
+    HTTP server for metrics, meant to be bound to localhost only
+    """
+
+    daemon_threads = True
+
+    def __init__(self, server_address: tuple, metrics: Metrics):
+        super(AdminServer, self).__init__(server_address, AdminHandler)
+        self.metrics = metrics
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="admin")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        if self._thread is not None:
+            self.shutdown()
+            self._thread = None
+        self.server_close()
+        self.metrics.profiler.stop()
@@ -0,0 +1,174 @@
+"""
+Admission control. Every budget is a token bucket, refilled at a steady rate up to a burst size, kept per client
+address or per user. Traffic over budget is dropped without an answer, answering would do the flood's work for it.
+
+    packets         datagrams per address, checked before anything is decoded
+    messages        messages relayed per user (per address before logging in)
+    key_exchange    key exchanges with the server per address
+    auth            registrations and logins per address
+    account         failed logins per username and address, checked before and charged after the password
+    resume          session resumptions per address
+
+Limits are given as name=rate/burst with the rate in tokens per second, e.g. key_exchange=1/3, or name=off.
+"""
+
+import threading
+import time
+from collections import Counter, OrderedDict
+
+# Tokens per second and burst size of every budget, None turns a budget off
+LIMITS = {
+    "packets": (2000.0, 4000),
+    "messages": (1000.0, 2000),
+    "key_exchange": (2.0, 5),
+    "auth": (2.0, 10),
+    "account": (0.2, 5),
+    "resume": (2.0, 5),
+}
+
+
+def parse_limits(specs: list) -> dict:
+    """
+    Parses limits such as ["key_exchange=1/3", "packets=off"], budgets that are left out keep their defaults
+    """
+    limits = dict(LIMITS)
+    for spec in specs or ():
+        name, _, value = spec.partition("=")
+        if name not in LIMITS:
+            raise ValueError(f"Unknown limit {name}, expected one of {', '.join(LIMITS)}")
+        if value == "off":
+            limits[name] = None
+            continue
+
+        rate, _, burst = value.partition("/")
+        rate = float(rate)
+        limits[name] = rate, int(burst) if burst else max(1, int(rate))
+    return limits
+
+
+class TokenBucket(object):
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated = now
+
+
+class RateLimiter(object):
+    """
+    Token buckets for one budget, keyed by address or username. Only the max_keys most recently seen keys are
+    remembered, a key that was forgotten starts over with a full bucket.
+    """
+
+    def __init__(self, rate: float, burst: int, max_keys: int = 100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _bucket(self, key) -> TokenBucket:
+        # Call with the lock held
+        now = time.monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(self.burst, now)
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+        return bucket
+
+    def allow(self, key, cost: float = 1.0) -> bool:
+        with self._lock:
+            bucket = self._bucket(key)
+            if bucket.tokens < cost:
+                return False
+            bucket.tokens -= cost
+            return True
+
+    def available(self, key, cost: float = 1.0) -> bool:
+        """
+        Whether key's bucket holds cost tokens, without taking them
+        """
+        with self._lock:
+            return self._bucket(key).tokens >= cost
+
+    def charge(self, key, cost: float = 1.0):
+        """
+        Takes cost tokens from key's bucket, as many as it holds if that is fewer
+        """
+        with self._lock:
+            bucket = self._bucket(key)
+            bucket.tokens = max(0.0, bucket.tokens - cost)
+
+    def __len__(self) -> int:
+        return len(self.buckets)
+
+
+class Admission(object):
+    """
+    Every budget of one server, plus the bound on requests being handled at once (max_in_flight, None for no bound)
+    """
+
+    def __init__(self, limits: dict = None, max_in_flight: int = None, max_keys: int = 100000):
+        limits = LIMITS if limits is None else limits
+        self.limiters = {name: RateLimiter(limit[0], limit[1], max_keys) for name, limit in limits.items() if limit}
+
+        self.max_in_flight = max_in_flight
+        self._in_flight = threading.BoundedSemaphore(max_in_flight) if max_in_flight else None
+
+        self.rejected = Counter()
+        self._lock = threading.Lock()
+
+    def allow(self, name: str, key) -> bool:
+        """
+        Takes a token from key's bucket of the named budget, returns False and counts the rejection if it is empty
+        """
+        limiter = self.limiters.get(name)
+        if limiter is None or limiter.allow(key):
+            return True
+        self.reject(name)
+        return False
+
+    def check(self, name: str, key) -> bool:
+        """
+        Like allow, but only checks for a token: budgets for outcomes, such as failed logins, are charged once the
+        outcome is known
+        """
+        limiter = self.limiters.get(name)
+        if limiter is None or limiter.available(key):
+            return True
+        self.reject(name)
+        return False
+
+    def charge(self, name: str, key):
+        limiter = self.limiters.get(name)
+        if limiter is not None:
+            limiter.charge(key)
+
+    def reject(self, name: str):
+        with self._lock:
+            self.rejected[name] += 1
+
+    def enter(self) -> bool:
+        """
+        Claims a place among the requests being handled, returns False if there is none. Call leave when done.
+        """
+        if self._in_flight is None:
+            return True
+        if self._in_flight.acquire(blocking=False):
+            return True
+        self.reject("queue")
+        return False
+
+    def leave(self):
+        if self._in_flight is not None:
+            self._in_flight.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            rejected = dict(self.rejected)
+        return {"rejected": rejected, "tracked": {name: len(limiter) for name, limiter in self.limiters.items()}}
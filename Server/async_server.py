@@ -0,0 +1,204 @@
+"""
+asyncio based server engine. Datagrams are received on a single event loop instead of a thread per datagram, relays
+are handled directly on the loop while key exchanges, registration, login and room requests run on bounded executors.
+"""
+
+import asyncio
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Type
+
+from MessageTypes.message import LoginMessage, RoomMessage, ResumeMessage, Message
+from Server.server import ServerStateMixin, ThreadedUDPHandler
+
+
+class TransportSocket(object):
+    """
+    Wraps a datagram transport so handlers can keep calling sendto, sends made from executor threads are handed back
+    to the event loop since transports are not thread safe
+    """
+
+    def __init__(self, transport: asyncio.DatagramTransport, loop: asyncio.AbstractEventLoop):
+        self.transport = transport
+        self.loop = loop
+        self.loop_thread = threading.get_ident()
+
+    def sendto(self, data: bytes, address: tuple):
+        if threading.get_ident() == self.loop_thread:
+            self.transport.sendto(data, address)
+        else:
+            self.loop.call_soon_threadsafe(self.transport.sendto, data, address)
+
+    def sendto_many(self, datagrams: list):
+        """
+        Sends (datagram, address) pairs, from another thread with one wake up of the event loop for all of them
+        """
+        if threading.get_ident() == self.loop_thread:
+            self._send_all(datagrams)
+        else:
+            self.loop.call_soon_threadsafe(self._send_all, datagrams)
+
+    def _send_all(self, datagrams: list):
+        sendto = self.transport.sendto
+        for data, address in datagrams:
+            sendto(data, address)
+
+
+class AsyncUDPProtocol(asyncio.DatagramProtocol):
+    """
+    Instantiates the server's request handler for every received datagram
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.sock = None
+
+    def connection_made(self, transport: asyncio.DatagramTransport):
+        self.sock = TransportSocket(transport, asyncio.get_running_loop())
+        self.server.sendto = self.server.reliability.sendto = self.sock.sendto
+        self.server.sendto_many = self.sock.sendto_many
+
+    def datagram_received(self, data: bytes, address: tuple):
+        # Executors bound the work in flight, only the per-address budget is checked before decoding
+        if not self.server.admission.allow("packets", address):
+            return
+        try:
+            self.server.RequestHandlerClass((data, self.sock), address, self.server)
+        except Exception as e:
+            # Same policy as socketserver, report the failed request and keep serving
+            self.server.handle_error(address, e)
+
+    def error_received(self, exc: Exception):
+        print(f"Socket error: {exc}")
+
+
+class AsyncUDPServer(ServerStateMixin):
+    """
+    Event loop counterpart to ThreadedUDPServer, shares its client list and database handling. Work that would block
+    the loop is submitted to one of two executors, each bounded by max_pending outstanding jobs. Datagrams that
+    arrive while an executor is full are dropped and counted, the same way an overloaded socket buffer would drop them.
+    """
+
+    def __init__(self, server_address: tuple, request_handler_class: Type[ThreadedUDPHandler], db_path: str,
+                 session_ttl: float = None, crypto_workers: int = None, db_workers: int = 4, auth_workers: int = 16,
+                 max_pending: int = 1024, reuse_port: bool = False):
+        self.setup_state(db_path, session_ttl, db_pool_size=db_workers)
+
+        self.RequestHandlerClass = request_handler_class
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.socket.bind(server_address)
+        self.server_address = self.socket.getsockname()
+
+        # One database worker per pooled connection, so workers never wait on each other for a connection
+        self.crypto_executor = ThreadPoolExecutor(max_workers=crypto_workers or os.cpu_count(),
+                                                  thread_name_prefix="crypto")
+        self.db_executor = ThreadPoolExecutor(max_workers=db_workers, thread_name_prefix="database")
+        # Registration and login mostly wait for the password hashing processes, a burst of them must not hold up the
+        # room and mailbox work on the database executor
+        self.auth_executor = ThreadPoolExecutor(max_workers=auth_workers, thread_name_prefix="auth")
+
+        self.max_pending = max_pending
+        self._pending = {self.crypto_executor: 0, self.db_executor: 0, self.auth_executor: 0}
+        self._pending_lock = threading.Lock()
+        self.dropped = 0
+        self.metrics.gauge("executor_dropped", lambda: self.dropped)
+        self.metrics.gauge("executor_pending", lambda: {"crypto": self._pending[self.crypto_executor],
+                                                        "database": self._pending[self.db_executor],
+                                                        "auth": self._pending[self.auth_executor]})
+
+        self.loop = None
+        self._stopped = None
+
+    def submit(self, executor: ThreadPoolExecutor, func, *args) -> bool:
+        """
+        Runs func on executor unless it already has max_pending jobs outstanding, returns whether the job was accepted
+        """
+        with self._pending_lock:
+            if self._pending[executor] >= self.max_pending:
+                self.dropped += 1
+                return False
+            self._pending[executor] += 1
+
+        future = executor.submit(func, *args)
+        future.add_done_callback(lambda f: self._finished(executor, f))
+        return True
+
+    def _finished(self, executor: ThreadPoolExecutor, future):
+        with self._pending_lock:
+            self._pending[executor] -= 1
+
+        if future.exception() is not None:
+            self.handle_error(None, future.exception())
+
+    @staticmethod
+    def handle_error(client_address, error: Exception):
+        print("-" * 40)
+        print(f"Exception occurred during processing of request from {client_address}: {error!r}")
+        print("-" * 40)
+
+    async def _serve(self):
+        self.loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+
+        transport, _ = await self.loop.create_datagram_endpoint(lambda: AsyncUDPProtocol(self), sock=self.socket)
+        try:
+            await self._stopped.wait()
+        finally:
+            transport.close()
+
+    def serve_forever(self):
+        """
+        Runs the event loop in the calling thread until shutdown is called
+        """
+        asyncio.run(self._serve())
+
+    def shutdown(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._stopped.set)
+
+        self.crypto_executor.shutdown(wait=False)
+        self.db_executor.shutdown(wait=False)
+        self.auth_executor.shutdown(wait=False)
+
+    def server_close(self):
+        self.socket.close()
+        self.close_state()
+
+
+class AsyncUDPHandler(ThreadedUDPHandler):
+    """
+    ThreadedUDPHandler that decodes and relays on the event loop and pushes everything else onto an executor
+    """
+
+    def handle(self):
+        raw = self.reassemble(self.request[0])
+        if raw is None or self.relay(raw):
+            return
+        for data in self.unbatch(self.decode(raw)):
+            if self.admit(data):
+                self.schedule(data)
+
+    def schedule(self, data: Message):
+        """
+        Relays data right away or hands it to the executor for its kind of work
+        """
+        if data.recipient.startswith("#") or type(data) is RoomMessage:
+            # Room membership may have to be read from the database
+            self.server.submit(self.server.db_executor, self.dispatch, data)
+        elif data.recipient != "root":
+            self.dispatch(data)
+        elif isinstance(data, LoginMessage):  # Includes RegisterMessage
+            self.server.submit(self.server.auth_executor, self.dispatch, data)
+        elif isinstance(data, ResumeMessage):
+            self.server.submit(self.server.db_executor, self.dispatch, data)
+        else:
+            self.server.submit(self.server.crypto_executor, self.dispatch, data)
+
+    def store(self, data):
+        # Looking up the recipient may query the database, keep it off the event loop
+        self.server.submit(self.server.db_executor, super(AsyncUDPHandler, self).store, data)
@@ -0,0 +1,118 @@
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache(object):
+    """
+    Thread safe LRU cache whose entries also expire after a time to live. Holds at most max_size entries, adding one
+    more evicts the least recently used.
+
+    Negative results (a lookup that found nothing) can be cached too by storing None, they expire after negative_ttl
+    which is usually much shorter than ttl.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 300.0, negative_ttl: float = 30.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key, default=_MISSING):
+        """
+        Returns the cached value for key, or default if there is no live entry. Without a default a miss returns the
+        module's sentinel so that a cached None can be told apart from a miss, check it with is_miss.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+            self.misses += 1
+        return default
+
+    @staticmethod
+    def is_miss(value) -> bool:
+        return value is _MISSING
+
+    def set(self, key, value):
+        """
+        Stores value under key, replacing any existing entry
+        """
+        self._store(key, value, replace=True)
+
+    def add(self, key, value) -> bool:
+        """
+        Stores value under key unless a live entry already exists, returns whether it was stored. Lets a reader cache
+        what it looked up without overwriting a newer value a writer set in the meantime.
+        """
+        return self._store(key, value, replace=False)
+
+    def _store(self, key, value, replace: bool) -> bool:
+        now = time.monotonic()
+        expires = now + (self.negative_ttl if value is None else self.ttl)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if not replace and entry is not None and entry[1] > now:
+                return False
+
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return True
+
+    def pop(self, key, default=None):
+        """
+        Removes the entry for key and returns its value, or default if there is no live entry
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[1] <= now:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return entry[0]
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """
+        Counters for introspection
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -4,4 +4,33 @@ create table users (
     username text not null unique,
     password blob not null,
     salt text not null
-);
\ No newline at end of file
+);
+drop table if exists messages;
+create table messages (
+    id integer primary key,
+    recipient text not null,
+    sender text,
+    payload blob not null,
+    created real not null
+);
+create index messages_by_recipient on messages (recipient, id);
+
+drop table if exists room_invites;
+drop table if exists room_members;
+drop table if exists rooms;
+create table rooms (
+    id integer primary key,
+    name text not null unique,
+    owner text not null
+);
+create table room_members (
+    room integer not null references rooms (id),
+    username text not null,
+    primary key (room, username)
+);
+create index room_members_by_username on room_members (username);
+create table room_invites (
+    room integer not null references rooms (id),
+    username text not null,
+    primary key (room, username)
+);
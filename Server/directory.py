@@ -0,0 +1,290 @@
+"""
+Session directory shared by the worker processes of a supervised server (see Server.supervisor).
+
+Every worker keeps a replica of which worker holds the session of each logged in user. Workers announce logins and
+logouts to each other over unix datagram sockets in a run directory, and a relay for a user whose session lives in
+another worker is passed to that worker over the same sockets, since only it knows the user's key, wire format and
+reliable delivery state. A relay to many users of the same worker (a room) names them all in one message, separated by
+null bytes. Workers also tell each other when a room's membership changed so they reload it, and share resumption
+tickets: a client resuming from a new address usually lands on another worker, which needs the ticket to take the
+session over.
+
+Announcements to every worker are queued and sent by a thread of their own, so callers holding the session registry's
+lock never wait on a peer's socket.
+
+    message: kind (1 byte) | worker (2 bytes) | username length (2 bytes) | username | payload
+"""
+
+import os
+import queue
+import socket
+import struct
+import threading
+
+from Server.sessions import SessionRegistry
+from Server.tickets import Ticket
+from Util.resumption import TICKET_SIZE
+
+# Message kinds
+BIND = 0
+UNBIND = 1
+RELAY = 2
+SYNC = 3
+ROOM = 4
+TICKET = 5
+DROP_TICKET = 6
+
+HEADER = struct.Struct(">BHH")
+
+# Size of a resumption secret, a SHA3-256 digest
+SECRET_SIZE = 32
+
+RECEIVE_SIZE = 256 * 1024
+
+
+def socket_path(run_dir: str, index: int) -> str:
+    return os.path.join(run_dir, f"worker-{index}.sock")
+
+
+class Directory(object):
+    """
+    One worker's view of the shared directory. Lookups are answered from the local replica without any IPC.
+    """
+
+    def __init__(self, index: int, workers: int, run_dir: str, timeout: float = 1.0):
+        self.index = index
+        self.workers = workers
+        self.run_dir = run_dir
+
+        self.routes = {}
+        self._lock = threading.Lock()
+
+        self.path = socket_path(run_dir, index)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(self.path)
+        # Sends block while a peer's queue is full, but never for long if that peer is stuck
+        self.sock.settimeout(timeout)
+
+        # Announcements waiting for the sender thread, None stops it
+        self._outbox = queue.SimpleQueue()
+
+        self.server = None
+        self._thread = None
+        self._sender = None
+
+        self.forwarded = 0
+        self.failed = 0
+
+    def _send(self, worker: int, kind: int, username: str, payload: bytes = b""):
+        name = bytes(username, "utf-8")
+        try:
+            self.sock.sendto(HEADER.pack(kind, self.index, len(name)) + name + payload,
+                             socket_path(self.run_dir, worker))
+        except OSError:
+            # The worker is not running (yet), its queue stayed full or the payload is too large
+            self.failed += 1
+
+    def _broadcast(self, kind: int, username: str, payload: bytes = b""):
+        self._outbox.put((kind, username, payload))
+
+    def _send_announcements(self):
+        while True:
+            announcement = self._outbox.get()
+            if announcement is None:
+                break
+            for worker in range(self.workers):
+                if worker != self.index:
+                    self._send(worker, *announcement)
+
+    def bound(self, username: str):
+        """
+        Announces that username logged in on this worker
+        """
+        with self._lock:
+            self.routes[username] = self.index
+        self._broadcast(BIND, username)
+
+    def unbound(self, username: str):
+        """
+        Announces that username's session on this worker is gone, unless another worker has taken it over
+        """
+        with self._lock:
+            if self.routes.get(username) != self.index:
+                return
+            del self.routes[username]
+        self._broadcast(UNBIND, username)
+
+    def owner(self, username: str) -> int:
+        """
+        Returns the index of the worker holding username's session, or None if the user is not logged in
+        """
+        return self.routes.get(username)
+
+    def forward(self, username: str, payload: bytes) -> bool:
+        """
+        Passes an encoded message to the worker holding username's session, returns False if that is no other worker
+        """
+        owner = self.routes.get(username)
+        if owner is None or owner == self.index:
+            return False
+
+        self._send(owner, RELAY, username, payload)
+        self.forwarded += 1
+        return True
+
+    def forward_many(self, usernames: list, payload: bytes):
+        """
+        Passes an encoded message to every worker holding sessions of usernames, once per worker
+        """
+        by_owner = {}
+        for username in usernames:
+            owner = self.routes.get(username)
+            if owner is not None and owner != self.index:
+                by_owner.setdefault(owner, []).append(username)
+
+        for owner, names in by_owner.items():
+            # The username field has a 16 bit length, split very large rooms over several messages
+            batch, size = [], 0
+            for name in names:
+                length = len(bytes(name, "utf-8")) + 1
+                if batch and size + length > 0xFFFF:
+                    self._send(owner, RELAY, "\x00".join(batch), payload)
+                    batch, size = [], 0
+                batch.append(name)
+                size += length
+            self._send(owner, RELAY, "\x00".join(batch), payload)
+            self.forwarded += 1
+
+    def room_changed(self, name: str):
+        """
+        Announces that a room's membership changed, every worker (this one included) reloads it on next use
+        """
+        self.server.rooms.invalidate(name)
+        self._broadcast(ROOM, name)
+
+    def ticket_issued(self, ticket_id: bytes, ticket: Ticket):
+        """
+        Hands a ticket this worker issued to every other worker, so the session can resume on any of them
+        """
+        self._broadcast(TICKET, ticket.username,
+                        ticket_id + ticket.secret + bytes(ticket.cipher_mode, "utf-8"))
+
+    def ticket_dropped(self, ticket_id: bytes):
+        """
+        Tells every other worker that a ticket was redeemed or replaced
+        """
+        self._broadcast(DROP_TICKET, "", ticket_id)
+
+    def start(self, server):
+        """
+        Starts handling messages from other workers for server and asks them for the users they hold
+        """
+        self.server = server
+        self._thread = threading.Thread(target=self._listen, name="directory")
+        self._thread.daemon = True
+        self._thread.start()
+        self._sender = threading.Thread(target=self._send_announcements, name="directory-sender")
+        self._sender.daemon = True
+        self._sender.start()
+
+        self._broadcast(SYNC, "")
+
+    def _listen(self):
+        while True:
+            try:
+                data = self.sock.recv(RECEIVE_SIZE)
+            except socket.timeout:
+                continue
+            except OSError:
+                break  # Closed
+
+            try:
+                self._handle(data)
+            except Exception as e:
+                print(f"Directory failed to handle a message: {e!r}")
+
+    def _handle(self, data: bytes):
+        kind, worker, length = HEADER.unpack_from(data)
+        username = str(data[HEADER.size:HEADER.size + length], "utf-8")
+
+        if kind == BIND:
+            with self._lock:
+                self.routes[username] = worker
+
+            # The user logged in elsewhere, stop routing to any session we still have for them
+            self.server.client_list.release(username)
+            # and forget a cached "no such user" from before they registered on the other worker
+            self.server.users.cache.invalidate(username)
+        elif kind == UNBIND:
+            with self._lock:
+                if self.routes.get(username) == worker:
+                    del self.routes[username]
+        elif kind == RELAY:
+            payload = data[HEADER.size + length:]
+            for name in username.split("\x00"):
+                self.server.deliver(name, payload)
+        elif kind == ROOM:
+            self.server.rooms.invalidate(username)
+        elif kind == TICKET:
+            payload = data[HEADER.size + length:]
+            ticket_id, secret = payload[:TICKET_SIZE], payload[TICKET_SIZE:TICKET_SIZE + SECRET_SIZE]
+            cipher_mode = str(payload[TICKET_SIZE + SECRET_SIZE:], "utf-8")
+            self.server.tickets.add(ticket_id, Ticket(secret, username, cipher_mode))
+        elif kind == DROP_TICKET:
+            self.server.tickets.discard(data[HEADER.size + length:])
+        elif kind == SYNC:
+            with self._lock:
+                local = [name for name, owner in self.routes.items() if owner == self.index]
+            for name in local:
+                self._send(worker, BIND, name)
+
+    def close(self):
+        if self._sender is not None:
+            self._outbox.put(None)
+            self._sender.join(timeout=2)
+            self._sender = None
+        self.sock.close()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class SharedSessionRegistry(SessionRegistry):
+    """
+    SessionRegistry that publishes every username it gains or loses to the directory
+    """
+
+    def __init__(self, ttl: float, directory: Directory, max_sessions: int = None, anonymous_ttl: float = None):
+        super(SharedSessionRegistry, self).__init__(ttl, max_sessions, anonymous_ttl)
+        self.directory = directory
+
+    def bind(self, session, username: str) -> bool:
+        with self._lock:
+            previous = session.username if self._by_username.get(session.username) is session else None
+            if not super(SharedSessionRegistry, self).bind(session, username):
+                return False
+
+        if previous is not None and previous != username:
+            self.directory.unbound(previous)
+        if username is not None:
+            self.directory.bound(username)
+        return True
+
+    def _unindex(self, session):
+        username = session.username
+        indexed = username is not None and self._by_username.get(username) is session
+        super(SharedSessionRegistry, self)._unindex(session)
+
+        if indexed:
+            self.directory.unbound(username)
+
+    def release(self, username: str):
+        """
+        Drops the local route for username without announcing it, another worker has taken the user over
+        """
+        with self._lock:
+            self._by_username.pop(username, None)
@@ -0,0 +1,92 @@
+import sqlite3
+import time
+from concurrent.futures import Future
+
+from Util.db import BatchWriter, ConnectionPool
+
+INSERT_MESSAGE = "INSERT INTO messages(recipient, sender, payload, created) VALUES (?,?,?,?)"
+SELECT_MESSAGES = "SELECT id, sender, payload FROM messages WHERE recipient=? AND created>=? ORDER BY id"
+DELETE_MESSAGES = "DELETE FROM messages WHERE recipient=? AND id<=?"
+TRIM_MESSAGES = "DELETE FROM messages WHERE recipient=? AND id<=(SELECT id FROM messages WHERE recipient=? " \
+                "ORDER BY id DESC LIMIT 1 OFFSET ?)"
+PURGE_MESSAGES = "DELETE FROM messages WHERE created<?"
+
+# Marks a flush request in the write queue
+_FLUSH = object()
+
+
+class MessageStore(BatchWriter):
+    """
+    Persistent per user queue of messages relayed while the recipient was offline, kept in the messages table.
+
+    Messages are appended by the batch writer thread, many per transaction, and a user's whole queue is read and
+    cleared in one transaction when they log in. Messages older than retention seconds are not delivered and are
+    purged periodically, each user keeps at most max_messages (the oldest are dropped first), and payloads larger than
+    max_payload bytes are refused.
+    """
+
+    def __init__(self, pool: ConnectionPool, batch_size: int = 256, retention: float = 7 * 24 * 3600.0,
+                 max_messages: int = 1000, max_payload: int = 64 * 1024, purge_interval: float = 60.0):
+        super(MessageStore, self).__init__(pool, batch_size, "message-store-writer")
+        self.retention = retention
+        self.max_messages = max_messages
+        self.max_payload = max_payload
+        self.purge_interval = purge_interval
+
+        self._last_purge = time.monotonic()
+
+    def append(self, recipient: str, sender: str, payload: bytes) -> Future:
+        """
+        Queues an encoded message for recipient, the returned future resolves to whether it was stored
+        """
+        if len(payload) > self.max_payload:
+            future = Future()
+            future.set_result(False)
+            return future
+
+        return self.submit((recipient, sender, bytes(payload), time.time()))
+
+    def flush(self):
+        """
+        Blocks until every message appended so far is committed
+        """
+        self.submit(_FLUSH).result()
+
+    def drain(self, recipient: str) -> list:
+        """
+        Removes and returns every live message queued for recipient as (sender, payload) tuples, oldest first
+        """
+        # Messages appended just before the recipient logged in may still be waiting for the writer
+        self.flush()
+
+        with self.pool.connection() as connection:
+            with connection:
+                rows = connection.execute(SELECT_MESSAGES, (recipient, time.time() - self.retention)).fetchall()
+                if rows:
+                    connection.execute(DELETE_MESSAGES, (recipient, rows[-1]["id"]))
+
+        return [(row["sender"], row["payload"]) for row in rows]
+
+    def _write(self, connection: sqlite3.Connection, batch: list):
+        messages = [item for item, _ in batch if item is not _FLUSH]
+        try:
+            if messages:
+                connection.executemany(INSERT_MESSAGE, messages)
+
+                # Only users that just received something can be over the cap
+                for recipient in {message[0] for message in messages}:
+                    connection.execute(TRIM_MESSAGES, (recipient, recipient, self.max_messages))
+
+            if time.monotonic() - self._last_purge >= self.purge_interval:
+                connection.execute(PURGE_MESSAGES, (time.time() - self.retention,))
+                self._last_purge = time.monotonic()
+
+            connection.commit()
+        except sqlite3.Error as e:
+            connection.rollback()
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        for _, future in batch:
+            future.set_result(True)
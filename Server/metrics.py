@@ -0,0 +1,231 @@
+"""
+Counters, gauges and latency histograms for the server's hot paths, and a sampling profiler that can be switched on
+and off while the server runs. Both are served as JSON over HTTP on a local admin port, see Server.admin.
+"""
+
+import bisect
+import sys
+import threading
+import time
+from collections import Counter
+
+# Upper bounds of the histogram buckets in seconds, 10µs to about 84s in steps of a factor of 1.25 keeps the error of
+# an estimated percentile under 25%
+BUCKETS = tuple(1e-5 * 1.25 ** i for i in range(72))
+
+
+class Histogram(object):
+    """
+    Latency distribution with fixed logarithmic buckets, recording a value costs a binary search and an increment
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        index = bisect.bisect_left(BUCKETS, seconds)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def percentile(self, fraction: float) -> float:
+        """
+        Upper bound of the bucket holding the given fraction of recorded values, in seconds
+        """
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(BUCKETS[index], self.max) if index < len(BUCKETS) else self.max
+        return 0.0
+
+    def summary(self) -> dict:
+        with self._lock:
+            if not self.count:
+                return {"count": 0}
+            return {
+                "count": self.count,
+                "mean_ms": self.total / self.count * 1000,
+                "p50_ms": self.percentile(0.50) * 1000,
+                "p90_ms": self.percentile(0.90) * 1000,
+                "p99_ms": self.percentile(0.99) * 1000,
+                "max_ms": self.max * 1000,
+            }
+
+
+class Timer(object):
+    """
+    Context manager recording the time spent inside it to a histogram
+    """
+
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Metrics(object):
+    """
+    Named counters and histograms, created on first use, plus gauges that are read when a snapshot is taken. Levels
+    are gauges that go up and down with the work in progress, such as requests being handled.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.counters = Counter()
+        self.levels = Counter()
+        self.histograms = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+        self.profiler = SamplingProfiler()
+
+    def increment(self, name: str, amount: int = 1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def level(self, name: str, delta: int):
+        with self._lock:
+            self.levels[name] += delta
+
+    def histogram(self, name: str) -> Histogram:
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(name, Histogram())
+        return histogram
+
+    def observe(self, name: str, seconds: float):
+        self.histogram(name).observe(seconds)
+
+    def timer(self, name: str) -> Timer:
+        """
+        Times a block of code: with metrics.timer("dh"): ...
+        """
+        return Timer(self.histogram(name))
+
+    def gauge(self, name: str, read):
+        """
+        Registers read, a function without arguments, whose result is reported under name in every snapshot
+        """
+        self.gauges[name] = read
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+            gauges = dict(self.levels)
+            histograms = list(self.histograms.items())
+
+        for name, read in list(self.gauges.items()):
+            try:
+                gauges[name] = read()
+            except Exception as e:
+                gauges[name] = repr(e)
+
+        return {
+            "uptime_s": time.time() - self.started,
+            "counters": counters,
+            "gauges": gauges,
+            "latency": {name: histogram.summary() for name, histogram in sorted(histograms)},
+            "profiling": self.profiler.running,
+        }
+
+
+class SamplingProfiler(object):
+    """
+    Periodically records the stack of every thread but its own. Costs nothing while stopped, while running the cost
+    grows with the number of threads and falls with the interval.
+    """
+
+    def __init__(self, interval: float = 0.005, max_depth: int = 32):
+        self.interval = interval
+        self.max_depth = max_depth
+
+        self.stacks = Counter()
+        self.samples = 0
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, interval: float = None):
+        if self.running:
+            return
+        if interval is not None:
+            self.interval = interval
+
+        with self._lock:
+            self.stacks = Counter()
+            self.samples = 0
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, name="sampling-profiler")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _sample(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            sampled = []
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{code.co_filename}:{code.co_name}:{frame.f_lineno}")
+                    frame = frame.f_back
+                # Outermost call first, the same order as a flame graph's collapsed stacks
+                sampled.append(";".join(reversed(stack)))
+
+            with self._lock:
+                self.stacks.update(sampled)
+                self.samples += 1
+
+    def report(self, limit: int = 25) -> dict:
+        """
+        Most frequently sampled stacks, and functions by how often they were on top of a stack (self) or anywhere in
+        it (total)
+        """
+        with self._lock:
+            stacks = self.stacks.copy()
+        own, total = Counter(), Counter()
+        for stack, count in stacks.items():
+            functions = [frame.rsplit(":", 1)[0] for frame in stack.split(";")]
+            own[functions[-1]] += count
+            for function in set(functions):
+                total[function] += count
+
+        return {
+            "running": self.running,
+            "interval_s": self.interval,
+            "samples": self.samples,
+            "self": own.most_common(limit),
+            "total": total.most_common(limit),
+            "stacks": stacks.most_common(limit),
+        }
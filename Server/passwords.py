@@ -0,0 +1,173 @@
+"""
+Password hashing with a deliberately slow key derivation function, run in a pool of worker processes so that hashing
+neither holds the GIL of the process serving requests nor blocks more than one request thread per login.
+
+Hashes are stored as the KDF's name and parameters followed by the derived key, the salt stays in its own column:
+
+    scrypt$n=16384,r=8,p=1$<hex>
+    pbkdf2_sha256$iterations=600000$<hex>
+
+Hashes without a "$" are the plain SHA3-256 hex digests of password + salt that earlier versions stored. Both are
+verified, and a successful login with anything but the configured KDF and parameters is rehashed.
+"""
+
+import hashlib
+import hmac
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+from Cryptodome.Hash import SHA3_256
+
+KDFS = ("scrypt", "pbkdf2_sha256")
+
+DEFAULTS = {
+    "scrypt": {"n": 16384, "r": 8, "p": 1},
+    "pbkdf2_sha256": {"iterations": 600000},
+}
+
+
+class Busy(Exception):
+    """
+    Raised when the hashing queue is full, the request should be refused rather than queued
+    """
+
+
+def parse(spec: str) -> (str, dict):
+    """
+    Parses a KDF specification such as "scrypt", "scrypt:n=32768" or "pbkdf2_sha256:iterations=100000", parameters
+    that are left out keep their defaults
+    """
+    name, _, options = spec.partition(":")
+    if name not in KDFS:
+        raise ValueError(f"Unknown KDF {name}, expected one of {', '.join(KDFS)}")
+
+    params = dict(DEFAULTS[name])
+    for option in filter(None, options.split(",")):
+        key, _, value = option.partition("=")
+        if key not in params:
+            raise ValueError(f"Unknown parameter {key} for {name}")
+        params[key] = int(value)
+    return name, params
+
+
+def encode_params(params: dict) -> str:
+    return ",".join(f"{key}={value}" for key, value in sorted(params.items()))
+
+
+def derive(name: str, params: dict, password: str, salt: str) -> str:
+    """
+    Hashes password with the given KDF, returns the encoded hash. Runs in the worker processes.
+    """
+    if name == "scrypt":
+        n, r = params["n"], params["r"]
+        key = hashlib.scrypt(bytes(password, "utf-8"), salt=bytes(salt, "utf-8"), n=n, r=r, p=params["p"],
+                             maxmem=256 * n * r, dklen=32)
+    else:
+        key = hashlib.pbkdf2_hmac("sha256", bytes(password, "utf-8"), bytes(salt, "utf-8"), params["iterations"])
+    return f"{name}${encode_params(params)}${key.hex()}"
+
+
+def verify(encoded: str, password: str, salt: str) -> bool:
+    """
+    Checks password against a stored hash of either format. Runs in the worker processes.
+    """
+    if "$" not in encoded:
+        expected = SHA3_256.new(bytes(password + salt, "utf-8")).hexdigest()
+    else:
+        name, options, _ = encoded.split("$")
+        params = {key: int(value) for key, value in (option.split("=") for option in options.split(","))}
+        expected = derive(name, params, password, salt)
+    return hmac.compare_digest(expected, encoded)
+
+
+def _ready() -> bool:
+    return True
+
+
+class PasswordHasher(object):
+    """
+    Hashes and verifies passwords with the configured KDF in worker processes (in the calling thread if workers is
+    0). At most max_pending operations may wait or run at once, beyond that hash and check raise Busy right away so
+    that a burst of logins is refused quickly instead of queuing up behind each other and timing out.
+    """
+
+    def __init__(self, spec: str = "scrypt", workers: int = None, max_pending: int = 256, timeout: float = 30.0):
+        self.name, self.params = parse(spec)
+        self.prefix = f"{self.name}${encode_params(self.params)}$"
+        self.timeout = timeout
+
+        self.max_pending = max_pending
+        self._pending = 0
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+        self.workers = os.cpu_count() if workers is None else workers
+        self.executor = None
+        if self.workers:
+            # Forking a process full of threads can copy locks in a held state, start clean interpreters instead
+            self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                mp_context=multiprocessing.get_context("spawn"))
+
+    def start(self, wait: bool = False):
+        """
+        Starts the worker processes now rather than on the first login. They come up in the background unless wait is
+        set, a server can take requests meanwhile and only logins wait for them.
+        """
+        if self.executor is not None:
+            futures = [self.executor.submit(_ready) for _ in range(self.workers)]
+            for future in futures if wait else ():
+                future.result()
+
+    def _run(self, func, *args):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise Busy("Too many passwords waiting to be hashed")
+            self._pending += 1
+
+        try:
+            if self.executor is None:
+                return func(*args)
+
+            future = self.executor.submit(func, *args)
+            try:
+                return future.result(self.timeout)
+            except TimeoutError:
+                future.cancel()
+                raise Busy("Timed out waiting for a password hash")
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def hash(self, password: str, salt: str) -> str:
+        """
+        Returns the encoded hash of password with the configured KDF, blocks until it is computed
+        """
+        return self._run(derive, self.name, self.params, password, salt)
+
+    def check(self, encoded: str, password: str, salt: str) -> bool:
+        """
+        Returns whether password matches the stored hash, blocks until it is computed
+        """
+        return self._run(verify, encoded, password, salt)
+
+    def needs_rehash(self, encoded: str) -> bool:
+        """
+        Whether a stored hash was made with anything but the configured KDF and parameters
+        """
+        return not encoded.startswith(self.prefix)
+
+    def close(self):
+        if self.executor is not None:
+            # A worker still waiting for work may never see the stop sentinel, and joining it at exit would hang
+            processes = list((self.executor._processes or {}).values())
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            for process in processes:
+                process.terminate()
+            self.executor = None
@@ -0,0 +1,195 @@
+import sqlite3
+import threading
+
+from Server.cache import TTLCache
+from Util.db import BatchWriter, ConnectionPool
+
+SELECT_ROOM = "SELECT id, name, owner FROM rooms WHERE name=?"
+SELECT_MEMBERS = "SELECT username FROM room_members WHERE room=?"
+SELECT_INVITES = "SELECT username FROM room_invites WHERE room=?"
+SELECT_ROOMS_OF = "SELECT rooms.name FROM rooms JOIN room_members ON room_members.room=rooms.id " \
+                  "WHERE room_members.username=?"
+INSERT_ROOM = "INSERT INTO rooms(name, owner) VALUES (?,?)"
+INSERT_MEMBER = "INSERT OR IGNORE INTO room_members(room, username) SELECT id, ? FROM rooms WHERE name=?"
+DELETE_MEMBER = "DELETE FROM room_members WHERE username=? AND room=(SELECT id FROM rooms WHERE name=?)"
+INSERT_INVITE = "INSERT OR IGNORE INTO room_invites(room, username) SELECT id, ? FROM rooms WHERE name=?"
+DELETE_INVITE = "DELETE FROM room_invites WHERE username=? AND room=(SELECT id FROM rooms WHERE name=?)"
+
+# Write kinds
+_CREATE = 0
+_JOIN = 1
+_LEAVE = 2
+_INVITE = 3
+
+
+class Room(object):
+    """
+    A named room, the usernames of its members and of the users invited to join it
+    """
+
+    __slots__ = ("name", "owner", "members", "invites")
+
+    def __init__(self, name: str, owner: str, members: set, invites: set = frozenset()):
+        self.name = name
+        self.owner = owner
+        self.members = members
+        self.invites = invites
+
+
+class RoomStore(BatchWriter):
+    """
+    Rooms, their members and pending invites, kept in the rooms, room_members and room_invites tables. Rooms are loaded
+    into memory the first time they are used and membership is answered from memory from then on, the cache holds the
+    most recently used rooms and reads the others from the database again on their next use. Invites, joins and leaves
+    are applied to memory at once and written by the batch writer thread, creating a room waits for its commit since
+    the name may be taken. Only users a member invited can join.
+
+    Room keys never reach the server: members make them and pass them to each other over the keys they share with one
+    another, see ClientInfo.share_room_key.
+    """
+
+    def __init__(self, pool: ConnectionPool, batch_size: int = 256, cache: TTLCache = None):
+        super(RoomStore, self).__init__(pool, batch_size, "room-store-writer")
+        self.cache = cache if cache is not None else TTLCache(max_size=10000, ttl=3600.0)
+        self._lock = threading.Lock()
+
+        # Called with a room's name after a change to it is committed, lets other processes reload it
+        self.on_change = None
+
+    def get(self, name: str) -> Room:
+        """
+        Returns the room called name or None if there is no such room
+        """
+        room = self.cache.get(name, None)
+        if room is not None:
+            return room
+
+        # Changes to a room that was dropped from the cache may still be queued
+        self.submit(None).result()
+
+        with self.pool.connection() as connection:
+            row = connection.execute(SELECT_ROOM, (name,)).fetchone()
+            if row is None:
+                return None
+            members = {member["username"] for member in connection.execute(SELECT_MEMBERS, (row["id"],))}
+            invites = {invite["username"] for invite in connection.execute(SELECT_INVITES, (row["id"],))}
+
+        return self._cache(Room(row["name"], row["owner"], members, invites))
+
+    def _cache(self, room: Room) -> Room:
+        # Another thread may have loaded the room, or created it, in the meantime
+        if self.cache.add(room.name, room):
+            return room
+        return self.cache.get(room.name, room)
+
+    def create(self, name: str, owner: str) -> Room:
+        """
+        Creates a room with owner as its first member, returns None if the name is taken
+        """
+        if not self.submit((_CREATE, (name, owner))).result():
+            return None
+
+        return self._cache(Room(name, owner, {owner}))
+
+    def invite(self, name: str, inviter: str, username: str) -> bool:
+        """
+        Lets username join a room, returns False if there is no such room or inviter is not a member
+        """
+        room = self.get(name)
+        if room is None or inviter not in room.members:
+            return False
+
+        if username not in room.members:
+            with self._lock:
+                room.invites = room.invites | {username}
+            self.submit((_INVITE, (username, name)))
+        return True
+
+    def join(self, name: str, username: str) -> Room:
+        """
+        Adds username to a room and uses up their invite, returns None if there is no such room or username was not
+        invited
+        """
+        room = self.get(name)
+        if room is None or (username not in room.invites and username not in room.members):
+            return None
+
+        with self._lock:
+            room.members = room.members | {username}
+            room.invites = room.invites - {username}
+        self.submit((_JOIN, (username, name)))
+        return room
+
+    def leave(self, name: str, username: str) -> bool:
+        """
+        Removes username from a room, returns False if they were not a member
+        """
+        room = self.get(name)
+        if room is None or username not in room.members:
+            return False
+
+        with self._lock:
+            room.members = room.members - {username}
+        self.submit((_LEAVE, (username, name)))
+        return True
+
+    def rooms_of(self, username: str) -> list:
+        """
+        Returns every room username is a member of
+        """
+        # Writes for this user may still be queued
+        self.submit(None).result()
+
+        with self.pool.connection() as connection:
+            names = [row["name"] for row in connection.execute(SELECT_ROOMS_OF, (username,))]
+        return [room for room in map(self.get, names) if room is not None and username in room.members]
+
+    def invalidate(self, name: str):
+        """
+        Drops a room from memory so the next use reads it from the database again
+        """
+        self.cache.invalidate(name)
+
+    def _write(self, connection: sqlite3.Connection, batch: list):
+        results = []
+        changed = set()
+        try:
+            for item, future in batch:
+                if item is None:  # Flush
+                    results.append((future, True))
+                    continue
+
+                kind, params = item
+                if kind == _CREATE:
+                    name, owner = params
+                    try:
+                        connection.execute(INSERT_ROOM, params)
+                    except sqlite3.IntegrityError:
+                        results.append((future, False))
+                        continue
+                    connection.execute(INSERT_MEMBER, (owner, name))
+                elif kind == _INVITE:
+                    username, name = params
+                    connection.execute(INSERT_INVITE, params)
+                elif kind == _JOIN:
+                    username, name = params
+                    connection.execute(INSERT_MEMBER, params)
+                    connection.execute(DELETE_INVITE, params)
+                else:
+                    username, name = params
+                    connection.execute(DELETE_MEMBER, params)
+                changed.add(name)
+                results.append((future, True))
+            connection.commit()
+        except sqlite3.Error as e:
+            connection.rollback()
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        if self.on_change is not None:
+            for name in changed:
+                self.on_change(name)
+
+        for future, result in results:
+            future.set_result(result)
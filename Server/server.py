@@ -1,34 +1,115 @@
+import argparse
 import socketserver
 import sqlite3
 import threading
+import time
 from typing import Type
 
-import yaml
 from Cryptodome.Hash import SHA3_256
-from Cryptodome.Random.random import randrange, getrandbits
-
-from MessageTypes.message import EncryptedMessage, KeyExchangeMessage, LoginMessage, RegisterMessage, Message
-from Util.prime_helper import PrimeHelper
+from Cryptodome.Random import get_random_bytes
+from Cryptodome.Random.random import getrandbits
+
+from MessageTypes import codec, framing, reliability
+from MessageTypes.message import EncryptedMessage, KeyExchangeMessage, LoginMessage, RegisterMessage, RoomMessage, \
+    ResumeMessage, BatchMessage, Message, EAX
+from Server.admission import Admission, parse_limits
+from Server.message_store import MessageStore
+from Server.metrics import Metrics
+from Server.passwords import Busy, PasswordHasher
+from Server.room_store import RoomStore
+from Server.sessions import SessionRegistry
+from Server.tickets import TicketStore
+from Server.user_store import UserStore
+from Util import dh, resumption, startup
+from Util.group_params import load_groups
 
 
 # TODO: Add client class to simplify client list
 
 
-class ThreadedUDPServer(socketserver.ThreadingMixIn, socketserver.UDPServer):
+class ServerStateMixin(object):
     """
-    Essentially a socketserver.UDPServer, with the addition of a persistent client list. Dispatches an instance of
-    the specified request_handler_class for each request and passes on relevant request information.
+    Persistent client list and database access shared by every server engine
     """
 
-    def __init__(self, server_address: tuple, request_handler_class: Type[socketserver.BaseRequestHandler],
-                 db_path: str):
-        super(ThreadedUDPServer, self).__init__(server_address, request_handler_class)
-
+    def setup_state(self, db_path: str, session_ttl: float = None, params_path: str = "data/prime.bin",
+                    db_pool_size: int = 4):
         self.db_path = db_path
 
-        self.client_list = {}
+        # Pooled connections used by register and login, the database property below is for setup scripts
+        self.users = UserStore(db_path, db_pool_size)
+
+        # Hashes in the calling thread, create_server replaces it with one that uses worker processes
+        self.passwords = PasswordHasher(workers=0)
+
+        # Messages for users that are offline wait here until they log in, sharing the user store's connections
+        self.mailbox = MessageStore(self.users.pool)
+
+        self.rooms = RoomStore(self.users.pool)
+        startup.mark("database")
+
+        # Group parameters are read once here and shared by every session
+        self.groups = load_groups(params_path)
+        startup.mark("group parameters")
+
+        # Sessions that never log in are dropped after five minutes, create_server applies the configured limits
+        self.client_list = SessionRegistry(session_ttl, max_sessions=1000000, anonymous_ttl=300.0)
+
+        # Expires sessions in the background as well, sweeps otherwise only happen when datagrams arrive
+        self._reaping = threading.Event()
+        self._reaper = threading.Thread(target=self._reap, name="session-reaper")
+        self._reaper.daemon = True
+        self._reaper.start()
         self._database = None
 
+        # Lets clients that logged in resume their session from a new address without another key exchange
+        self.tickets = TicketStore()
+
+        # Messages larger than one datagram are split on the way out and collected per client on the way in
+        self.fragmenter = framing.Fragmenter()
+        self.reassembler = framing.Reassembler()
+
+        # Acknowledgements and retransmission for clients that send reliably, the engine sets the socket to use
+        self.reliability = reliability.ReliableEndpoint()
+        self.reliability.start()
+
+        # Sends a datagram from the server's socket, set by the engine
+        self.sendto = None
+
+        # Routes to sessions held by other worker processes, only set when running under Server.supervisor
+        self.directory = None
+
+        # Rate limits per address and per user, and the bound on requests the threaded engine handles at once
+        self.admission = Admission(max_in_flight=1024)
+
+        # Hot path counters and latencies, served over HTTP when create_server is given an admin port
+        self.metrics = Metrics()
+        self.metrics.gauge("sessions", lambda: self.client_list.stats())
+        self.metrics.gauge("threads", threading.active_count)
+        self.metrics.gauge("user_cache", lambda: {"hits": self.users.cache.hits, "misses": self.users.cache.misses})
+        self.metrics.gauge("reassembler_dropped", lambda: self.reassembler.dropped)
+        self.metrics.gauge("reliability", self.reliability.stats)
+        self.metrics.gauge("tickets", self.tickets.stats)
+        self.metrics.gauge("admission", lambda: self.admission.stats())
+        self.metrics.gauge("passwords", lambda: {"pending": self.passwords.pending,
+                                                 "rejected": self.passwords.rejected})
+        self.admin = None
+        startup.mark("sessions, reliability and metrics")
+
+    def _reap(self, interval: float = 5.0):
+        while not self._reaping.wait(interval):
+            self.client_list.expire()
+            self.reassembler.expire()
+
+    def start_admin(self, port: int):
+        """
+        Serves the metrics and profiler on localhost:port, see Server.admin
+        """
+        from Server.admin import AdminServer
+
+        self.admin = AdminServer(("localhost", port), self.metrics)
+        self.admin.start()
+
     def connect_db(self):
         connection = sqlite3.connect(self.db_path)
         connection.row_factory = sqlite3.Row
@@ -55,15 +136,106 @@ class ThreadedUDPServer(socketserver.ThreadingMixIn, socketserver.UDPServer):
             self.database.cursor().executescript(f.read())
         self.database.commit()
 
+    def deliver(self, username: str, payload: bytes):
+        """
+        Delivers a binary encoded message that another worker process relayed to a user whose session is held here
+        """
+        session = self.client_list.find(username)
+        if session is not None:
+            if session.wire_format != codec.BINARY:
+                payload = codec.encode(codec.decode(payload), session.wire_format)
+            self.send_datagrams(payload, session)
+            return
+
+        # The user went offline in the meantime
+        data = codec.decode(payload)
+        if type(data) is EncryptedMessage:
+            self.mailbox.append(username, data.sender, payload)
+
+    def send_datagrams(self, payload: bytes, recipient):
+        """
+        Fragments an encoded message and sends it to a session, reliably if the client sends reliably
+        """
+        self.metrics.increment("bytes_out", len(payload))
+        for datagram in self.fragmenter.fragment(payload):
+            if recipient.reliable:
+                self.reliability.send(datagram, recipient.ip_address)
+            else:
+                self.sendto(datagram, recipient.ip_address)
+
+    def sendto_many(self, datagrams: list):
+        """
+        Sends (datagram, address) pairs from the server's socket, engines that can hand a burst to the socket at once
+        replace it
+        """
+        for datagram, address in datagrams:
+            self.sendto(datagram, address)
+
+    def close_state(self):
+        self._reaping.set()
+        if self.admin is not None:
+            self.admin.close()
+            self.admin = None
+        self.reliability.close()
+        self.passwords.close()
+        self.mailbox.close()
+        self.rooms.close()
+        self.users.close()
+        if self._database:
+            self._database.close()
+            self._database = None
+
+
+class ThreadedUDPServer(ServerStateMixin, socketserver.ThreadingMixIn, socketserver.UDPServer):
+    """
+    Essentially a socketserver.UDPServer, with the addition of a persistent client list. Dispatches an instance of
+    the specified request_handler_class for each request and passes on relevant request information.
+    """
+
+    # socketserver reads 8192 bytes per datagram by default, fragments and whole frames can be larger
+    max_packet_size = framing.RECEIVE_SIZE
+
+    def __init__(self, server_address: tuple, request_handler_class: Type[socketserver.BaseRequestHandler],
+                 db_path: str, session_ttl: float = None, reuse_port: bool = False):
+        # Lets several worker processes bind the same port, see Server.supervisor
+        self.allow_reuse_port = reuse_port
+
+        super(ThreadedUDPServer, self).__init__(server_address, request_handler_class)
+
+        self.setup_state(db_path, session_ttl)
+        self.sendto = self.reliability.sendto = self.socket.sendto
+
+    def process_request(self, request: tuple, client_address: tuple):
+        # Shed load before a thread is started or anything is decoded
+        if not self.admission.allow("packets", client_address):
+            return
+        if not self.admission.enter():
+            return
+        try:
+            super(ThreadedUDPServer, self).process_request(request, client_address)
+        except Exception:
+            self.admission.leave()
+            raise
+
+    def process_request_thread(self, request: tuple, client_address: tuple):
+        try:
+            super(ThreadedUDPServer, self).process_request_thread(request, client_address)
+        finally:
+            self.admission.leave()
+
+    def server_close(self):
+        super(ThreadedUDPServer, self).server_close()
+        self.close_state()
+
 
 class ThreadedUDPHandler(socketserver.BaseRequestHandler):
     """
     Handle Client Connections
     """
 
-    def __init__(self, request: tuple, client_address: str, dispatcher: ThreadedUDPServer):
-        if client_address not in dispatcher.client_list:  # Add new clients to the server client list
-            dispatcher.client_list[client_address] = ClientInfo(client_address, self)
+    def __init__(self, request: tuple, client_address: str, dispatcher: ServerStateMixin):
+        # Add new clients to the server client list, either way mark the session as active
+        self.client = dispatcher.client_list.get_or_create(client_address, lambda: ClientInfo(client_address))
 
         self.cipher = None
 
@@ -71,8 +243,10 @@ class ThreadedUDPHandler(socketserver.BaseRequestHandler):
 
     @staticmethod
     def decode_yaml(msg: bytes):
+        import yaml
+
         try:
-            return yaml.load(msg)
+            return yaml.load(msg, Loader=codec.yaml_loader())
         except yaml.YAMLError:
             return msg
 
@@ -97,110 +271,681 @@ class ThreadedUDPHandler(socketserver.BaseRequestHandler):
         """
         Receives data from client, prints data before forwarding to all other clients
         """
-        data = self.decode_yaml(self.request[0].strip())
-        client = self.server.client_list[self.client_address]
+        raw = self.reassemble(self.request[0])
+        if raw is not None and not self.relay(raw):
+            for data in self.unbatch(self.decode(raw)):
+                if self.admit(data):
+                    self.dispatch(data)
+
+    def reassemble(self, datagram: bytes) -> bytes:
+        """
+        Returns the complete message once its last fragment arrives, None while fragments are still missing or if
+        the datagram was an acknowledgement, a duplicate, malformed or a fragment the reassembler refused
+        """
+        self.server.metrics.increment("bytes_in", len(datagram))
+
+        if reliability.is_reliable(datagram):
+            # Answer reliably as well once the client shows it supports it
+            self.client.reliable = True
+            try:
+                datagram = self.server.reliability.receive(datagram, self.client_address)
+            except reliability.ReliabilityError:
+                return None  # Malformed
+            if datagram is None:
+                return None
+
+        try:
+            return self.server.reassembler.feed(self.client_address, datagram)
+        except framing.FramingError:
+            return None  # Malformed, or a message larger than the reassembler takes
+
+    def relay(self, raw: bytes) -> bool:
+        """
+        Fast path for binary frames from one user to another, which the server cannot read anyway: routes on the
+        header alone and sends the received bytes on unchanged. Returns False if raw has to be decoded instead, because
+        it is addressed to the server or a room, is a batch, a room key or YAML, or its recipient is not online.
+        """
+        if not codec.is_binary(raw):
+            return False
+        try:
+            msg_type, recipient, sender = codec.peek(raw)
+        except codec.CodecError:
+            return False  # Let decode report it
+        if (msg_type in (codec.BATCH, codec.ROOM) or recipient is None or recipient == "root"
+                or recipient.startswith("#")):
+            return False
+        if self.spoofed(sender):
+            return True  # Dropped
+        if not self.server.admission.allow("messages", self.client.username or self.client_address):
+            return True  # Dropped
+
+        metrics = self.server.metrics
+        start = time.perf_counter()
+        self.client.wire_format = codec.BINARY
+
+        with metrics.timer("lookup"):
+            session = self.server.client_list.find(recipient)
+        if session is not None:
+            self.send_encoded(raw, session)
+        else:
+            # Messages for offline users are only stored once decoded, the mailbox keeps nothing else
+            directory = self.server.directory
+            if directory is None or not directory.forward(recipient, raw):
+                return False
+
+        metrics.observe("relay", time.perf_counter() - start)
+        return True
+
+    def spoofed(self, sender: str) -> bool:
+        """
+        Checks the sender a message to other users names against the session it arrived on, True if it is to be
+        dropped: the client is not logged in or claims to be someone else
+        """
+        if self.client.username is not None and sender == self.client.username:
+            return False
+        self.server.metrics.increment("spoofed")
+        return True
+
+    def decode(self, raw: bytes) -> Message:
+        """
+        Decodes a received datagram and records the wire format the client is speaking, returns None if it is not a
+        message
+        """
+        try:
+            with self.server.metrics.timer("decode"):
+                data = codec.decode(raw)
+        except codec.CodecError:
+            self.server.metrics.increment("malformed")
+            return None
+
+        # Reply in the format the client last spoke, clients that never send binary frames keep receiving YAML
+        if codec.is_binary(raw):
+            self.client.wire_format = codec.BINARY
+
+        return data
+
+    def admit(self, data: Message) -> bool:
+        """
+        Checks data against the budget for what it asks of the server, False if it is to be dropped
+        """
+        admission = self.server.admission
+        if data.recipient != "root":
+            return admission.allow("messages", self.client.username or self.client_address)
+        if type(data) is KeyExchangeMessage:
+            return admission.allow("key_exchange", self.client_address)
+        if isinstance(data, LoginMessage):  # Includes RegisterMessage
+            return admission.allow("auth", self.client_address)
+        if type(data) is ResumeMessage:
+            return admission.allow("resume", self.client_address)
+        return True
+
+    def unbatch(self, data: Message) -> tuple:
+        """
+        Messages a datagram carried, clients may send several in one BatchMessage. Only messages with a recipient are
+        passed on, a YAML document can hold a message with any fields.
+        """
+        if type(data) is BatchMessage:
+            self.server.metrics.increment("batched", len(data.messages))
+            messages = data.messages
+        else:
+            messages = data,
+        return tuple(message for message in messages if self.valid(message))
+
+    @staticmethod
+    def valid(data: object) -> bool:
+        return (isinstance(data, Message) and isinstance(data.recipient, str)
+                and (data.sender is None or isinstance(data.sender, str)))
+
+    @staticmethod
+    def kind(data: Message) -> str:
+        """
+        Name a message is timed under in the metrics, its type if it is addressed to the server
+        """
+        if data.recipient == "root":
+            return type(data).__name__
+        return "room" if data.recipient.startswith("#") else "relay"
+
+    def dispatch(self, data: Message):
+        """
+        Handles a decoded message, timing it by kind
+        """
+        metrics = self.server.metrics
+        metrics.level("handlers", 1)
+        start = time.perf_counter()
+        try:
+            self.route(data)
+        finally:
+            metrics.observe(self.kind(data), time.perf_counter() - start)
+            metrics.level("handlers", -1)
+
+    def route(self, data: Message):
+        """
+        Handles messages addressed to the server (key exchange, register, login) and relays everything else
+        """
+        client = self.client
 
         if data.recipient == "root":
+            codec.attach_key(data, client.key)
+
+            # Answer with whichever cipher mode the client encrypts with
+            if isinstance(data, LoginMessage):
+                client.cipher_mode = data.username.mode
+            elif isinstance(data, EncryptedMessage):
+                client.cipher_mode = data.mode
+
             if type(data) is KeyExchangeMessage:
-                client.dh_key_exchange(data.prime, data.root, data.public)
+                if codec.BINARY in (getattr(data, "formats", None) or ()):
+                    client.wire_format = codec.BINARY
+                client.dh_key_exchange(self, data.prime, data.root, data.public)
             elif type(data) is RegisterMessage:
-                client.register(data.username.decrypt(), data.password.decrypt())
+                client.register(self, data.username.decrypt(), data.password.decrypt())
             elif type(data) is LoginMessage:
-                client.login(data.username.decrypt(), data.password.decrypt())
+                client.login(self, data.username.decrypt(), data.password.decrypt())
+            elif type(data) is RoomMessage:
+                client.room_request(self, data.request, data.room, data.text)
+            elif type(data) is ResumeMessage:
+                client.resume(self, data.ticket_id, data.nonce, getattr(data, "mac", None))
             elif type(data) is EncryptedMessage:
                 print(data.decrypt(), data.recipient)
+        elif self.spoofed(data.sender):
+            return
+        elif data.recipient.startswith("#"):
+            self.fan_out(data)
+        elif type(data) is RoomMessage and not self.members(data.room, data.sender, data.recipient):
+            return  # Room keys are only passed between members of the room
+        else:
+            with self.server.metrics.timer("lookup"):
+                recipient = self.server.client_list.find(data.recipient)
+
+            if recipient is not None:
+                self.send_object(data, recipient)
+            elif not self.forward(data):
+                self.store(data)
+
+    def forward(self, data: Message) -> bool:
+        """
+        Passes a message on to the worker process that holds the recipient's session, returns False if no other
+        worker does (or this server is not supervised)
+        """
+        directory = self.server.directory
+        return directory is not None and directory.forward(data.recipient, codec.encode(data))
+
+    def members(self, name: str, *usernames: str) -> bool:
+        """
+        Whether every one of usernames is a member of the room called name
+        """
+        rooms = self.server.rooms
+        room = rooms.get(name) if isinstance(name, str) else None
+        if room is not None and not room.members.issuperset(usernames):
+            # Another worker process may have changed the room since it was loaded
+            rooms.invalidate(name)
+            room = rooms.get(name)
+        return room is not None and room.members.issuperset(usernames)
+
+    def online_members(self, room, exclude: str = None) -> list:
+        """
+        Returns the members of room that are logged in here or at another worker process, sorted by name
+        """
+        directory = self.server.directory
+        return sorted(member for member in room.members if member != exclude and (
+            self.server.client_list.find(member) is not None
+            or directory is not None and directory.owner(member) is not None))
+
+    def notify(self, obj: Message):
+        """
+        Sends a message from the server to the user it is addressed to, through the worker process holding their
+        session if it is not held here
+        """
+        session = self.server.client_list.find(obj.recipient)
+        if session is not None:
+            self.send_object(obj, session)
         else:
-            recipient = None
-            for address, user in self.server.client_list.items():
-                if user.username == data.recipient:
-                    recipient = user
+            self.forward(obj)
+
+    def fan_out(self, data: Message):
+        """
+        Relays a message addressed to "#" + room to every other member of the room. The message is encoded once per
+        wire format and sent to every online member in one burst from this thread, members held by other worker
+        processes get it through one directory message per worker and offline members through the mailbox.
+        """
+        room = self.server.rooms.get(data.recipient[1:])
+        if room is None or self.client.username not in room.members:
+            print(f"Dropped message from {self.client.username} to {data.recipient}, not a member")
+            return
+
+        online, remote, offline = [], [], []
+        directory = self.server.directory
+        for member in room.members:
+            if member == self.client.username:
+                continue
+            session = self.server.client_list.find(member)
+            if session is not None:
+                online.append(session)
+            elif directory is not None and directory.owner(member) not in (None, directory.index):
+                remote.append(member)
+            else:
+                offline.append(member)
+
+        payload = codec.encode(data)
+        self.send_many(payload, online)
+        if remote:
+            directory.forward_many(remote, payload)
+        if type(data) is EncryptedMessage:
+            for member in offline:
+                self.server.mailbox.append(member, data.sender, payload)
+
+    def send_many(self, payload: bytes, recipients: list):
+        """
+        Sends one binary encoded message to many recipients, it is encoded and fragmented at most once per wire format.
+        The datagrams for every recipient are collected first and handed to the server's sendto_many in one call,
+        reliable ones are numbered under a single acquisition of the reliability lock.
+        """
+        datagrams = {codec.BINARY: self.server.fragmenter.fragment(payload)}
+        unreliable, reliable = [], []
+        sent = 0
+        for recipient in recipients:
+            if recipient.wire_format not in datagrams:
+                datagrams[recipient.wire_format] = self.server.fragmenter.fragment(
+                    codec.encode(codec.decode(payload), recipient.wire_format))
+
+            batch = reliable if recipient.reliable else unreliable
+            for datagram in datagrams[recipient.wire_format]:
+                batch.append((datagram, recipient.ip_address))
+                sent += len(datagram)
+
+        if reliable:
+            unreliable.extend(self.server.reliability.prepare(reliable))
+        self.server.sendto_many(unreliable)
+        self.server.metrics.increment("bytes_out", sent)
+
+    def store(self, data: Message):
+        """
+        Keeps a message for a registered user that is not logged in, to be delivered when they log in
+        """
+        # Key exchanges need both sides online, only messages encrypted with an established key are worth keeping
+        if type(data) is not EncryptedMessage:
+            return
+        if self.server.users.get_user(data.recipient) is None:
+            print(f"Dropped message for unknown user {data.recipient}")
+            return
 
-            self.send_yaml(data, recipient)
+        self.server.mailbox.append(data.recipient, data.sender, codec.encode(data))
+
+    def deliver_stored(self, recipient):
+        """
+        Sends everything that was stored for recipient while they were offline
+        """
+        for _, payload in self.server.mailbox.drain(recipient.username):
+            self.send_encoded(payload, recipient)
+
+    def send_object(self, obj: object, recipient):
+        """
+        Encodes obj with the wire format negotiated with the recipient and sends it
+        """
+        self.send_message(codec.encode(obj, recipient.wire_format), recipient)
+
+    def send_encoded(self, payload: bytes, recipient):
+        """
+        Sends a message that is already binary encoded, re-encoding it for recipients that speak YAML
+        """
+        if recipient.wire_format == codec.BINARY:
+            self.send_message(payload, recipient)
+        else:
+            self.send_object(codec.decode(payload), recipient)
 
     def send_yaml(self, obj: object, recipient):
+        import yaml
+
         self.send_message(yaml.dump(obj), recipient)
 
-    def send_message(self, msg: str, recipient):
+    def send_message(self, msg: str or bytes, recipient):
         """
         Sends encoded message to client
         """
-        self.request[1].sendto(bytes(msg, "utf-8"), recipient.ip_address)
+        if isinstance(msg, str):
+            msg = bytes(msg, "utf-8")
+        self.server.send_datagrams(msg, recipient)
 
     def send_encrypted_message(self, msg: str, recipient):
         """
         Encrypts and sends message if key is established or begins key exchange if no key exists
         """
-        self.send_message(yaml.dump(EncryptedMessage(recipient.key, msg)), recipient)
+        with self.server.metrics.timer("encrypt"):
+            message = EncryptedMessage(recipient.key, msg, mode=recipient.cipher_mode)
+        self.send_object(message, recipient)
 
 
 class ClientInfo(object):
     """
-    Basic class to hold client information (username, ip address, etc)
+    Basic class to hold client information (username, ip address, etc). Sessions outlive the requests that create
+    them and a server may hold millions, so they keep nothing but their own state: the handler of the request being
+    served is passed to every method that needs the server or has to answer.
     """
 
-    def __init__(self, client_address, handler: ThreadedUDPHandler, username=None, key=None):
+    __slots__ = ("ip_address", "username", "key", "wire_format", "cipher_mode", "reliable", "ticket", "last_seen")
+
+    def __init__(self, client_address, username=None, key=None):
         self.ip_address = client_address
         self.username = username
         self.key = key
+        self.wire_format = codec.YAML
+        self.cipher_mode = EAX
+        self.reliable = False
 
-        # read prime for use in key exchange
-        self.prime_dump = "data/prime.bin"
-        self.helper = PrimeHelper(self.prime_dump)
-        self.helper.read()
-
-        self.handler = handler
+        # Identifier of the resumption ticket last issued to this session
+        self.ticket = None
 
-    def dh_key_exchange(self, prime: int, root: int, received_public: int):
-        secret = randrange(1, prime)  # Random integer between 1 and prime - 1: to be kept secret
+        # time.monotonic() of the last datagram, kept up to date by SessionRegistry
+        self.last_seen = 0.0
 
-        public = (root ** secret) % prime  # Public part, shared in the clear
+    def dh_key_exchange(self, handler: ThreadedUDPHandler, prime: int, root: int, received_public: int):
+        # Only accept groups the server knows, the client picks which one
+        group = handler.server.groups.find(prime, root)
+        try:
+            if group is None:
+                raise ValueError("Unknown group parameters")
+            dh.validate_public(group.prime, received_public)
+        except ValueError:
+            handler.send_object(KeyExchangeMessage("Key Exchange Rejected"), self)
+            return
 
-        self.handler.send_yaml(KeyExchangeMessage("Key Exchange Accepted"), self)
-        self.handler.send_yaml(Message(public), self)  # Send public information
+        with handler.server.metrics.timer("dh"):
+            secret, public = dh.generate_keypair(group.prime, group.root)  # Public part, shared in the clear
 
-        # Calculate and return shared secret
-        self.key = SHA3_256.new(self.handler.int_to_bytes((received_public ** secret) % self.helper.prime)).digest()
+            # Calculate shared secret before replying, the client may use it as soon as it has our public part
+            shared = dh.shared_secret(group.prime, secret, received_public)
+        self.key = SHA3_256.new(handler.int_to_bytes(shared)).digest()
 
-    def register(self, username, password):
-        cursor = self.handler.server.database.cursor()
+        handler.send_object(KeyExchangeMessage("Key Exchange Accepted"), self)
+        handler.send_object(Message(public), self)  # Send public information
 
+    def register(self, handler: ThreadedUDPHandler, username, password):
         salt = str(getrandbits(64))
-        statement = "INSERT INTO users(username, password, salt) VALUES (?,?,?)"
+        try:
+            with handler.server.metrics.timer("kdf"):
+                hashed = handler.server.passwords.hash(password, salt)
+        except Busy:
+            handler.send_encrypted_message("Server Busy, Try Again Later.", self)
+            return
+
+        # Blocks until the batch this registration was written in is committed
+        with handler.server.metrics.timer("db"):
+            added = handler.server.users.add_user(username, hashed, salt)
+        if added and not handler.server.client_list.bind(self, username):
+            # Evicted or expired while the password was hashed, the account exists and the client has to log in
+            handler.send_encrypted_message("Session Expired, Reconnect.", self)
+        elif added:
+            # The ticket goes out before the reply, a client may log in again as soon as it has the reply
+            self.send_ticket(handler)
+
+            handler.send_encrypted_message("Successfully Registered.", self)
+        else:
+            handler.send_encrypted_message("Username Already Registered.", self)
+
+    def login(self, handler: ThreadedUDPHandler, username, password):
+        # Only failed logins use up the account's budget, and only from the address they came from: wrong passwords
+        # sent from elsewhere cannot lock the owner out
+        admission, account = handler.server.admission, (username, self.ip_address[0])
+        if not admission.check("account", account):
+            handler.send_encrypted_message("Server Busy, Try Again Later.", self)
+            return
+
+        passwords = handler.server.passwords
+        with handler.server.metrics.timer("db"):
+            user = handler.server.users.get_user(username)
 
         try:
-            cursor.execute(statement, (username, SHA3_256.new(bytes(password + salt, "utf-8")).hexdigest(), salt))
-            self.handler.send_encrypted_message("Successfully Registered.", self)
+            with handler.server.metrics.timer("kdf"):
+                valid = user is not None and passwords.check(user["password"], password, user["salt"])
+        except Busy:
+            handler.send_encrypted_message("Server Busy, Try Again Later.", self)
+            return
+
+        if valid and not handler.server.client_list.bind(self, username):
+            handler.send_encrypted_message("Session Expired, Reconnect.", self)
+        elif valid:
+            self.send_ticket(handler)
+
+            handler.send_encrypted_message("Login Successful.", self)
+            self.catch_up(handler)
+
+            # Hashes made with an older KDF or cost can only be upgraded while the password is at hand
+            if passwords.needs_rehash(user["password"]):
+                self.rehash(handler, username, password, user["salt"])
+        else:
+            admission.charge("account", account)
+            handler.send_encrypted_message("Login Failed.", self)
 
-            self.username = username
-        except sqlite3.IntegrityError:
-            self.handler.send_encrypted_message("Username Already Registered.", self)
+    def catch_up(self, handler: ThreadedUDPHandler):
+        """
+        Gets a client that just logged in their room keys and sends the messages stored while they were offline
+        """
+        for room in handler.server.rooms.rooms_of(self.username):
+            self.share_room_key(handler, room)
+        handler.deliver_stored(self)
 
-        self.handler.server.database.commit()
-        self.handler.server.database.close()
-        self.handler.server.database = None
+    def issue_ticket(self, handler: ThreadedUDPHandler, username: str) -> EncryptedMessage:
+        """
+        Replaces this session's resumption ticket with a new one for username and the current key, returns the
+        ticket's identifier encrypted under that key
+        """
+        tickets = handler.server.tickets
+        if self.ticket is not None:
+            tickets.revoke(self.ticket)
+        self.ticket = tickets.issue(resumption.resumption_secret(self.key), username, self.cipher_mode)
+        return EncryptedMessage(self.key, self.ticket.hex(), mode=self.cipher_mode)
 
-    def login(self, username, password):
-        cursor = self.handler.server.database.cursor()
-        username = username
+    def send_ticket(self, handler: ThreadedUDPHandler):
+        """
+        Sends a resumption ticket to clients that negotiated the binary codec, older clients would not understand it
+        """
+        if self.wire_format == codec.BINARY:
+            ticket = self.issue_ticket(handler, self.username)
+            handler.send_object(ResumeMessage("ticket", ticket, recipient=self.username), self)
 
-        saved_user, saved_pass, salt = cursor.execute("SELECT username, password, salt FROM users WHERE username=?",
-                                                      (username,)).fetchone()
+    def resume(self, handler: ThreadedUDPHandler, ticket_id: bytes, nonce: bytes, mac: bytes):
+        """
+        Restores the session a ticket was issued for, under a key derived from the ticket's secret and both nonces.
+        Nothing is bound or sent unless mac proves the client holds the ticket's secret, a request with a wrong one
+        leaves the ticket to its owner.
+        """
+        tickets, ticket = handler.server.tickets, None
+        if ticket_id is not None and nonce is not None and len(nonce) == resumption.NONCE_SIZE:
+            ticket_id, nonce = bytes(ticket_id), bytes(nonce)
+            ticket = tickets.find(ticket_id)
+            if ticket is not None and not resumption.verify_resume_mac(ticket.secret, ticket_id, nonce,
+                                                                       ticket.username, mac):
+                ticket = None
+            # Redeemed only now, and only once if the same request arrives twice
+            if ticket is not None and tickets.redeem(ticket_id) is None:
+                ticket = None
+        if ticket is None:
+            handler.send_object(ResumeMessage("rejected"), self)
+            return
+
+        # The session keeps its current key unless it is bound to the ticket's user
+        server_nonce = get_random_bytes(resumption.NONCE_SIZE)
+        key = resumption.resumed_key(ticket.secret, nonce, server_nonce)
+        if not handler.server.client_list.bind(self, ticket.username):
+            handler.send_object(ResumeMessage("rejected"), self)
+            return
+        self.key, self.cipher_mode = key, ticket.cipher_mode
+
+        # The client needs the new key before anything encrypted under it, such as stored messages
+        ticket_id = self.issue_ticket(handler, ticket.username)
+        handler.send_object(ResumeMessage("resumed", ticket_id, nonce=server_nonce, recipient=ticket.username), self)
+        self.catch_up(handler)
+
+    def rehash(self, handler: ThreadedUDPHandler, username, password, salt):
+        try:
+            hashed = handler.server.passwords.hash(password, salt)
+        except Busy:
+            return  # Try again on the next login
+        handler.server.users.update_password(username, hashed, salt)
 
-        if SHA3_256.new(bytes(password + salt, "utf-8")).hexdigest() == saved_pass:
-            self.handler.send_encrypted_message("Login Successful.", self)
+    def room_request(self, handler: ThreadedUDPHandler, request: str, name: str, text: str = None):
+        """
+        Creates, joins or leaves a room, or invites the user named by text to it
+        """
+        rooms = handler.server.rooms
+
+        if self.username is None:
+            room, error = None, "Login required."
+        elif not name or len(name) > 64 or name.startswith("#"):
+            room, error = None, "Invalid room name."
+        elif request == "create":
+            room, error = rooms.create(name, self.username), "Room already exists."
+            if room is not None:
+                error = "Created room."
+        elif request == "join":
+            # Does not tell whether the room exists, only members learn that
+            room, error = rooms.join(name, self.username), "No such room, or not invited."
+            if room is not None:
+                error = "Joined room."
+        elif request == "invite":
+            if not text or len(text) > 64:
+                room, error = None, "Invalid username."
+            else:
+                room, error = None, f"Invited {text}." if rooms.invite(name, self.username, text) else "Not a member."
+        elif request == "leave":
+            if rooms.leave(name, self.username):
+                room, error = None, "Left room."
+                self.rotate_room_key(handler, rooms.get(name))
+            else:
+                room, error = None, "Not a member."
+        else:
+            room, error = None, f"Unknown request {request}."
 
-            self.username = username
+        handler.send_object(RoomMessage("error", name, text=error, recipient=self.username), self)
+        if room is not None:
+            self.share_room_key(handler, room)
+
+    def share_room_key(self, handler: ThreadedUDPHandler, room):
+        """
+        Gets this client the key of a room it is a member of. Room keys are made by members and sent from one member to
+        another under the key the two share, the server only relays them: the first other member online is asked (with
+        request share) to send theirs to this client, and if nobody else is online this client is asked (with request
+        rekey) to make a new one.
+        """
+        others = handler.online_members(room, exclude=self.username)
+        if others:
+            handler.notify(RoomMessage("share", room.name, text=self.username, recipient=others[0]))
         else:
-            self.handler.send_encrypted_message("Login Failed.", self)
+            handler.send_object(RoomMessage("rekey", room.name, text="", recipient=self.username), self)
+
+    def rotate_room_key(self, handler: ThreadedUDPHandler, room):
+        """
+        Replaces the key of a room a member just left, so that they cannot read what is sent to it from now on. The
+        first member online is asked to make a new key and send it to the others online, named in text and separated
+        by null bytes, members that are offline get it when they log in.
+        """
+        others = handler.online_members(room) if room is not None else []
+        if others:
+            handler.notify(RoomMessage("rekey", room.name, text="\0".join(others[1:]), recipient=others[0]))
 
-        self.handler.server.database.close()
-        self.handler.server.database = None
+
+def create_server(engine: str, server_address: tuple, db_path: str, session_ttl: float = None,
+                  reload_interval: float = 5.0, mailbox_retention: float = 7 * 24 * 3600.0, mailbox_size: int = 1000,
+                  reuse_port: bool = False, admin_port: int = None, kdf: str = "scrypt",
+                  hash_workers: int = None, limits: list = None, max_in_flight: int = 1024,
+                  max_sessions: int = 1000000, anonymous_ttl: float = 300.0) -> ServerStateMixin:
+    """
+    Builds a server with the specified engine and applies the command line settings to it
+    """
+    startup.begin()
+    if engine == "async":
+        from Server.async_server import AsyncUDPServer, AsyncUDPHandler
+
+        server = AsyncUDPServer(server_address, AsyncUDPHandler, db_path, session_ttl=session_ttl,
+                                reuse_port=reuse_port)
+    else:
+        server = ThreadedUDPServer(server_address, ThreadedUDPHandler, db_path, session_ttl, reuse_port)
+    startup.mark("engine")
+    server.groups.watch(reload_interval)
+    server.client_list.max_sessions = max_sessions
+    server.client_list.anonymous_ttl = anonymous_ttl
+    server.mailbox.retention = mailbox_retention
+    server.mailbox.max_messages = mailbox_size
+    dh.precompute(server.groups.groups.values())
+    startup.mark("fixed-base tables")
+    server.passwords = PasswordHasher(kdf, hash_workers)
+    server.passwords.start()
+    startup.mark("password workers")
+    server.admission = Admission(parse_limits(limits), max_in_flight)
+    if admin_port:
+        server.start_admin(admin_port)
+        startup.mark("admin server")
+    return server
 
 
 if __name__ == "__main__":
     HOST, PORT = "localhost", 9999
 
-    server = ThreadedUDPServer((HOST, PORT), ThreadedUDPHandler, "data/users.db")
+    parser = argparse.ArgumentParser(prog="server")
+    parser.add_argument("-e", "--engine", choices=("threaded", "async"), default="threaded",
+                        help="Server engine, a thread per datagram or an asyncio event loop, defaults to threaded")
+    parser.add_argument("-t", "--session-ttl", type=float, default=None,
+                        help="Seconds a client may stay idle before its session is dropped, defaults to never")
+    parser.add_argument("--max-sessions", type=int, default=1000000,
+                        help="Sessions held at most, beyond that the least recently seen are evicted, those that never "
+                             "logged in first, defaults to 1000000")
+    parser.add_argument("--anonymous-ttl", type=float, default=300.0,
+                        help="Seconds a session that never logged in may stay idle, defaults to 300")
+    parser.add_argument("-r", "--reload-interval", type=float, default=5.0,
+                        help="Seconds between checks of data/prime.bin for new group parameters, defaults to 5")
+    parser.add_argument("--mailbox-retention", type=float, default=7 * 24 * 3600.0,
+                        help="Seconds messages for offline users are kept, defaults to a week")
+    parser.add_argument("--mailbox-size", type=int, default=1000,
+                        help="Messages kept per offline user, the oldest are dropped first, defaults to 1000")
+    parser.add_argument("-a", "--admin-port", type=int, default=None,
+                        help="Serve metrics and the profiler over HTTP on this localhost port, worker i of several "
+                             "uses port + i, defaults to off")
+    parser.add_argument("-k", "--kdf", default="scrypt",
+                        help="Password KDF and cost, e.g. scrypt:n=32768,r=8,p=1 or pbkdf2_sha256:iterations=600000, "
+                             "stored hashes are upgraded on login, defaults to scrypt with n=16384, r=8, p=1")
+    parser.add_argument("--hash-workers", type=int, default=None,
+                        help="Processes hashing passwords, 0 hashes on the request threads, defaults to one per CPU")
+    parser.add_argument("-l", "--limit", action="append", default=None,
+                        help="Rate limit as name=rate/burst or name=off, may be repeated, see Server.admission for the "
+                             "names and defaults")
+    parser.add_argument("--max-in-flight", type=int, default=1024,
+                        help="Datagrams the threaded engine handles at once, more are dropped unread, defaults to 1024")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="Worker processes sharing the port (needs SO_REUSEPORT), defaults to 1")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="Report how long importing each module and every initialization step took once the "
+                             "server is up, single worker only")
+    args = parser.parse_args()
+
+    settings = {
+        "engine": args.engine,
+        "server_address": (HOST, PORT),
+        "db_path": "data/users.db",
+        "session_ttl": args.session_ttl,
+        "max_sessions": args.max_sessions,
+        "anonymous_ttl": args.anonymous_ttl,
+        "reload_interval": args.reload_interval,
+        "mailbox_retention": args.mailbox_retention,
+        "mailbox_size": args.mailbox_size,
+        "admin_port": args.admin_port,
+        "kdf": args.kdf,
+        "hash_workers": args.hash_workers,
+        "limits": args.limit,
+        "max_in_flight": args.max_in_flight,
+    }
+
+    if args.workers > 1:
+        from Server.supervisor import Supervisor
+
+        Supervisor(args.workers, settings).run()
+        raise SystemExit
+
+    if args.profile_startup:
+        startup.report_imports("Server.async_server" if args.engine == "async" else "Server.server")
+    server = create_server(**settings)
+    if args.profile_startup:
+        startup.report_init()
+
     server_thread = threading.Thread(target=server.serve_forever)
     server_thread.start()
     print(f"Server loop running in thread: {server_thread.name}")
@@ -0,0 +1,206 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class SessionRegistry(object):
+    """
+    Thread safe store of client sessions indexed by both address and username, so relays find their recipient in
+    constant time no matter how many clients are connected.
+
+    Sessions are kept in least recently seen order, which lets idle sessions be expired from the front without
+    scanning the whole registry. A ttl of None keeps sessions forever. Sessions that never logged in are kept in a
+    second such order and expire after anonymous_ttl, a key exchange costs nothing to abandon.
+
+    At most max_sessions are held (None for no limit). A new session beyond that evicts the least recently seen one
+    that never logged in, or the least recently seen of all if every session is logged in.
+    """
+
+    def __init__(self, ttl: float = None, max_sessions: int = None, anonymous_ttl: float = None):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.anonymous_ttl = anonymous_ttl
+
+        self._lock = threading.RLock()
+        self._by_address = OrderedDict()
+        self._by_username = {}
+
+        # Addresses of sessions without a username, least recently seen first
+        self._anonymous = OrderedDict()
+
+        self._last_sweep = time.monotonic()
+        self.expired = 0
+        self.evicted = 0
+
+    # dict style access, kept so the registry can stand in for the old client list
+    def __getitem__(self, address: tuple):
+        with self._lock:
+            return self._by_address[address]
+
+    def __setitem__(self, address: tuple, session):
+        self.add(address, session)
+
+    def __contains__(self, address: tuple) -> bool:
+        return address in self._by_address
+
+    def __len__(self) -> int:
+        return len(self._by_address)
+
+    def get(self, address: tuple, default=None):
+        with self._lock:
+            return self._by_address.get(address, default)
+
+    def items(self) -> list:
+        with self._lock:
+            return list(self._by_address.items())
+
+    def values(self) -> list:
+        with self._lock:
+            return list(self._by_address.values())
+
+    def add(self, address: tuple, session):
+        """
+        Stores a session under its address and, if it is authenticated, under its username
+        """
+        with self._lock:
+            previous = self._by_address.get(address)
+            if previous is not None and previous is not session:
+                self._unindex(previous)
+            elif previous is None and self.max_sessions is not None and len(self._by_address) >= self.max_sessions:
+                self._evict()
+
+            self._by_address[address] = session
+            self._by_address.move_to_end(address)
+            session.last_seen = time.monotonic()
+
+            if session.username is not None:
+                self._by_username[session.username] = session
+                self._anonymous.pop(address, None)
+            else:
+                self._anonymous[address] = None
+                self._anonymous.move_to_end(address)
+
+    def get_or_create(self, address: tuple, factory):
+        """
+        Returns the session for address, creating it with factory if there is none. Either way the session is marked
+        as seen, which resets its idle timer.
+        """
+        session = self.touch(address)
+        if session is not None:
+            return session
+
+        # Build the session outside the lock, if another thread beat us to it keep theirs
+        session = factory()
+        with self._lock:
+            existing = self._by_address.get(address)
+            if existing is not None:
+                return existing
+            self.add(address, session)
+        return session
+
+    def touch(self, address: tuple):
+        """
+        Marks the session for address as active, returns it or None if there is no such session
+        """
+        with self._lock:
+            session = self._by_address.get(address)
+            if session is not None:
+                self._by_address.move_to_end(address)
+                if address in self._anonymous:
+                    self._anonymous.move_to_end(address)
+                session.last_seen = time.monotonic()
+
+        self._maybe_expire()
+        return session
+
+    def find(self, username: str):
+        """
+        Returns the session logged in as username or None if that user is not connected
+        """
+        return self._by_username.get(username)
+
+    def bind(self, session, username: str) -> bool:
+        """
+        Atomically sets the username of a session and moves the username index to it. A user logging in from a new
+        address takes over the route from their old session. Returns False and leaves the session as it is if it is
+        no longer registered, such as one evicted or expired while its login was being checked.
+        """
+        with self._lock:
+            if self._by_address.get(session.ip_address) is not session:
+                return False
+
+            if session.username is not None and self._by_username.get(session.username) is session:
+                del self._by_username[session.username]
+
+            session.username = username
+            if username is not None:
+                self._by_username[username] = session
+                self._anonymous.pop(session.ip_address, None)
+        return True
+
+    def remove(self, address: tuple):
+        """
+        Removes the session for address and its username route, returns the removed session or None
+        """
+        with self._lock:
+            session = self._by_address.pop(address, None)
+            self._anonymous.pop(address, None)
+            if session is not None:
+                self._unindex(session)
+        return session
+
+    def _unindex(self, session):
+        # Only drop the route if it still points at this session, the user may have logged in elsewhere since
+        if session.username is not None and self._by_username.get(session.username) is session:
+            del self._by_username[session.username]
+
+    def _evict(self):
+        order = self._anonymous if self._anonymous else self._by_address
+        self.remove(next(iter(order)))
+        self.evicted += 1
+
+    def _expire_from(self, order: OrderedDict, deadline: float) -> int:
+        removed = 0
+        while order:
+            address = next(iter(order))
+            if self._by_address[address].last_seen > deadline:
+                break
+            self.remove(address)
+            removed += 1
+        return removed
+
+    def expire(self, now: float = None) -> int:
+        """
+        Removes every session idle for longer than ttl and every anonymous one idle for longer than anonymous_ttl,
+        returns the number removed
+        """
+        now = time.monotonic() if now is None else now
+        removed = 0
+        with self._lock:
+            if self.anonymous_ttl is not None:
+                removed += self._expire_from(self._anonymous, now - self.anonymous_ttl)
+            if self.ttl is not None:
+                removed += self._expire_from(self._by_address, now - self.ttl)
+
+            self.expired += removed
+            self._last_sweep = time.monotonic()
+        return removed
+
+    def _maybe_expire(self):
+        # Sweep at most a few times per ttl, each sweep only visits sessions that have actually expired
+        ttls = [ttl for ttl in (self.ttl, self.anonymous_ttl) if ttl is not None]
+        if ttls and time.monotonic() - self._last_sweep > min(ttls) / 4:
+            self.expire()
+
+    def stats(self) -> dict:
+        """
+        Session counts for introspection
+        """
+        with self._lock:
+            return {
+                "sessions": len(self._by_address),
+                "authenticated": len(self._by_username),
+                "anonymous": len(self._anonymous),
+                "expired": self.expired,
+                "evicted": self.evicted,
+            }
@@ -0,0 +1,123 @@
+"""
+Runs several server processes on one port so that decoding, encryption and hashing use every core instead of being
+limited to one by the GIL. Each worker binds the port with SO_REUSEPORT and the kernel spreads clients across them by
+address, so a client always reaches the same worker. Workers share the database file and a session directory (see
+Server.directory) that lets them relay to users whose session lives in another worker.
+
+Started by server.py with --workers N.
+"""
+
+import multiprocessing
+import multiprocessing.connection
+import shutil
+import signal
+import tempfile
+import threading
+import time
+
+from Server.directory import Directory, SharedSessionRegistry
+from Server.server import create_server
+
+
+def run_worker(index: int, workers: int, run_dir: str, settings: dict):
+    """
+    Entry point of a worker process, serves until it receives SIGTERM
+    """
+    # Every worker serves its own metrics, on consecutive admin ports
+    if settings.get("admin_port"):
+        settings = dict(settings, admin_port=settings["admin_port"] + index)
+
+    server = create_server(reuse_port=True, **settings)
+
+    directory = Directory(index, workers, run_dir)
+    sessions = server.client_list
+    server.client_list = SharedSessionRegistry(sessions.ttl, directory, sessions.max_sessions, sessions.anonymous_ttl)
+    server.directory = directory
+    server.rooms.on_change = directory.room_changed
+    server.tickets.on_issue = directory.ticket_issued
+    server.tickets.on_drop = directory.ticket_dropped
+    directory.start(server)
+
+    # shutdown waits for serve_forever to return, so it cannot be called from the thread running it
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    try:
+        server.serve_forever()
+    finally:
+        directory.close()
+        server.server_close()
+
+
+class Supervisor(object):
+    """
+    Starts workers worker processes with the create_server settings and restarts any that exit until stopped
+    """
+
+    def __init__(self, workers: int, settings: dict, run_dir: str = None, restart_delay: float = 1.0):
+        self.workers = workers
+        self.settings = settings
+        self.run_dir = run_dir
+        self.restart_delay = restart_delay
+
+        self.processes = {}
+        self._stopping = False
+        self._owns_run_dir = False
+        self.restarts = 0
+
+    def _spawn(self, index: int):
+        process = multiprocessing.Process(target=run_worker, args=(index, self.workers, self.run_dir, self.settings),
+                                          name=f"server-worker-{index}")
+        # Not a daemon, workers start processes of their own for password hashing. stop() ends them.
+        process.start()
+        self.processes[index] = process
+
+    def start(self):
+        if self.run_dir is None:
+            self.run_dir = tempfile.mkdtemp(prefix="jam-")
+            self._owns_run_dir = True
+
+        for index in range(self.workers):
+            self._spawn(index)
+
+    def run(self):
+        """
+        Starts the workers and supervises them in the calling thread until SIGINT or SIGTERM
+        """
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stop())
+        signal.signal(signal.SIGINT, lambda signum, frame: self.stop())
+
+        self.start()
+        print(f"Supervising {self.workers} workers on {self.settings['server_address']}")
+
+        try:
+            while not self._stopping:
+                sentinels = {process.sentinel: index for index, process in self.processes.items()}
+                for sentinel in multiprocessing.connection.wait(list(sentinels), timeout=1.0):
+                    if self._stopping:
+                        break
+                    index = sentinels[sentinel]
+                    print(f"Worker {index} exited with code {self.processes[index].exitcode}, restarting")
+                    time.sleep(self.restart_delay)
+                    self.restarts += 1
+                    self._spawn(index)
+        finally:
+            self.stop()
+
+    def stop(self):
+        if self._stopping and not self.processes:
+            return
+        self._stopping = True
+
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+        for process in self.processes.values():
+            process.join(timeout=5)
+            if process.is_alive():
+                process.kill()
+                process.join()
+        self.processes = {}
+
+        if self._owns_run_dir:
+            shutil.rmtree(self.run_dir, ignore_errors=True)
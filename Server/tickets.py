@@ -0,0 +1,96 @@
+import threading
+
+from Cryptodome.Random import get_random_bytes
+
+from Server.cache import TTLCache
+from Util.resumption import TICKET_SIZE
+
+
+class Ticket(object):
+    """
+    What the server remembers about a session a ticket resumes
+    """
+
+    __slots__ = ("secret", "username", "cipher_mode")
+
+    def __init__(self, secret: bytes, username: str, cipher_mode: str):
+        self.secret = secret
+        self.username = username
+        self.cipher_mode = cipher_mode
+
+
+class TicketStore(object):
+    """
+    Resumption tickets the server has issued (see Util.resumption), held in memory for ttl seconds. At most max_size
+    are kept, the least recently issued are dropped first and their clients fall back to a full key exchange. Every
+    ticket can be redeemed once, a resumed session gets a new one.
+
+    on_issue is called with every ticket issued here and on_drop with the identifier of every ticket redeemed or
+    revoked here, a supervised server sets them to share tickets between its workers (see Server.directory). Tickets
+    from other workers are stored with add and forgotten with discard, which call neither.
+    """
+
+    def __init__(self, max_size: int = 100000, ttl: float = 24 * 3600.0):
+        self.cache = TTLCache(max_size=max_size, ttl=ttl)
+
+        self.on_issue = None
+        self.on_drop = None
+
+        self._lock = threading.Lock()
+        self.issued = 0
+        self.redeemed = 0
+
+    def issue(self, secret: bytes, username: str, cipher_mode: str) -> bytes:
+        """
+        Stores a ticket for the session with the given resumption secret, returns its identifier
+        """
+        ticket_id = get_random_bytes(TICKET_SIZE)
+        ticket = Ticket(secret, username, cipher_mode)
+        self.cache.set(ticket_id, ticket)
+        with self._lock:
+            self.issued += 1
+        if self.on_issue is not None:
+            self.on_issue(ticket_id, ticket)
+        return ticket_id
+
+    def add(self, ticket_id: bytes, ticket: Ticket):
+        """
+        Stores a ticket another worker issued
+        """
+        self.cache.set(ticket_id, ticket)
+
+    def find(self, ticket_id: bytes) -> Ticket:
+        """
+        Returns the ticket with identifier ticket_id without redeeming it, None if it is unknown or has expired
+        """
+        return self.cache.get(ticket_id, None)
+
+    def redeem(self, ticket_id: bytes) -> Ticket:
+        """
+        Removes and returns the ticket with identifier ticket_id, None if it is unknown or has expired
+        """
+        ticket = self.cache.pop(ticket_id)
+        if ticket is not None:
+            with self._lock:
+                self.redeemed += 1
+            if self.on_drop is not None:
+                self.on_drop(ticket_id)
+        return ticket
+
+    def revoke(self, ticket_id: bytes):
+        self.cache.invalidate(ticket_id)
+        if self.on_drop is not None:
+            self.on_drop(ticket_id)
+
+    def discard(self, ticket_id: bytes):
+        """
+        Forgets a ticket another worker redeemed or revoked
+        """
+        self.cache.invalidate(ticket_id)
+
+    def stats(self) -> dict:
+        """
+        Counters for introspection
+        """
+        return {"size": len(self.cache), "issued": self.issued, "redeemed": self.redeemed,
+                "evictions": self.cache.evictions}
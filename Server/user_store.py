@@ -0,0 +1,97 @@
+import sqlite3
+from concurrent.futures import Future
+
+from Server.cache import TTLCache
+from Util.db import BatchWriter, ConnectionPool
+
+SELECT_USER = "SELECT username, password, salt FROM users WHERE username=?"
+INSERT_USER = "INSERT INTO users(username, password, salt) VALUES (?,?,?)"
+UPDATE_PASSWORD = "UPDATE users SET password=?, salt=? WHERE username=?"
+
+# Write kinds
+_INSERT = 0
+_UPDATE = 1
+
+
+class UserStore(BatchWriter):
+    """
+    Access to the users table. Lookups use a pooled connection on the calling thread, registrations are queued to a
+    single writer thread that inserts everything waiting in one transaction and commits once per batch.
+
+    User records (hash and salt) are cached in memory, including usernames that do not exist, so that repeated logins
+    for the same users rarely reach the database. A registration replaces the cached record once it is committed.
+    """
+
+    def __init__(self, db_path: str, pool_size: int = 4, batch_size: int = 64, cache: TTLCache = None):
+        super(UserStore, self).__init__(ConnectionPool(db_path, pool_size), batch_size, "user-store-writer")
+        self.cache = cache if cache is not None else TTLCache(max_size=100000, ttl=300.0, negative_ttl=30.0)
+
+    def get_user(self, username: str) -> sqlite3.Row:
+        """
+        Returns the row for username with its password hash and salt, or None if there is no such user
+        """
+        user = self.cache.get(username)
+        if not self.cache.is_miss(user):
+            return user
+
+        with self.pool.connection() as connection:
+            user = connection.execute(SELECT_USER, (username,)).fetchone()
+
+        # Don't overwrite a record a registration stored while we were reading
+        self.cache.add(username, user)
+        return user
+
+    def add_user(self, username: str, password: str, salt: str) -> bool:
+        """
+        Inserts a new user, blocks until the batch it was written in is committed. Returns False if the username is
+        already taken.
+        """
+        return self.add_user_async(username, password, salt).result()
+
+    def add_user_async(self, username: str, password: str, salt: str) -> Future:
+        """
+        Queues a new user for the next batch, the returned future resolves to whether the insert succeeded
+        """
+        return self.submit((_INSERT, (username, password, salt)))
+
+    def update_password(self, username: str, password: str, salt: str) -> Future:
+        """
+        Queues a new password hash and salt for an existing user, the returned future resolves to whether the user
+        was found
+        """
+        return self.submit((_UPDATE, (username, password, salt)))
+
+    def _write(self, connection: sqlite3.Connection, batch: list):
+        results = []
+        try:
+            for (kind, params), future in batch:
+                if kind == _UPDATE:
+                    username, password, salt = params
+                    cursor = connection.execute(UPDATE_PASSWORD, (password, salt, username))
+                    results.append((future, cursor.rowcount > 0))
+                    continue
+                try:
+                    connection.execute(INSERT_USER, params)
+                    results.append((future, True))
+                except sqlite3.IntegrityError:
+                    # Only this statement is rolled back, the rest of the batch stays in the transaction
+                    results.append((future, False))
+            connection.commit()
+        except sqlite3.Error as e:
+            connection.rollback()
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        for ((kind, params), _), (future, result) in zip(batch, results):
+            username, password, salt = params
+            if result:
+                self.cache.set(username, {"username": username, "password": password, "salt": salt})
+            elif kind == _INSERT:
+                # The name is taken, whatever we cached for it may be a stale negative result
+                self.cache.invalidate(username)
+            future.set_result(result)
+
+    def close(self):
+        super(UserStore, self).close()
+        self.pool.close()
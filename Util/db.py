@@ -0,0 +1,156 @@
+"""
+SQLite plumbing shared by the server's stores and the client's history: a pool of connections for readers and a
+single writer thread that commits queued writes in batches.
+"""
+
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+
+class ConnectionPool(object):
+    """
+    Thread safe pool of sqlite connections to one database, opened lazily up to size and reused after that
+
+    Every connection runs in WAL mode so readers never block the writer or each other. Statements are prepared once per
+    connection and served from sqlite3's statement cache afterwards, queries must therefore use the same SQL text
+    every time (see the module level statements).
+    """
+
+    def __init__(self, db_path: str, size: int = 4, timeout: float = 5.0):
+        self.db_path = db_path
+        self.size = size
+        self.timeout = timeout
+
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def connect(self) -> sqlite3.Connection:
+        # Connections move between threads, the pool makes sure only one thread uses a connection at a time
+        connection = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False,
+                                     cached_statements=64)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._opened < self.size:
+                self._opened += 1
+                try:
+                    return self.connect()
+                except sqlite3.Error:
+                    self._opened -= 1
+                    raise
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No database connection became available within {self.timeout}s")
+
+    def release(self, connection: sqlite3.Connection):
+        if self._closed:
+            connection.close()
+        else:
+            self._idle.put(connection)
+
+    @contextmanager
+    def connection(self) -> sqlite3.Connection:
+        """
+        Borrows a connection for the duration of a with block
+        """
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class BatchWriter(object):
+    """
+    Queues writes for a single writer thread that applies everything waiting, up to batch_size items, in one
+    transaction and commits once per batch. Subclasses implement _write.
+    """
+
+    def __init__(self, pool: ConnectionPool, batch_size: int = 64, name: str = "batch-writer"):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.name = name
+
+        self._writes = queue.Queue()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+
+    def submit(self, item) -> Future:
+        """
+        Queues item for the next batch, the returned future resolves to whatever _write sets for it
+        """
+        self._start_writer()
+
+        future = Future()
+        self._writes.put((item, future))
+        return future
+
+    def _start_writer(self):
+        if self._writer is not None:
+            return
+
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_batches, name=self.name)
+                self._writer.daemon = True
+                self._writer.start()
+
+    def _write_batches(self):
+        connection = self.pool.connect()
+        try:
+            while True:
+                item = self._writes.get()
+                if item is None:
+                    break
+
+                # Take whatever else is already waiting, up to batch_size, without waiting for more
+                batch = [item]
+                while len(batch) < self.batch_size:
+                    try:
+                        item = self._writes.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        self._writes.put(None)
+                        break
+                    batch.append(item)
+
+                self._write(connection, batch)
+        finally:
+            connection.close()
+
+    def _write(self, connection: sqlite3.Connection, batch: list):
+        """
+        Applies a batch of (item, future) pairs and commits, must resolve every future
+        """
+        raise NotImplementedError
+
+    def close(self):
+        if self._writer is not None:
+            self._writes.put(None)
+            self._writer.join(timeout=5)
+            self._writer = None
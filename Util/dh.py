@@ -0,0 +1,147 @@
+"""
+Diffie-Hellman arithmetic. Public values are computed with precomputed fixed-base tables, the generator of a group
+never changes so every power of it that an exponentiation could need is calculated once and cached per group. Shared
+secrets have a different base every time and use the built-in pow, which already does windowed exponentiation in C.
+"""
+
+import threading
+
+from Cryptodome.Random.random import randrange
+
+DEFAULT_WINDOW = 6
+
+# Keypairs generated for a group with the built-in pow before its table is built. A table takes about as long to build
+# as a dozen plain exponentiations, a short-lived client doing a handful of exchanges is faster without one.
+BUILD_AFTER = 16
+
+
+class FixedBaseTable(object):
+    """
+    Table of base ** (d * 2 ** (window * i)) % modulus for every window sized digit d at every position i. Raising the
+    base to an exponent is then one modular multiplication per non-zero digit of the exponent, no squarings.
+
+    Memory use is about (bits / window) * 2 ** window integers of the modulus' size.
+    """
+
+    def __init__(self, base: int, modulus: int, max_bits: int = None, window: int = DEFAULT_WINDOW):
+        self.base = base
+        self.modulus = modulus
+        self.window = window
+        self.max_bits = max_bits or modulus.bit_length()
+
+        self._mask = (1 << window) - 1
+        self._rows = []
+
+        position_base = base % modulus
+        for _ in range((self.max_bits + window - 1) // window):
+            row = [1] * (1 << window)
+            for digit in range(1, 1 << window):
+                row[digit] = row[digit - 1] * position_base % modulus
+            self._rows.append(row)
+            position_base = row[-1] * position_base % modulus
+
+    def pow(self, exponent: int) -> int:
+        """
+        Returns base ** exponent % modulus
+        """
+        if exponent < 0 or exponent.bit_length() > self.max_bits:
+            # Outside the table, still give the right answer
+            return pow(self.base, exponent, self.modulus)
+
+        modulus, mask, window = self.modulus, self._mask, self.window
+        result = 1
+        for row in self._rows:
+            if not exponent:
+                break
+            digit = exponent & mask
+            if digit:
+                result = result * row[digit] % modulus
+            exponent >>= window
+        return result
+
+
+_tables = {}
+_uses = {}
+_tables_lock = threading.Lock()
+
+
+def fixed_base_table(prime: int, root: int, window: int = DEFAULT_WINDOW) -> FixedBaseTable:
+    """
+    Returns the cached table for a group, building it on first use
+    """
+    key = (prime, root, window)
+    table = _tables.get(key)
+    if table is None:
+        with _tables_lock:
+            table = _tables.get(key)
+            if table is None:
+                table = _tables[key] = FixedBaseTable(root, prime, window=window)
+    return table
+
+
+def _table_for(prime: int, root: int, window: int) -> FixedBaseTable:
+    """
+    Returns the group's table, None until the group has been used BUILD_AFTER times unless precompute built it
+    """
+    key = (prime, root, window)
+    table = _tables.get(key)
+    if table is None:
+        with _tables_lock:
+            uses = _uses[key] = _uses.get(key, 0) + 1
+        if uses > BUILD_AFTER:
+            table = fixed_base_table(prime, root, window)
+    return table
+
+
+def precompute(groups, window: int = DEFAULT_WINDOW):
+    """
+    Builds the tables for every group ahead of time so the first exchange does not pay for it
+    """
+    for group in groups:
+        fixed_base_table(group.prime, group.root, window)
+
+
+def validate_public(prime: int, public: int):
+    """
+    Rejects public values that would force the shared secret into a trivial subgroup. 0, 1 and prime - 1 (and
+    anything outside the group) give secrets an eavesdropper can guess.
+    """
+    if not isinstance(public, int) or not 2 <= public <= prime - 2:
+        raise ValueError("Invalid Diffie-Hellman public value")
+
+
+def accept_request(groups, prime: int, root: int, public: int):
+    """
+    Returns the group a peer's key exchange request is in after checking its public value. Only groups we know are
+    accepted, a peer picking the parameters could pick weak ones.
+    """
+    group = groups.find(prime, root)
+    if group is None:
+        raise ValueError("Unknown group parameters")
+    validate_public(group.prime, public)
+    return group
+
+
+def generate_keypair(prime: int, root: int, cached: bool = True, window: int = DEFAULT_WINDOW) -> (int, int):
+    """
+    Returns a random secret exponent and the matching public value root ** secret % prime
+
+    Set cached to False for parameters that are not one of our own groups, so that a peer cannot make us build and
+    keep a table for every prime it sends. Cached groups get their table once they have been used BUILD_AFTER times.
+    """
+    table = _table_for(prime, root, window) if cached else None
+    while True:
+        secret = randrange(1, prime - 1)  # Random integer between 1 and prime - 2: to be kept secret
+        public = table.pow(secret) if table is not None else pow(root, secret, prime)
+
+        # Our own public value has to pass the peer's validation too
+        if 2 <= public <= prime - 2:
+            return secret, public
+
+
+def shared_secret(prime: int, secret: int, peer_public: int) -> int:
+    """
+    Validates the peer's public value and returns the shared secret peer_public ** secret % prime
+    """
+    validate_public(prime, peer_public)
+    return pow(peer_public, secret, prime)
@@ -1,23 +1,45 @@
 """
-CLI for generating primes, pickling them and dumping to a binary file in such a way that it can be read by the
-client and used during a key exchange. Generating large enough primes (>2048 bits) to be secure is a time consuming
-process that would be infeasible to run every time a shared secret is generated.
+CLI for generating primes and writing them to a binary file in such a way that it can be read by the client and used
+during a key exchange. Generating large enough primes (>2048 bits) to be secure is a time consuming process that would
+be infeasible to run every time a shared secret is generated.
 
-Exports pickled prime to file specified by user, default: prime.dmp
+Safe primes are searched for on every core. Several sizes and several groups per size can be generated at once, the
+first group generated becomes the default group and every group is stored under a name (see Util.group_params), e.g.
+"2048", or "2048-1", "2048-2" when more than one group of a size is requested.
+
+Writes the groups to the file specified by user, default: prime.bin
 """
 
 import argparse
 
-import Util
+from Util.prime_helper import PrimeHelper
+from Util.safe_prime import generate_safe_primes, safe_prime_root, print_progress
 
 # CLI setup
 parser = argparse.ArgumentParser(prog="generate-prime")
-parser.add_argument("-n", "--n_bits", type=int, default=4096,
-                    help="Length of generated prime in bits. Recommended to be at least 2048, defaults to 4096")
+parser.add_argument("-n", "--n_bits", type=int, nargs="+", default=[4096],
+                    help="Length of generated primes in bits, may list several sizes. Recommended to be at least "
+                         "2048, defaults to 4096")
+parser.add_argument("-c", "--count", type=int, default=1, help="Number of groups to generate per size, defaults to 1")
+parser.add_argument("-w", "--workers", type=int, default=None,
+                    help="Number of processes to search with, defaults to the number of cores")
 parser.add_argument("-f", "--file", type=str, default="prime.bin", help="Name of dump file, defaults to prime.bin")
 
 args = parser.parse_args()
 
-# Generate prime
-prime = Util.prime_helper.PrimeHelper("prime.bin", args.n_bits)
-prime.export(prime=prime.prime, root=prime.root)
+# Generate primes
+groups = {}
+for n_bits in args.n_bits:
+    print(f"Generating {args.count} safe prime(s) with {n_bits} bits...")
+    primes = generate_safe_primes(n_bits, args.count, args.workers, progress=print_progress)
+    print()
+
+    for i, prime in enumerate(primes, start=1):
+        name = str(n_bits) if args.count == 1 else f"{n_bits}-{i}"
+        groups[name] = {"prime": prime, "root": safe_prime_root(prime)}
+
+default = next(iter(groups))
+helper = PrimeHelper(args.file)
+helper.export(prime=groups[default]["prime"], root=groups[default]["root"], default=default, groups=groups)
+
+print(f"Wrote {len(groups)} group(s) to {args.file}, default group is {default}")
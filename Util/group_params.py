@@ -0,0 +1,278 @@
+import hashlib
+import io
+import os
+import struct
+import threading
+from types import MappingProxyType
+from typing import NamedTuple
+
+# Parameters files start with the magic, the format version, the number of groups and the SHA-256 digest of the file
+# they were converted from (zeros if they were written directly). Every group follows as its name, prime and root,
+# each prefixed with its length in bytes, the default group first. A SHA-256 digest of everything before it ends the
+# file.
+MAGIC = b"JAMG"
+VERSION = 1
+_HEADER = struct.Struct(">4sBH32s")
+_DIGEST_SIZE = 32
+
+# Files in the older pickle format are converted once into a file of this name next to them
+CACHE_SUFFIX = ".cache"
+
+
+class DHGroup(NamedTuple):
+    """
+    Immutable Diffie-Hellman group parameters, a prime modulus and a generator
+    """
+    name: str
+    prime: int
+    root: int
+
+    @property
+    def n_bits(self) -> int:
+        return self.prime.bit_length()
+
+
+class GroupStore(object):
+    """
+    Holds every named group from a parameters file, loaded once and shared by all sessions in the process so that
+    setting up a connection never touches the disk.
+
+    The file is written by write_groups (see the format above), files in the older pickle format are still read, see
+    read_groups.
+
+    Reloading swaps in a complete new set of groups at once, readers always see either the old or the new set.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+
+        self._groups = MappingProxyType({})
+        self._by_prime = MappingProxyType({})
+        self._default = None
+        self._mtime = None
+
+        self._lock = threading.Lock()
+        self._watcher = None
+        self._stop = threading.Event()
+
+        self.load()
+
+    @property
+    def groups(self) -> MappingProxyType:
+        return self._groups
+
+    @property
+    def default(self) -> DHGroup:
+        return self._default
+
+    def get(self, name: str = None) -> DHGroup:
+        """
+        Returns the group with the specified name, or the default group if no name is given
+        """
+        if name is None:
+            return self._default
+        try:
+            return self._groups[name]
+        except KeyError:
+            raise KeyError(f"Unknown group {name!r}, available groups: {', '.join(self._groups)}")
+
+    def find(self, prime: int, root: int = None) -> DHGroup:
+        """
+        Returns the known group using prime (and root if specified), or None if the parameters are not one of ours
+        """
+        group = self._by_prime.get(prime)
+        if group is None or (root is not None and group.root != root):
+            return None
+        return group
+
+    def load(self):
+        """
+        Reads the parameters file and atomically replaces the current groups
+        """
+        with self._lock:
+            mtime = os.stat(self.filename).st_mtime_ns
+            default, *others = read_groups(self.filename)
+
+            groups = {default.name: default}
+            for group in others:
+                groups[group.name] = group
+
+            self._groups = MappingProxyType(groups)
+            self._by_prime = MappingProxyType({group.prime: group for group in groups.values()})
+            self._default = default
+            self._mtime = mtime
+
+    def reload_if_changed(self) -> bool:
+        """
+        Reloads the groups if the parameters file was modified since the last load, returns whether it did
+        """
+        try:
+            changed = os.stat(self.filename).st_mtime_ns != self._mtime
+        except FileNotFoundError:
+            return False
+
+        if changed:
+            self.load()
+        return changed
+
+    def watch(self, interval: float = 5.0):
+        """
+        Starts a daemon thread checking the parameters file for changes every interval seconds
+        """
+        if self._watcher is not None:
+            return
+
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    if self.reload_if_changed():
+                        print(f"Reloaded group parameters from {self.filename}")
+                except Exception as e:
+                    # Keep serving with the groups we already have rather than dying on a half written file
+                    print(f"Failed to reload group parameters from {self.filename}: {e!r}")
+
+        self._watcher = threading.Thread(target=run, name="group-watcher")
+        self._watcher.daemon = True
+        self._watcher.start()
+
+    def stop_watching(self):
+        self._stop.set()
+        self._watcher = None
+
+
+def _int_bytes(value: int) -> bytes:
+    return value.to_bytes((value.bit_length() + 7) // 8, "big")
+
+
+def encode_groups(groups: list, source: bytes = bytes(_DIGEST_SIZE)) -> bytes:
+    """
+    Serializes a list of DHGroup, the first of which is the default group
+    """
+    body = io.BytesIO()
+    body.write(_HEADER.pack(MAGIC, VERSION, len(groups), source))
+    for group in groups:
+        for field in (group.name.encode("utf-8"), _int_bytes(group.prime), _int_bytes(group.root)):
+            body.write(struct.pack(">H", len(field)))
+            body.write(field)
+    data = body.getvalue()
+    return data + hashlib.sha256(data).digest()
+
+
+def decode_groups(data: bytes) -> (list, bytes):
+    """
+    Parses and validates a parameters file, returns its groups (default first) and the digest of the file it was
+    converted from. Raises ValueError for anything but a complete, intact file of sane parameters.
+    """
+    if len(data) < _HEADER.size + _DIGEST_SIZE or not data.startswith(MAGIC):
+        raise ValueError("Not a group parameters file")
+    data, digest = memoryview(data)[:-_DIGEST_SIZE], data[-_DIGEST_SIZE:]
+    if hashlib.sha256(data).digest() != digest:
+        raise ValueError("Group parameters file is corrupt, its checksum does not match")
+
+    magic, version, count, source = _HEADER.unpack_from(data)
+    if version != VERSION:
+        raise ValueError(f"Unsupported group parameters file version {version}")
+
+    offset, fields = _HEADER.size, []
+    for _ in range(count * 3):
+        if offset + 2 > len(data):
+            raise ValueError("Group parameters file is truncated")
+        size, = struct.unpack_from(">H", data, offset)
+        offset += 2
+        if offset + size > len(data):
+            raise ValueError("Group parameters file is truncated")
+        fields.append(bytes(data[offset:offset + size]))
+        offset += size
+    if offset != len(data) or not count:
+        raise ValueError("Group parameters file has trailing data or no groups")
+
+    groups = []
+    for i in range(0, len(fields), 3):
+        group = DHGroup(fields[i].decode("utf-8"), int.from_bytes(fields[i + 1], "big"),
+                        int.from_bytes(fields[i + 2], "big"))
+        # A prime that is even or tiny, or a root of 0, 1 or p - 1, would make every shared secret guessable
+        if group.prime < 5 or not group.prime & 1 or not 2 <= group.root <= group.prime - 2:
+            raise ValueError(f"Group {group.name!r} has invalid parameters")
+        groups.append(group)
+    if len({group.name for group in groups}) != len(groups):
+        raise ValueError("Group parameters file names a group twice")
+    return groups, source
+
+
+def write_groups(filename: str, groups: list, source: bytes = bytes(_DIGEST_SIZE)):
+    """
+    Writes groups (default first) to filename, replacing it atomically so that a watching server never reads half of it
+    """
+    temporary = f"{filename}.{os.getpid()}.tmp"
+    with open(temporary, mode="wb") as file:
+        file.write(encode_groups(groups, source))
+    os.replace(temporary, filename)
+
+
+def _from_pickle(data: bytes) -> list:
+    """
+    Reads the pickled dictionary older versions of PrimeHelper.export wrote. Its "prime" and "root" keys form the
+    default group, an optional "groups" key maps further names to dictionaries with their own "prime" and "root".
+    Only plain data is unpickled, a file naming any class or function is refused.
+    """
+    import pickle
+
+    class DataUnpickler(pickle.Unpickler):
+        def find_class(self, module, name):
+            raise ValueError(f"Group parameters file refers to {module}.{name}, only plain data is allowed")
+
+    data = DataUnpickler(io.BytesIO(data)).load()
+    try:
+        default = DHGroup(str(data.get("default") or data["prime"].bit_length()), data["prime"], data["root"])
+        groups = {default.name: default}
+        for name, params in data.get("groups", {}).items():
+            groups[str(name)] = DHGroup(str(name), params["prime"], params["root"])
+    except (AttributeError, KeyError, TypeError):
+        raise AttributeError("File must contain a dictionary with at least keys \"prime\" and \"root\"")
+
+    # Validated the same way as any other file
+    groups, _ = decode_groups(encode_groups([groups.pop(default.name)] + list(groups.values())))
+    return groups
+
+
+def read_groups(filename: str) -> list:
+    """
+    Returns the groups in a parameters file, default first. A file in the older pickle format is converted into
+    filename + CACHE_SUFFIX on first read, later reads use that for as long as the file stays the same.
+    """
+    with open(filename, mode="rb") as file:
+        data = file.read()
+    if data.startswith(MAGIC):
+        return decode_groups(data)[0]
+
+    digest = hashlib.sha256(data).digest()
+    cache = filename + CACHE_SUFFIX
+    try:
+        with open(cache, mode="rb") as file:
+            groups, source = decode_groups(file.read())
+        if source == digest:
+            return groups
+    except (OSError, ValueError):
+        pass
+
+    groups = _from_pickle(data)
+    try:
+        write_groups(cache, groups, digest)
+    except OSError:
+        pass  # A read only data directory just means converting again next time
+    return groups
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def load_groups(filename: str) -> GroupStore:
+    """
+    Returns the process wide GroupStore for filename, loading it on first use
+    """
+    path = os.path.abspath(filename)
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = GroupStore(path)
+        return _stores[path]
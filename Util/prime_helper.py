@@ -1,7 +1,7 @@
-import pickle
+from Util.group_params import DHGroup, read_groups, write_groups
 
-from Cryptodome.Util import number
-from sympy.ntheory.residue_ntheory import primitive_root
+# sympy and the prime search are only imported when parameters are generated, they take far longer to import than
+# everything a client or server needs to start
 
 
 class PrimeHelper(object):
@@ -9,13 +9,15 @@ class PrimeHelper(object):
     Helper class to manipulate large prime numbers for cryptographic use
     """
 
-    def __init__(self, filename: str, n_bits: int = None):
+    def __init__(self, filename: str, n_bits: int = None, workers: int = None):
         self.n_bits = n_bits
         self.filename = filename
+        self.workers = workers
 
         # "Private" variables set by properties
         self._prime = None
         self._root = None
+        self._safe = False
 
     @property
     def prime(self) -> int:
@@ -45,6 +47,14 @@ class PrimeHelper(object):
         self._prime = self._generate_prime()
         self._root = None
 
+    def set_prime(self, prime: int, safe: bool = False):
+        """
+        Helper to use an externally generated prime, the root will be calculated on the next access
+        """
+        self._prime = prime
+        self._root = None
+        self._safe = safe
+
     def _generate_prime(self) -> int:
         """
         Helper function to generate a prime number from the instance variable n_bits, raises an error if this is not
@@ -53,36 +63,46 @@ class PrimeHelper(object):
         if self.n_bits is None:
             raise ValueError("n_bits is not specified, cannot generate prime. Either specify n_bits or use read "
                              "function to import prime from file")
-        print(f"Generating prime with {self.n_bits} bits...")
-        return number.getPrime(self.n_bits)
+        from Util.safe_prime import generate_safe_primes, print_progress
+
+        print(f"Generating safe prime with {self.n_bits} bits...")
+        prime, = generate_safe_primes(self.n_bits, workers=self.workers, progress=print_progress)
+        print()
+
+        self._safe = True
+        return prime
 
     def _generate_root(self) -> int:
         """
         Helper function to calculate the smallest primitive root modulo n where n is the prime specified on the instance
         """
         print(f"Calculating smallest primitive root modulo n where n = {self._prime}")
+        if self._safe:
+            from Util.safe_prime import safe_prime_root
+
+            # No need to factor p - 1 for a safe prime
+            return safe_prime_root(self._prime)
+
+        from sympy.ntheory.residue_ntheory import primitive_root
+
         return primitive_root(self._prime)
 
-    def export(self, **kwargs):
+    def export(self, prime: int, root: int, default: str = None, groups: dict = None):
         """
-        Pickle and write data to file specified on the instance
+        Write the parameters to the file specified on the instance in the format of Util.group_params
 
-        To be properly loaded back kwargs must contain at least the _prime and _root variables under the keys 'prime'
-        and 'root' respectively
+        prime and root form the default group, named default (its size in bits if not given), groups maps further
+        names to dictionaries with keys "prime" and "root"
         """
-        with open(self.filename, mode="wb") as file:
-            pickle.dump(kwargs, file)
+        default = DHGroup(default or str(prime.bit_length()), prime, root)
+        others = [DHGroup(str(name), params["prime"], params["root"]) for name, params in (groups or {}).items()
+                  if str(name) != default.name]
+        write_groups(self.filename, [default] + others)
 
     def read(self):
         """
-        Un-Pickle data saved in file and load instance variables
-
-        Pickled data must be a dictionary with keys "prime" and "root"
+        Load the default group's prime and root from the file specified on the instance
         """
-        with open(self.filename, mode="rb") as file:
-            data = pickle.load(file)
-            try:
-                self._prime = data["prime"]
-                self._root = data["root"]
-            except AttributeError:
-                raise AttributeError("File must contain a dictionary with at least keys \"prime\" and \"root\"")
+        default = read_groups(self.filename)[0]
+        self._prime = default.prime
+        self._root = default.root
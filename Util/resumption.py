@@ -0,0 +1,41 @@
+"""
+Key derivation for session resumption. After a client logs in the server hands it a ticket, an identifier for a secret
+derived from the current session key. Presenting the ticket with a fresh nonce later, from any address, gets a new
+session key derived from that secret and both sides' nonces in one round trip instead of a Diffie-Hellman exchange.
+The client proves it holds the secret with a MAC over the ticket, its nonce and its username, the identifier alone
+resumes nothing.
+"""
+
+import hashlib
+import hmac
+
+from Cryptodome.Hash import SHA3_256
+
+NONCE_SIZE = 16
+TICKET_SIZE = 16
+
+
+def resumption_secret(key: bytes) -> bytes:
+    """
+    Secret a ticket for the session with key resumes, never sent over the wire
+    """
+    return SHA3_256.new(b"jam resumption" + key).digest()
+
+
+def resumed_key(secret: bytes, client_nonce: bytes, server_nonce: bytes) -> bytes:
+    """
+    Session key of a resumed session
+    """
+    return SHA3_256.new(secret + client_nonce + server_nonce).digest()
+
+
+def resume_mac(secret: bytes, ticket_id: bytes, client_nonce: bytes, username: str) -> bytes:
+    """
+    MAC a client sends with a resume request, under the ticket's secret
+    """
+    transcript = b"jam resume" + ticket_id + client_nonce + bytes(username or "", "utf-8")
+    return hmac.new(secret, transcript, hashlib.sha3_256).digest()
+
+
+def verify_resume_mac(secret: bytes, ticket_id: bytes, client_nonce: bytes, username: str, mac: bytes) -> bool:
+    return mac is not None and hmac.compare_digest(resume_mac(secret, ticket_id, client_nonce, username), bytes(mac))
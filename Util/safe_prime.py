@@ -0,0 +1,185 @@
+"""
+Parallel search for safe primes, primes p = 2q + 1 where q is also prime. Diffie-Hellman groups built on safe primes
+have no small subgroups other than {1, p - 1}, and their primitive roots can be found without factoring p - 1.
+
+Every worker process picks a random starting point, sieves a window of candidates against the small primes (rejecting
+q or 2q + 1 with a small factor), then runs a base 2 Fermat test on q and p before the full Miller-Rabin rounds, so
+almost all of the expensive work is only done on candidates that are very likely safe primes. Once q is known to be
+prime, p passing the base 2 Fermat test proves p prime (Pocklington), so Miller-Rabin only ever runs on q.
+"""
+
+import multiprocessing
+import os
+import queue
+import time
+
+from Cryptodome.Random.random import getrandbits, randrange
+
+SIEVE_LIMIT = 1 << 16
+WINDOW = 1 << 14
+ROUNDS = 40
+
+
+def _small_primes(limit: int) -> list:
+    sieve = bytearray([1]) * limit
+    sieve[0:2] = b"\x00\x00"
+    for n in range(2, int(limit ** 0.5) + 1):
+        if sieve[n]:
+            sieve[n * n::n] = bytes(len(range(n * n, limit, n)))
+    return [n for n in range(3, limit) if sieve[n]]
+
+
+SMALL_PRIMES = _small_primes(SIEVE_LIMIT)
+
+
+def is_probable_prime(n: int, rounds: int = ROUNDS) -> bool:
+    """
+    Miller-Rabin test with random bases
+    """
+    if n < 4:
+        return n in (2, 3)
+    if not n & 1:
+        return False
+
+    d, s = n - 1, 0
+    while not d & 1:
+        d >>= 1
+        s += 1
+
+    for _ in range(rounds):
+        x = pow(randrange(2, n - 1), d, n)
+        if x == 1 or x == n - 1:
+            continue
+        for _ in range(s - 1):
+            x = x * x % n
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+
+def is_safe_prime(p: int, rounds: int = ROUNDS) -> bool:
+    q = (p - 1) // 2
+    return p > 5 and p & 3 == 3 and is_probable_prime(q, rounds) and is_probable_prime(p, rounds)
+
+
+def safe_prime_root(p: int) -> int:
+    """
+    Returns the smallest primitive root modulo the safe prime p. The group order p - 1 = 2q has only the prime
+    factors 2 and q, so g is a primitive root exactly when g ** 2 and g ** q are both not 1, which takes two
+    exponentiations per candidate instead of factoring p - 1.
+    """
+    q = (p - 1) // 2
+    for g in range(2, p):
+        if pow(g, 2, p) != 1 and pow(g, q, p) != 1:
+            return g
+    raise ValueError(f"{p} is not a safe prime")
+
+
+def _sieve_window(q0: int) -> bytearray:
+    """
+    Marks the offsets k in the window for which q = q0 + 2k or p = 2q + 1 has a small prime factor
+    """
+    composite = bytearray(WINDOW)
+    for s in SMALL_PRIMES:
+        if s >= q0:
+            break
+        half = (s + 1) // 2  # Inverse of 2 modulo s
+        r = q0 % s
+        # q divisible by s when q = 0, p = 2q + 1 divisible by s when q = (s - 1) / 2 (mod s)
+        for target in (0, (s - 1) // 2):
+            start = (target - r) * half % s
+            composite[start::s] = b"\x01" * len(range(start, WINDOW, s))
+    return composite
+
+
+def _search(n_bits: int, found: multiprocessing.Queue, stop: multiprocessing.Event, tested: multiprocessing.Value):
+    """
+    Worker process body, searches random windows until stop is set and puts every safe prime found on the queue
+    """
+    while not stop.is_set():
+        # q has n_bits - 1 bits so that p = 2q + 1 has exactly n_bits
+        q0 = getrandbits(n_bits - 1) | (1 << (n_bits - 2)) | 1
+        composite = _sieve_window(q0)
+
+        count = 0
+        for k in range(WINDOW):
+            if composite[k]:
+                continue
+            if stop.is_set():
+                break
+
+            q = q0 + 2 * k
+            p = 2 * q + 1
+            if p.bit_length() > n_bits:
+                break
+            count += 1
+            if count == 32:
+                _add(tested, count)
+                count = 0
+
+            # Cheap filters first, then the full test on the few survivors
+            if pow(2, q - 1, q) != 1 or pow(2, p - 1, p) != 1:
+                continue
+            if is_probable_prime(q):
+                found.put(p)
+                break  # Start over somewhere random so a batch is not a run of neighbouring primes
+
+        _add(tested, count)
+
+
+def _add(counter: multiprocessing.Value, amount: int):
+    with counter.get_lock():
+        counter.value += amount
+
+
+def generate_safe_primes(n_bits: int, count: int = 1, workers: int = None, progress=None) -> list:
+    """
+    Searches for count distinct safe primes of n_bits bits on workers processes (defaults to every core)
+
+    progress, if specified, is called about once a second with the number of candidates tested, the number of primes
+    found so far and the elapsed time in seconds.
+    """
+    if n_bits < 16:
+        raise ValueError("Safe primes must have at least 16 bits")
+
+    workers = workers or os.cpu_count()
+    found = multiprocessing.Queue()
+    stop = multiprocessing.Event()
+    tested = multiprocessing.Value("Q", 0)
+
+    processes = [multiprocessing.Process(target=_search, args=(n_bits, found, stop, tested), daemon=True)
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+
+    primes = []
+    start = time.monotonic()
+    try:
+        while len(primes) < count:
+            try:
+                p = found.get(timeout=1.0)
+                if p not in primes:
+                    primes.append(p)
+            except queue.Empty:
+                pass
+
+            if progress is not None:
+                progress(tested.value, len(primes), time.monotonic() - start)
+    finally:
+        stop.set()
+        for process in processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+
+    return primes
+
+
+def print_progress(tested: int, found: int, elapsed: float):
+    """
+    Progress callback for generate_safe_primes that writes a status line to the terminal
+    """
+    rate = tested / elapsed if elapsed else 0
+    print(f"\r{tested:,} candidates tested ({rate:,.0f}/s), {found} found, {elapsed:.0f}s elapsed", end="", flush=True)
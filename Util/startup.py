@@ -0,0 +1,95 @@
+"""
+Startup profiling for the --profile-startup flags of the server and the client. Import times are measured in a fresh
+interpreter with python -X importtime, by the time a command line is parsed everything the program imports is loaded
+already. Initialization steps are timed in the running process: begin starts a profile and every mark records the time
+since the previous one.
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+_marks = None
+_last = None
+
+
+def begin():
+    """
+    Starts recording marks, clearing any recorded before
+    """
+    global _marks, _last
+    _marks = []
+    _last = time.perf_counter()
+
+
+def mark(step: str):
+    """
+    Records the time since begin or the previous mark as the time step took, does nothing before begin is called
+    """
+    global _last
+    if _marks is None:
+        return
+    now = time.perf_counter()
+    _marks.append((step, now - _last))
+    _last = now
+
+
+def init_times() -> list:
+    """
+    Returns the marks recorded since begin as (step, seconds)
+    """
+    return list(_marks or ())
+
+
+def import_times(module: str) -> (float, float, list):
+    """
+    Imports module in a fresh interpreter and returns the seconds the interpreter took to start, the seconds importing
+    module took and (name, self seconds, cumulative seconds) for every module it imports directly, slowest first
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in sys.path if path))
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], env=env,
+                            capture_output=True, text=True, check=True)
+
+    # Lines are "import time: self [us] | cumulative | name" with two spaces of indent per level, every module after
+    # the modules it imported
+    interpreter, total, children, pending = 0.0, 0.0, [], []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        own, cumulative, name = int(own) / 1e6, int(cumulative) / 1e6, name.strip()
+
+        if depth == 1:
+            pending.append((name, own, cumulative))
+        elif depth == 0 and name == module:
+            total, children = cumulative, pending
+        elif depth == 0:
+            interpreter += cumulative
+            pending = []
+    return interpreter, total, sorted(children, key=lambda child: child[2], reverse=True)
+
+
+def report_imports(*modules: str, threshold: float = 0.0005):
+    """
+    Prints the import times of modules, leaving out imports that took less than threshold seconds. Call it before
+    starting anything that competes for the CPU, such as worker processes.
+    """
+    for module in modules:
+        interpreter, total, children = import_times(module)
+        print(f"Importing {module} took {total * 1e3:.1f} ms, starting the interpreter {interpreter * 1e3:.1f} ms")
+        print(f"    {'module':<40}{'self ms':>10}{'total ms':>10}")
+        for name, own, cumulative in children:
+            if cumulative >= threshold:
+                print(f"    {name:<40}{own * 1e3:>10.1f}{cumulative * 1e3:>10.1f}")
+
+
+def report_init():
+    """
+    Prints the marks recorded since begin
+    """
+    steps = init_times()
+    print(f"Initialization took {sum(seconds for _, seconds in steps) * 1e3:.1f} ms")
+    for step, seconds in steps:
+        print(f"    {step:<40}{seconds * 1e3:>20.1f}")
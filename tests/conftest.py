@@ -0,0 +1,80 @@
+import os
+import sqlite3
+import sys
+
+import pytest
+
+# The packages live at the repository root, which is not a package itself
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    """
+    A database created from the server's schema
+    """
+    path = str(tmp_path / "users.db")
+    with open(os.path.join(ROOT, "Server", "data", "schema.sql")) as schema:
+        connection = sqlite3.connect(path)
+        connection.executescript(schema.read())
+        connection.close()
+    return path
+
+
+@pytest.fixture
+def server(db_path, monkeypatch):
+    """
+    A threaded server on db_path that is never started, handlers are run directly. Datagrams it would send are
+    recorded in server.sent as (payload, username) instead.
+    """
+    from Server.server import create_server
+
+    # The server reads its group parameters relative to Server/
+    monkeypatch.chdir(os.path.join(ROOT, "Server"))
+    server = create_server("threaded", ("localhost", 0), db_path, kdf="pbkdf2_sha256:iterations=1000",
+                           hash_workers=0)
+    server.sent = []
+    server.send_datagrams = lambda payload, recipient: server.sent.append((payload, recipient.username))
+    yield server
+    server.server_close()
+
+
+
+def _serving(engine: str, db_path: str, monkeypatch):
+    import threading
+    import time
+
+    from Server.server import create_server
+
+    monkeypatch.chdir(os.path.join(ROOT, "Server"))
+    server = create_server(engine, ("127.0.0.1", 0), db_path, kdf="pbkdf2_sha256:iterations=1000", hash_workers=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    # The async engine replaces the server's sendto once its endpoint is up
+    deadline = time.monotonic() + 5
+    while engine == "async" and "sendto_many" not in vars(server):
+        assert time.monotonic() < deadline, "async server did not start"
+        time.sleep(0.01)
+
+    yield server
+    server.shutdown()
+    thread.join(5)
+    server.server_close()
+
+
+@pytest.fixture
+def threaded_server(db_path, monkeypatch):
+    """
+    A threaded server on db_path serving on a local port from a background thread
+    """
+    yield from _serving("threaded", db_path, monkeypatch)
+
+
+@pytest.fixture
+def async_server(db_path, monkeypatch):
+    """
+    An async server on db_path serving on a local port from a background thread
+    """
+    yield from _serving("async", db_path, monkeypatch)
@@ -0,0 +1,55 @@
+import pytest
+
+from MessageTypes import codec
+from MessageTypes.message import LoginMessage
+from Server.admission import RateLimiter
+from Server.server import ClientInfo, ThreadedUDPHandler
+
+KEY = bytes(range(32))
+
+
+def test_check_does_not_take_tokens():
+    limiter = RateLimiter(rate=0.001, burst=2)
+    assert all(limiter.available("key") for _ in range(10))
+
+    limiter.charge("key")
+    limiter.charge("key")
+    assert not limiter.available("key")
+    assert not limiter.allow("key")
+    assert limiter.available("other")
+
+
+@pytest.fixture
+def login(server):
+    server.users.add_user("alice", server.passwords.hash("secret", "salt"), "salt")
+
+    def login(address: tuple, password: str) -> str:
+        if address not in server.client_list:
+            server.client_list.add(address, ClientInfo(address, key=KEY))
+        message = LoginMessage(KEY, "alice", password, sender="alice")
+        ThreadedUDPHandler((codec.encode(message), server.socket), address, server)
+        # Replies are encrypted under the session key, the reply to a login is the last of them
+        replies = [codec.decode(payload, KEY) for payload, _ in server.sent]
+        server.sent.clear()
+        texts = [reply.decrypt() for reply in replies if hasattr(reply, "decrypt")]
+        return texts[-1]
+
+    return login
+
+
+def test_failed_logins_are_limited_per_address(login):
+    attacker, owner = ("10.0.0.1", 5000), ("10.0.0.2", 5000)
+
+    assert [login(attacker, "guess") for _ in range(5)] == ["Login Failed."] * 5
+    assert login(attacker, "guess") == "Server Busy, Try Again Later."
+    # Another port of the same host shares the budget
+    assert login(("10.0.0.1", 5001), "secret") == "Server Busy, Try Again Later."
+
+    # Guesses from elsewhere do not lock the owner out
+    assert login(owner, "secret") == "Login Successful."
+
+
+def test_successful_logins_are_not_charged(login):
+    address = ("10.0.0.3", 5000)
+    assert [login(address, "secret") for _ in range(8)] == ["Login Successful."] * 8
+    assert login(address, "guess") == "Login Failed."
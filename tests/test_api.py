@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+from Client.api import BlockingClient, Client, LoginError, Received
+
+
+def test_send_many_batches_messages(threaded_server):
+    port = threaded_server.server_address[1]
+
+    async def main():
+        async with Client("127.0.0.1", port) as bot, Client("127.0.0.1", port) as alice:
+            await bot.register("bot", "password")
+            await alice.register("alice", "password")
+            with pytest.raises(LoginError):
+                await alice.register("alice", "password")
+
+            await bot.send_many([("alice", f"m{i}") for i in range(30)])
+            return [await asyncio.wait_for(alice.receive(), 5) for _ in range(30)]
+
+    # Each batch is a datagram of its own, batches can overtake each other
+    assert set(asyncio.run(main())) == {Received("bot", f"m{i}") for i in range(30)}
+    assert threaded_server.metrics.counters["batched"] > 0
+
+
+def test_connect_resumes_the_stored_session(threaded_server, tmp_path):
+    port = threaded_server.server_address[1]
+    ticket_path = str(tmp_path / "ticket.json")
+
+    async def main():
+        async with Client("127.0.0.1", port, ticket_path=ticket_path) as bot:
+            await bot.register("bot", "password")
+            assert not bot.resumed
+        async with Client("127.0.0.1", port, ticket_path=ticket_path) as bot, Client("127.0.0.1", port) as alice:
+            await alice.register("alice", "password")
+            await bot.send("alice", "back again")
+            return bot.resumed, bot.username, await asyncio.wait_for(alice.receive(), 5)
+
+    assert asyncio.run(main()) == (True, "bot", Received("bot", "back again"))
+
+
+def test_blocking_client(threaded_server):
+    port = threaded_server.server_address[1]
+    with BlockingClient("127.0.0.1", port, timeout=10) as bot, BlockingClient("127.0.0.1", port, timeout=10) as alice:
+        bot.register("bot", "password")
+        alice.register("alice", "password")
+        bot.send("alice", "hi")
+
+        assert alice.receive(5) == Received("bot", "hi")
+        with pytest.raises(asyncio.TimeoutError):
+            alice.receive(0.2)
+
+
+def test_full_queue_drops_the_oldest_message(threaded_server):
+    port = threaded_server.server_address[1]
+
+    async def main():
+        async with Client("127.0.0.1", port) as bot, Client("127.0.0.1", port, max_received=2) as alice:
+            await bot.register("bot", "password")
+            await alice.register("alice", "password")
+            for i in range(4):
+                await bot.send("alice", f"m{i}")
+                await asyncio.sleep(0.05)  # In order, one datagram each
+
+            while alice.dropped < 2:
+                await asyncio.sleep(0.01)
+            return [alice.received.get_nowait().text for _ in range(2)], alice.dropped
+
+    assert asyncio.run(asyncio.wait_for(main(), 10)) == (["m2", "m3"], 2)
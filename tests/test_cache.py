@@ -0,0 +1,55 @@
+from types import SimpleNamespace
+
+import pytest
+
+from Server import cache
+from Server.cache import TTLCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Replaces the cache's clock with one that only moves when told to, clock[0] is the current time
+    """
+    now = [1000.0]
+    monkeypatch.setattr(cache, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+def test_least_recently_used_entry_is_evicted():
+    entries = TTLCache(max_size=2)
+    entries.set("alice", 1)
+    entries.set("bob", 2)
+    entries.get("alice")
+    entries.set("carol", 3)
+
+    assert entries.get("alice") == 1 and entries.get("carol") == 3
+    assert entries.is_miss(entries.get("bob"))
+    assert entries.stats()["evictions"] == 1
+
+
+def test_entries_expire_negative_ones_sooner(clock):
+    entries = TTLCache(ttl=300.0, negative_ttl=30.0)
+    entries.set("alice", "record")
+    entries.set("nobody", None)
+
+    # A cached None is a hit, not a miss
+    assert entries.get("nobody") is None
+    clock[0] += 31
+    assert entries.is_miss(entries.get("nobody"))
+    assert entries.get("alice") == "record"
+    clock[0] += 270
+    assert entries.is_miss(entries.get("alice"))
+    assert len(entries) == 0
+
+
+def test_add_keeps_a_live_entry(clock):
+    entries = TTLCache(ttl=10.0)
+    entries.set("alice", "written")
+
+    assert not entries.add("alice", "read earlier")
+    assert entries.get("alice") == "written"
+    clock[0] += 11
+    assert entries.add("alice", "read later")
+    assert entries.pop("alice") == "read later"
+    assert entries.pop("alice", "gone") == "gone"
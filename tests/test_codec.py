@@ -0,0 +1,124 @@
+import os
+
+import pytest
+
+from MessageTypes import codec
+from MessageTypes.message import EncryptedMessage, KeyExchangeMessage, LoginMessage, RoomMessage, ResumeMessage, \
+    BatchMessage, Message, GCM, CHACHA20_POLY1305
+
+KEY = bytes(range(32))
+
+
+@pytest.mark.parametrize("wire_format", [codec.BINARY, codec.YAML])
+def test_encrypted_round_trip(wire_format):
+    for mode in (codec.EAX, GCM, CHACHA20_POLY1305):
+        message = EncryptedMessage(KEY, "hello bob", recipient="bob", sender="alice", mode=mode)
+        decoded = codec.decode(codec.encode(message, wire_format), KEY)
+
+        assert type(decoded) is EncryptedMessage
+        assert (decoded.recipient, decoded.sender) == ("bob", "alice")
+        assert decoded.decrypt() == "hello bob"
+
+
+@pytest.mark.parametrize("wire_format", [codec.BINARY, codec.YAML])
+def test_message_round_trips(wire_format):
+    exchange = KeyExchangeMessage("Request Key Exchange", 23, 5, 8, recipient="bob", sender="alice",
+                                  formats=(codec.BINARY, codec.YAML))
+    decoded = codec.decode(codec.encode(exchange, wire_format))
+    assert (decoded.request, decoded.prime, decoded.root, decoded.public) == ("Request Key Exchange", 23, 5, 8)
+    assert tuple(decoded.formats) == (codec.BINARY, codec.YAML)
+
+    login = codec.decode(codec.encode(LoginMessage(KEY, "alice", "secret", sender="alice"), wire_format), KEY)
+    assert type(login) is LoginMessage
+    assert (login.username.decrypt(), login.password.decrypt()) == ("alice", "secret")
+
+    room = codec.decode(codec.encode(RoomMessage("join", "lobby", sender="alice"), wire_format))
+    assert (room.request, room.room, room.sender) == ("join", "lobby", "alice")
+
+    resume = codec.decode(codec.encode(ResumeMessage("resume", ticket_id=b"\x01" * 16, nonce=b"\x02" * 16,
+                                                     mac=b"\x03" * 32), wire_format))
+    assert (bytes(resume.ticket_id), bytes(resume.nonce), bytes(resume.mac)) == (b"\x01" * 16, b"\x02" * 16,
+                                                                                 b"\x03" * 32)
+
+    assert codec.decode(codec.encode(Message("plain"), wire_format)).text == "plain"
+
+
+def test_yaml_never_carries_keys():
+    login = LoginMessage(KEY, "alice", "secret", sender="alice")
+    room = RoomMessage("key", "lobby", EncryptedMessage(KEY, "00" * 32))
+    for message in (EncryptedMessage(KEY, "hello bob", recipient="bob", sender="alice"), login, room):
+        document = codec.encode(message, codec.YAML)
+        assert b"key:" not in document.replace(b"room_key:", b"")
+        assert codec.decode(document).__class__ is message.__class__
+
+    # The message being sent keeps its key
+    assert login.username.key == KEY
+
+
+def test_batch_round_trip():
+    frames = [codec.encode(EncryptedMessage(KEY, f"m{i}", recipient="bob", sender="alice")) for i in range(20)]
+    batches = codec.pack(frames, 1400)
+    assert len(batches) < len(frames)
+
+    texts = []
+    for batch in batches:
+        decoded = codec.decode(batch, KEY)
+        messages = decoded.messages if type(decoded) is BatchMessage else [decoded]
+        texts.extend(message.decrypt() for message in messages)
+    assert texts == [f"m{i}" for i in range(20)]
+
+
+def test_peek_reads_routing_fields():
+    frame = codec.encode(EncryptedMessage(KEY, "hi", recipient="bob", sender="alice"))
+    assert codec.peek(frame) == (codec.ENCRYPTED, "bob", "alice")
+
+
+def test_truncated_binary_frame_is_rejected():
+    frame = codec.encode(EncryptedMessage(KEY, "hi", recipient="bob", sender="alice"))
+    with pytest.raises(codec.CodecError):
+        codec.decode(frame[:len(frame) // 2])
+
+
+@pytest.mark.parametrize("payload", [
+    b"!!python/object/apply:os.getpid []",
+    b"!!python/object/apply:os.system ['true']",
+    b"!!python/object/new:subprocess.Popen [['true']]",
+    b"!!python/object:subprocess.Popen {args: true}",
+    b"!!python/name:os.system",
+    b"!!python/object:MessageTypes.codec._Reader {}",
+])
+def test_unsafe_yaml_is_rejected(payload, monkeypatch):
+    calls = []
+    monkeypatch.setattr(os, "getpid", lambda: calls.append("getpid") or 0)
+    monkeypatch.setattr(os, "system", lambda command: calls.append(command) or 0)
+
+    # Nothing is constructed from documents the loader refuses
+    with pytest.raises(codec.CodecError):
+        codec.decode(payload)
+    assert not calls
+
+
+@pytest.mark.parametrize("payload", [
+    b"just some text",
+    b"[1, 2, 3]",
+    b"!!binary aGk=",
+    b"{unbalanced",
+    b"\xff\xfe",
+    codec.HEADER.pack(codec.MAGIC, codec.VERSION, codec.MESSAGE) + b"\x00\x02\xff\xfe",
+    codec.HEADER.pack(codec.MAGIC, codec.VERSION, codec.MESSAGE) + b"\xff\xff" * 2 + b"\x01\x00\x00\x00\x01\xff",
+    codec.HEADER.pack(codec.MAGIC, codec.VERSION, codec.MESSAGE) + b"\xff\xff" * 2 + b"\x01\xff\xff\xff\xff",
+])
+def test_anything_but_a_message_raises_codec_error(payload):
+    with pytest.raises(codec.CodecError):
+        codec.decode(payload)
+
+
+def test_yaml_loader_builds_only_message_classes():
+    import yaml
+
+    document = "!!python/object:MessageTypes.message.Message {text: hi, recipient: bob, sender: null}"
+    message = yaml.load(document, Loader=codec.yaml_loader())
+    assert type(message) is Message and message.text == "hi"
+
+    with pytest.raises(yaml.YAMLError):
+        yaml.load("!!python/object/apply:os.getpid []", Loader=codec.yaml_loader())
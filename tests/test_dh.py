@@ -0,0 +1,68 @@
+from types import SimpleNamespace
+
+import pytest
+from Cryptodome.Random.random import getrandbits
+
+from Util import dh
+from Util.group_params import DHGroup
+from Util.safe_prime import is_probable_prime
+
+
+def first_prime(start: int) -> int:
+    candidate = start | 1
+    while not is_probable_prime(candidate):
+        candidate += 2
+    return candidate
+
+
+# Large enough for several table rows at every window size, the arithmetic does not need a safe prime
+GROUP = DHGroup("test", first_prime(1 << 511), 3)
+
+
+@pytest.mark.parametrize("window", [1, 4, dh.DEFAULT_WINDOW])
+def test_fixed_base_table_matches_pow(window):
+    table = dh.FixedBaseTable(GROUP.root, GROUP.prime, window=window)
+    bits = GROUP.n_bits
+
+    exponents = [0, 1, 2, (1 << bits) - 1, GROUP.prime - 2] + [getrandbits(bits) for _ in range(20)]
+    # Beyond the table, and negative exponents, fall back to pow
+    exponents += [1 << bits, (1 << (bits + 7)) + 3]
+    for exponent in exponents:
+        assert table.pow(exponent) == pow(GROUP.root, exponent, GROUP.prime)
+    assert table.pow(-1) == pow(GROUP.root, -1, GROUP.prime)
+
+
+@pytest.mark.parametrize("public", [0, 1, GROUP.prime - 1, GROUP.prime, GROUP.prime + 2, -2, 2.0, "2"])
+def test_rejects_public_values_outside_the_group(public):
+    with pytest.raises(ValueError):
+        dh.validate_public(GROUP.prime, public)
+    with pytest.raises(ValueError):
+        dh.shared_secret(GROUP.prime, 12345, public)
+
+
+@pytest.mark.parametrize("cached", [True, False])
+def test_both_sides_agree_on_the_secret(cached):
+    for _ in range(dh.BUILD_AFTER + 2):  # Past the point where the table is built
+        secret, public = dh.generate_keypair(GROUP.prime, GROUP.root, cached=cached)
+        peer_secret, peer_public = dh.generate_keypair(GROUP.prime, GROUP.root, cached=cached)
+
+        assert public == pow(GROUP.root, secret, GROUP.prime)
+        dh.validate_public(GROUP.prime, public)
+        assert dh.shared_secret(GROUP.prime, secret, peer_public) == dh.shared_secret(GROUP.prime, peer_secret, public)
+
+
+def test_uncached_groups_never_get_a_table():
+    prime, root = 1019, 2  # Not one of ours
+    for _ in range(dh.BUILD_AFTER + 2):
+        dh.generate_keypair(prime, root, cached=False)
+
+    assert (prime, root, dh.DEFAULT_WINDOW) not in dh._tables
+
+
+def test_answers_only_requests_in_known_groups():
+    groups = SimpleNamespace(find=lambda prime, root: GROUP if (prime, root) == (GROUP.prime, GROUP.root) else None)
+
+    assert dh.accept_request(groups, GROUP.prime, GROUP.root, 5) is GROUP
+    for prime, root, public in ((GROUP.prime, 5, 5), (1019, 2, 5), (GROUP.prime, GROUP.root, 1)):
+        with pytest.raises(ValueError):
+            dh.accept_request(groups, prime, root, public)
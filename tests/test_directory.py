@@ -0,0 +1,70 @@
+import shutil
+import tempfile
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from Server.directory import Directory
+from Server.tickets import TicketStore
+
+
+def fake_server():
+    return SimpleNamespace(tickets=TicketStore(), rooms=SimpleNamespace(invalidate=lambda name: None),
+                           client_list=SimpleNamespace(release=lambda username: None),
+                           users=SimpleNamespace(cache=SimpleNamespace(invalidate=lambda username: None)))
+
+
+def wait_for(condition, timeout: float = 2.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@pytest.fixture
+def workers():
+    run_dir = tempfile.mkdtemp(prefix="jam-test-")
+    directories = [Directory(index, 2, run_dir) for index in range(2)]
+    yield directories
+    for directory in directories:
+        directory.close()
+    shutil.rmtree(run_dir, ignore_errors=True)
+
+
+def start(directory: Directory):
+    server = fake_server()
+    server.tickets.on_issue = directory.ticket_issued
+    server.tickets.on_drop = directory.ticket_dropped
+    directory.start(server)
+    return server
+
+
+def test_tickets_are_shared_and_used_once(workers):
+    first, second = start(workers[0]), start(workers[1])
+
+    ticket_id = first.tickets.issue(b"\x05" * 32, "alice", "eax")
+    assert wait_for(lambda: second.tickets.find(ticket_id) is not None)
+    ticket = second.tickets.find(ticket_id)
+    assert (ticket.secret, ticket.username, ticket.cipher_mode) == (b"\x05" * 32, "alice", "eax")
+
+    # Redeemed on the worker the client resumed on, gone from the one that issued it
+    assert second.tickets.redeem(ticket_id) is not None
+    assert wait_for(lambda: first.tickets.find(ticket_id) is None)
+
+
+def test_announcements_do_not_send_on_the_calling_thread(workers):
+    directory, peer = workers
+    start(peer)
+
+    # Not started, so nothing drains the queue: the calls return without touching the socket
+    directory.routes["alice"] = directory.index
+    directory.unbound("alice")
+    directory.bound("bob")
+    assert directory._outbox.qsize() == 2
+    assert peer.routes == {}
+
+    directory.start(fake_server())
+    assert wait_for(lambda: peer.routes == {"bob": 0})
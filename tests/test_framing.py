@@ -0,0 +1,109 @@
+import os
+
+import pytest
+
+from MessageTypes import framing
+from MessageTypes.framing import Fragmenter, Reassembler, FramingError, HEADER, MAGIC, VERSION
+
+SENDER = ("127.0.0.1", 40000)
+
+
+def fragment_header(message_id: int, index: int, count: int) -> bytes:
+    return HEADER.pack(MAGIC, VERSION, message_id, index, count)
+
+
+def test_small_payloads_pass_through():
+    assert Fragmenter().fragment(b"hello") == [b"hello"]
+    assert Reassembler().feed(SENDER, b"hello") == b"hello"
+
+
+def test_round_trip_in_any_order():
+    payload = os.urandom(10000)
+    fragments = Fragmenter(fragment_size=500).fragment(payload)
+    assert len(fragments) > 1 and all(len(fragment) <= 500 for fragment in fragments)
+
+    reassembler = Reassembler()
+    fragments = fragments[::-1] + fragments[:1]  # Reversed, with a duplicate at the end
+    results = [reassembler.feed(SENDER, fragment) for fragment in fragments]
+    assert results[len(fragments) - 2] == payload
+    assert [result for result in results if result is not None] == [payload]
+
+
+def test_count_beyond_byte_budget_is_refused():
+    reassembler = Reassembler(max_bytes=64 * 1024)
+    # 0xFFFF fragments of about 1200 bytes could never fit in 64KB
+    with pytest.raises(FramingError):
+        reassembler.feed(SENDER, fragment_header(1, 0, framing.MAX_FRAGMENTS) + b"x" * 1000)
+    assert not reassembler._senders
+
+
+def test_huge_count_allocates_nothing_up_front():
+    reassembler = Reassembler()
+    # The last fragment alone says little about the total size, it is accepted but holds one chunk
+    assert reassembler.feed(SENDER, fragment_header(1, framing.MAX_FRAGMENTS - 1, framing.MAX_FRAGMENTS) + b"x") is None
+    partial = reassembler._senders[SENDER][1]
+    assert len(partial.parts) == 1
+
+
+def test_byte_budget_counts_headers_and_drops_oldest():
+    chunk = b"x" * 100
+    size = HEADER.size + len(chunk)
+    reassembler = Reassembler(max_bytes=3 * size)
+
+    for message_id in range(4):
+        assert reassembler.feed(SENDER, fragment_header(message_id, 0, 2) + chunk) is None
+    pending = reassembler._senders[SENDER]
+    assert list(pending) == [1, 2, 3]
+    assert sum(partial.size for partial in pending.values()) == 3 * size
+    assert reassembler.dropped == 1
+
+
+def test_max_pending_per_sender():
+    reassembler = Reassembler(max_pending=2)
+    for message_id in range(5):
+        reassembler.feed(SENDER, fragment_header(message_id, 0, 2) + b"x")
+    assert list(reassembler._senders[SENDER]) == [3, 4]
+
+
+@pytest.mark.parametrize("datagram", [
+    MAGIC + b"\x01",
+    fragment_header(1, 0, 0),
+    fragment_header(1, 2, 2) + b"x",
+    HEADER.pack(MAGIC, VERSION + 1, 1, 0, 2) + b"x",
+])
+def test_malformed_fragments_are_rejected(datagram):
+    with pytest.raises(FramingError):
+        Reassembler().feed(SENDER, datagram)
+
+
+def test_count_must_not_change_mid_message():
+    reassembler = Reassembler()
+    reassembler.feed(SENDER, fragment_header(1, 0, 3) + b"x")
+    with pytest.raises(FramingError):
+        reassembler.feed(SENDER, fragment_header(1, 1, 4) + b"x")
+
+
+def test_total_byte_budget_drops_oldest_across_senders():
+    chunk = b"x" * 100
+    size = HEADER.size + len(chunk)
+    reassembler = Reassembler(max_total_bytes=3 * size)
+
+    for port in range(4):
+        assert reassembler.feed(("127.0.0.1", port), fragment_header(1, 0, 2) + chunk) is None
+    assert list(reassembler._senders) == [("127.0.0.1", 1), ("127.0.0.1", 2), ("127.0.0.1", 3)]
+    assert reassembler.total == 3 * size
+    assert reassembler.dropped == 1
+
+    # Completing a message gives its bytes back
+    assert reassembler.feed(("127.0.0.1", 3), fragment_header(1, 1, 2) + chunk) == chunk * 2
+    assert reassembler.total == 2 * size
+
+
+def test_expire_drops_old_messages(monkeypatch):
+    reassembler = Reassembler(timeout=10.0)
+    reassembler.feed(SENDER, fragment_header(1, 0, 2) + b"x")
+    assert reassembler.expire() == 0
+
+    monkeypatch.setattr(framing.time, "monotonic", lambda: reassembler._order[(SENDER, 1)].started + 10.0)
+    assert reassembler.expire() == 1
+    assert not reassembler._senders and not reassembler._order and reassembler.total == 0
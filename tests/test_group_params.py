@@ -0,0 +1,130 @@
+import hashlib
+import os
+import pickle
+import struct
+
+import pytest
+
+from Util.group_params import (CACHE_SUFFIX, DHGroup, GroupStore, MAGIC, decode_groups, encode_groups, load_groups,
+                               read_groups, write_groups)
+
+# Small safe primes, fine for checking how groups are stored and looked up
+SMALL = DHGroup("small", 23, 5)
+MEDIUM = DHGroup("medium", 47, 5)
+LARGE = DHGroup("large", 59, 2)
+
+
+@pytest.fixture
+def params(tmp_path):
+    path = str(tmp_path / "prime.bin")
+    write_groups(path, [SMALL, MEDIUM])
+    return path
+
+
+def test_store_looks_up_groups_by_name_and_parameters(params):
+    groups = GroupStore(params)
+
+    assert groups.get() == groups.default == SMALL
+    assert groups.get("medium") == MEDIUM
+    assert groups.find(47, 5) == MEDIUM
+    assert groups.find(47) == MEDIUM
+    # Known prime with another root, or parameters that are not ours
+    assert groups.find(47, 2) is None
+    assert groups.find(59, 2) is None
+    with pytest.raises(KeyError):
+        groups.get("large")
+
+
+def test_store_reloads_a_changed_file(params):
+    groups = GroupStore(params)
+    assert not groups.reload_if_changed()
+
+    write_groups(params, [LARGE, SMALL])
+    stat = os.stat(params)
+    os.utime(params, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))  # Rewritten within the clock's resolution
+
+    assert groups.reload_if_changed()
+    assert groups.default == LARGE
+    assert set(groups.groups) == {"large", "small"}
+    assert groups.find(47) is None
+
+
+def test_stores_are_shared_per_file(params, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    assert load_groups(params) is load_groups("prime.bin")
+
+
+def sealed(data: bytes) -> bytes:
+    """
+    data with the checksum a parameters file ends with
+    """
+    return data + hashlib.sha256(data).digest()
+
+
+def test_round_trip_keeps_the_default_first(params):
+    assert read_groups(params) == [SMALL, MEDIUM]
+    assert decode_groups(encode_groups([LARGE, SMALL], source=bytes(range(32)))) == ([LARGE, SMALL], bytes(range(32)))
+
+
+@pytest.mark.parametrize("data", [
+    b"",
+    b"\x80\x04not a parameters file",
+    encode_groups([SMALL])[:-1] + b"\x00",  # Checksum does not match
+    sealed(encode_groups([SMALL])[:4] + b"\x02" + encode_groups([SMALL])[5:-32]),  # Unknown version
+    sealed(encode_groups([SMALL])[:-34]),  # Truncated
+    sealed(encode_groups([SMALL])[:-32] + b"\x00"),  # Trailing data
+    encode_groups([]),
+    encode_groups([DHGroup("even", 24, 5)]),
+    encode_groups([DHGroup("tiny", 3, 2)]),
+    encode_groups([DHGroup("trivial root", 23, 22)]),
+    encode_groups([SMALL, DHGroup("small", 47, 5)]),
+])
+def test_rejects_anything_but_an_intact_file_of_sane_groups(data):
+    with pytest.raises(ValueError):
+        decode_groups(data)
+
+
+def test_read_rejects_a_file_with_more_groups_than_it_claims(tmp_path):
+    data = encode_groups([SMALL, MEDIUM])[:-32]
+    # Claims one group, followed by the fields of a second one
+    data = data[:5] + struct.pack(">H", 1) + data[7:]
+    path = str(tmp_path / "prime.bin")
+    with open(path, "wb") as file:
+        file.write(sealed(data))
+
+    with pytest.raises(ValueError):
+        read_groups(path)
+
+
+def write_pickle(path: str, data):
+    with open(path, "wb") as file:
+        pickle.dump(data, file)
+
+
+def test_converts_pickle_files_once(tmp_path):
+    path = str(tmp_path / "prime.bin")
+    write_pickle(path, {"prime": 23, "root": 5, "groups": {"medium": {"prime": 47, "root": 5}}})
+
+    default = DHGroup("5", 23, 5)  # Named after its size in bits, as older files had no names
+    assert read_groups(path) == [default, MEDIUM]
+    with open(path + CACHE_SUFFIX, "rb") as file:
+        assert file.read().startswith(MAGIC)
+
+    # The converted file is read as long as the pickle stays the same
+    with open(path, "rb") as file:
+        write_groups(path + CACHE_SUFFIX, [default], hashlib.sha256(file.read()).digest())
+    assert read_groups(path) == [default]
+
+    write_pickle(path, {"default": "large", "prime": 59, "root": 2})
+    assert read_groups(path) == [LARGE]
+
+
+@pytest.mark.parametrize("data", [{"prime": 23}, [23, 5], {"prime": 24, "root": 5}, DHGroup("small", 23, 5)])
+def test_refuses_pickles_that_are_not_plain_parameters(tmp_path, data):
+    path = str(tmp_path / "prime.bin")
+    write_pickle(path, data)
+
+    # A named tuple is pickled as a reference to its class, which is never looked up
+    with pytest.raises((AttributeError, ValueError)):
+        read_groups(path)
+    assert not os.path.exists(path + CACHE_SUFFIX)
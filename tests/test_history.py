@@ -0,0 +1,121 @@
+import sqlite3
+from concurrent.futures import Future
+
+import pytest
+
+from Client import history as history_module
+from Client.history import History
+
+
+@pytest.fixture
+def path(tmp_path, monkeypatch):
+    # The KDF cost is not what these tests are about
+    monkeypatch.setattr(history_module, "KDF_PARAMS", {"n": 16, "r": 1, "p": 1})
+    return str(tmp_path / "history.db")
+
+
+@pytest.fixture
+def history(path):
+    history = History(path, "passphrase", search=True, page_size=4)
+    yield history
+    history.close()
+
+
+def fill(history: History, peer: str, count: int, start: float = 1000.0):
+    for i in range(count):
+        history.append(peer, "alice" if i % 2 else "bob", f"message {i}", sent=start + i)
+    history.flush()
+
+
+def test_round_trip_survives_reopening(path, history):
+    history.append("bob", "alice", "Lunch at noon?", sent=1000.0)
+    history.append("#lobby", None, "Hello room", sent=1001.0)
+    history.close()
+
+    reopened = History(path, "passphrase")
+    try:
+        [entry] = reopened.page("bob")
+        assert (entry.peer, entry.sender, entry.text, entry.sent) == ("bob", "alice", "Lunch at noon?", 1000.0)
+        assert [entry.text for entry in reopened.page("#lobby")] == ["Hello room"]
+        assert reopened.page("carol") == []
+    finally:
+        reopened.close()
+
+
+def test_wrong_passphrase_raises(path, history):
+    fill(history, "bob", 1)
+    history.close()
+
+    with pytest.raises(ValueError):
+        History(path, "wrong")
+
+
+def test_nothing_is_stored_in_the_clear(path, history):
+    history.append("bob", "alice", "Lunch at noon?")
+    history.flush()
+
+    with open(path, "rb") as file:
+        data = file.read()
+    assert b"Lunch" not in data and b"lunch" not in data and b"alice" not in data and b"bob" not in data
+
+
+def test_pages_scroll_back_oldest_first(history):
+    fill(history, "bob", 10)
+    fill(history, "carol", 3)
+
+    latest = history.page("bob", size=4)
+    assert [entry.text for entry in latest] == [f"message {i}" for i in range(6, 10)]
+    older = history.page("bob", before=latest[0], size=4)
+    assert [entry.text for entry in older] == [f"message {i}" for i in range(2, 6)]
+    assert [entry.text for entry in history.page("bob", before=older[0], size=4)] == ["message 0", "message 1"]
+
+
+def test_messages_stream_a_time_range_in_pages(history):
+    fill(history, "bob", 10)
+
+    # page_size is 4, so this takes several reads
+    assert [entry.text for entry in history.messages("bob")] == [f"message {i}" for i in range(10)]
+    assert [entry.sent for entry in history.messages("bob", since=1003.0, until=1007.0)] == [1003, 1004, 1005, 1006]
+
+
+def test_search_matches_whole_words_newest_first(history):
+    history.append("bob", "bob", "Lunch at noon?", sent=1000.0)
+    history.append("carol", "carol", "lunch tomorrow", sent=1001.0)
+    history.append("bob", "alice", "Launch day", sent=1002.0)
+    fill(history, "dave", 6, start=2000.0)
+
+    assert [entry.text for entry in history.search("LUNCH")] == ["lunch tomorrow", "Lunch at noon?"]
+    assert [entry.text for entry in history.search("lunch", peer="bob")] == ["Lunch at noon?"]
+    assert list(history.search("lunch noon")) == list(history.search("noon"))
+    assert list(history.search("lun")) == []
+    # More matches than page_size
+    assert len(list(history.search("message", peer="dave"))) == 6
+
+
+def test_search_needs_the_word_index(path):
+    history = History(path, "passphrase")
+    try:
+        with pytest.raises(ValueError):
+            list(history.search("lunch"))
+    finally:
+        history.close()
+
+
+def test_failed_batch_is_rolled_back(history, monkeypatch):
+    seal = history._seal
+
+    def seal_or_fail(peer, sender, text, sent):
+        if text == "there":
+            raise sqlite3.OperationalError("disk I/O error")
+        return seal(peer, sender, text, sent)
+
+    # The first message is inserted before the second one fails, neither may be kept
+    monkeypatch.setattr(history, "_seal", seal_or_fail)
+    batch = [(("bob", "alice", text, 1000.0), Future()) for text in ("hi", "there")]
+    with history.pool.connection() as connection:
+        history._write(connection, batch)
+
+    for _, future in batch:
+        with pytest.raises(sqlite3.Error):
+            future.result()
+    assert history.page("bob") == []
@@ -0,0 +1,45 @@
+import argparse
+import math
+import os
+import socket
+
+from Benchmark.load_benchmark import PHASES, compare, percentile, run, summarize
+
+SERVER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Server")
+
+
+def phase(throughput: float, p99_ms: float, drop_rate: float = 0.0) -> dict:
+    return {"throughput": throughput, "p99_ms": p99_ms, "drop_rate": drop_rate}
+
+
+def test_summary_counts_failures_as_dropped():
+    summary = summarize([(True, 0.001), (True, 0.003), (False, 5.0), (True, 0.002)], elapsed=1.0)
+
+    assert (summary["operations"], summary["failed"], summary["drop_rate"]) == (4, 1, 0.25)
+    assert summary["throughput"] == 3
+    assert summary["p50_ms"] == 2 and summary["max_ms"] == 3
+    assert math.isnan(percentile([], 0.5))
+
+
+def test_compare_reports_regressions_beyond_the_threshold():
+    baseline = {"phases": {"login": phase(1000, 10), "relay": phase(1000, 10)}}
+    results = {"phases": {"login": phase(950, 10.5), "relay": phase(800, 20, drop_rate=0.05)}}
+
+    regressions = compare(results, baseline, threshold=0.1)
+    assert len(regressions) == 3 and all(line.startswith("relay:") for line in regressions)
+    assert compare(results, {}, threshold=0.1) == []
+
+
+def test_short_run_completes_every_phase(monkeypatch):
+    # The benchmark reads the schema relative to Server/, as when run from the command line
+    monkeypatch.chdir(SERVER)
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+        probe.bind(("localhost", 0))
+        port = probe.getsockname()[1]
+
+    args = argparse.Namespace(engine="threaded", workers=1, sessions=4, concurrency=4, messages=2, timeout=5.0,
+                              reliable=False, port=port)
+    results = run(args)
+
+    assert set(results["phases"]) == set(PHASES)
+    assert all(summary["operations"] and not summary["failed"] for summary in results["phases"].values())
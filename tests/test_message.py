@@ -0,0 +1,63 @@
+import zlib
+
+import pytest
+from Cryptodome.Cipher import AES
+from Cryptodome.Util import Padding
+
+from MessageTypes.message import EncryptedMessage, MAX_PLAINTEXT, MODES, decompress, new_cipher
+
+KEY = bytes(range(32))
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_seals_each_message_with_a_fresh_nonce(mode):
+    first = EncryptedMessage(KEY, "hello bob", mode=mode)
+    second = EncryptedMessage(KEY, "hello bob", mode=mode)
+
+    # Stream modes, the ciphertext is as long as the text
+    assert len(first.text) == len("hello bob")
+    assert first.nonce != second.nonce and first.text != second.text
+    assert EncryptedMessage(KEY, first.text, first.tag, first.nonce, mode=mode).text == "hello bob"
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_tampering_is_detected(mode):
+    message = EncryptedMessage(KEY, "hello bob", mode=mode)
+    message.text = bytes([message.text[0] ^ 1]) + message.text[1:]
+
+    with pytest.raises(ValueError):
+        message.decrypt()
+    message.key = bytes(32)
+    with pytest.raises(ValueError):
+        message.decrypt()
+
+
+def test_unknown_mode_is_refused():
+    with pytest.raises(ValueError):
+        new_cipher(KEY, "des")
+
+
+def test_long_texts_are_compressed_above_the_threshold():
+    text = "la " * 1000
+    message = EncryptedMessage(KEY, text, compress_threshold=256)
+
+    assert message.compressed and len(message.text) < len(text)
+    assert message.decrypt() == text
+    assert not EncryptedMessage(KEY, "short", compress_threshold=256).compressed
+
+
+def test_decompression_is_bounded():
+    with pytest.raises(ValueError):
+        decompress(zlib.compress(bytes(MAX_PLAINTEXT + 1)))
+    with pytest.raises(ValueError):
+        decompress(b"not zlib")
+
+
+def test_reads_padded_messages_from_older_senders():
+    cipher = AES.new(KEY, AES.MODE_EAX)
+    text, tag = cipher.encrypt_and_digest(Padding.pad(b"hello bob", 16))
+
+    # As restored from YAML, without the fields newer senders set
+    message = EncryptedMessage.__new__(EncryptedMessage)
+    message.key, message.text, message.tag, message.nonce = KEY, text, tag, cipher.nonce
+    assert message.decrypt() == "hello bob"
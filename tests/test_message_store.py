@@ -0,0 +1,63 @@
+import pytest
+
+from MessageTypes import codec
+from MessageTypes.message import EncryptedMessage
+from Server.message_store import MessageStore
+from Server.server import ClientInfo, ThreadedUDPHandler
+from Util.db import ConnectionPool
+
+ALICE = ("127.0.0.1", 40001)
+KEY = bytes(range(32))
+
+
+@pytest.fixture
+def mailbox(db_path):
+    pool = ConnectionPool(db_path, 2)
+    store = MessageStore(pool, max_messages=3, max_payload=16)
+    yield store
+    store.close()
+    pool.close()
+
+
+def test_drain_returns_the_queue_oldest_first_and_clears_it(mailbox):
+    for i in range(2):
+        mailbox.append("bob", "alice", b"m%d" % i)
+    mailbox.append("carol", "alice", b"for carol")
+
+    assert mailbox.drain("bob") == [("alice", b"m0"), ("alice", b"m1")]
+    assert mailbox.drain("bob") == []
+    assert mailbox.drain("carol") == [("alice", b"for carol")]
+
+
+def test_queues_are_capped_and_payloads_bounded(mailbox):
+    futures = [mailbox.append("bob", "alice", b"m%d" % i) for i in range(5)]
+    assert all(future.result() for future in futures)
+    assert not mailbox.append("bob", "alice", bytes(17)).result()
+
+    # Only the newest max_messages are kept
+    assert [payload for _, payload in mailbox.drain("bob")] == [b"m2", b"m3", b"m4"]
+
+
+def test_expired_messages_are_not_delivered(mailbox):
+    mailbox.append("bob", "alice", b"old")
+    mailbox.flush()
+    mailbox.retention = 0.0
+
+    assert mailbox.drain("bob") == []
+
+
+def test_server_keeps_messages_for_registered_users_that_are_offline(server):
+    session = ClientInfo(ALICE, key=KEY)
+    session.wire_format = codec.BINARY
+    server.client_list.add(ALICE, session)
+    server.client_list.bind(session, "alice")
+    server.users.add_user("bob", "hash", "salt")
+
+    for recipient in ("bob", "nobody"):
+        message = EncryptedMessage(KEY, f"hi {recipient}", recipient=recipient, sender="alice")
+        ThreadedUDPHandler((codec.encode(message), server.socket), ALICE, server)
+
+    assert server.sent == []
+    stored = server.mailbox.drain("bob")
+    assert [codec.decode(payload, KEY).decrypt() for _, payload in stored] == ["hi bob"]
+    assert server.mailbox.drain("nobody") == []
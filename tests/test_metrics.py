@@ -0,0 +1,90 @@
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from Server.admin import AdminServer
+from Server.metrics import Histogram, Metrics
+
+
+def test_histogram_percentiles_are_within_a_bucket():
+    histogram = Histogram()
+    for i in range(1, 1001):
+        histogram.observe(i / 1000)
+
+    for fraction in (0.5, 0.9, 0.99):
+        assert fraction <= histogram.percentile(fraction) < fraction * 1.25
+    summary = histogram.summary()
+    assert summary["count"] == 1000 and summary["max_ms"] == 1000
+    assert Histogram().summary() == {"count": 0}
+
+
+def test_snapshot_reads_counters_levels_and_gauges():
+    metrics = Metrics()
+    metrics.increment("relayed", 3)
+    metrics.level("in_flight", 2)
+    metrics.level("in_flight", -1)
+    metrics.gauge("sessions", lambda: 7)
+    metrics.gauge("broken", lambda: 1 / 0)
+    with metrics.timer("lookup"):
+        pass
+
+    snapshot = metrics.snapshot()
+    assert snapshot["counters"] == {"relayed": 3}
+    assert snapshot["gauges"]["in_flight"] == 1 and snapshot["gauges"]["sessions"] == 7
+    # A failing gauge is reported, not raised
+    assert "ZeroDivisionError" in snapshot["gauges"]["broken"]
+    assert snapshot["latency"]["lookup"]["count"] == 1
+
+
+def busy(stop: threading.Event):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_profiler_samples_other_threads():
+    metrics = Metrics()
+    stop = threading.Event()
+    worker = threading.Thread(target=busy, args=(stop,))
+    worker.start()
+    try:
+        metrics.profiler.start(interval=0.001)
+        time.sleep(0.1)
+        metrics.profiler.stop()
+    finally:
+        stop.set()
+        worker.join()
+
+    report = metrics.profiler.report()
+    assert not report["running"] and report["samples"] > 0
+    assert any(function.endswith(":busy") for function, _ in report["total"])
+
+
+@pytest.fixture
+def admin():
+    server = AdminServer(("localhost", 0), Metrics())
+    server.start()
+    yield server
+    server.close()
+
+
+def request(admin: AdminServer, path: str, method: str = "GET") -> dict:
+    url = f"http://localhost:{admin.server_address[1]}{path}"
+    with urllib.request.urlopen(urllib.request.Request(url, method=method), timeout=5) as response:
+        return json.load(response)
+
+
+def test_admin_serves_metrics_and_controls_the_profiler(admin):
+    admin.metrics.increment("relayed")
+    assert request(admin, "/metrics")["counters"] == {"relayed": 1}
+
+    assert request(admin, "/profile/start?interval=0.01", "POST") == {"running": True, "interval_s": 0.01}
+    assert request(admin, "/profile")["running"]
+    assert not request(admin, "/profile/stop", "POST")["running"]
+
+    with pytest.raises(urllib.error.HTTPError) as error:
+        request(admin, "/nowhere")
+    assert error.value.code == 404
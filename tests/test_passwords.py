@@ -0,0 +1,56 @@
+import pytest
+from Cryptodome.Hash import SHA3_256
+
+from Server.passwords import Busy, PasswordHasher, parse, verify
+
+# Cheap parameters, the tests check the encoding and not the cost
+FAST = ("scrypt:n=16", "pbkdf2_sha256:iterations=10")
+
+
+def test_parse_fills_in_defaults_and_refuses_unknown_options():
+    assert parse("scrypt:n=32768") == ("scrypt", {"n": 32768, "r": 8, "p": 1})
+    assert parse("pbkdf2_sha256") == ("pbkdf2_sha256", {"iterations": 600000})
+    for spec in ("md5", "scrypt:rounds=3"):
+        with pytest.raises(ValueError):
+            parse(spec)
+
+
+@pytest.mark.parametrize("spec", FAST)
+def test_hashes_verify_with_their_own_parameters(spec):
+    hasher = PasswordHasher(spec, workers=0)
+    encoded = hasher.hash("secret", "salt")
+
+    assert encoded.startswith(hasher.prefix) and not hasher.needs_rehash(encoded)
+    assert hasher.check(encoded, "secret", "salt")
+    assert not hasher.check(encoded, "secret", "pepper")
+    assert not hasher.check(encoded, "wrong", "salt")
+    # A hash made with the other KDF verifies but is due for a rehash
+    other = PasswordHasher(FAST[1] if spec == FAST[0] else FAST[0], workers=0)
+    assert hasher.check(other.hash("secret", "salt"), "secret", "salt")
+    assert hasher.needs_rehash(other.hash("secret", "salt"))
+
+
+def test_legacy_digests_verify_and_need_a_rehash():
+    legacy = SHA3_256.new(b"secretsalt").hexdigest()
+
+    assert verify(legacy, "secret", "salt") and not verify(legacy, "wrong", "salt")
+    assert PasswordHasher(FAST[0], workers=0).needs_rehash(legacy)
+
+
+def test_full_queue_is_refused():
+    hasher = PasswordHasher(FAST[0], workers=0, max_pending=0)
+
+    with pytest.raises(Busy):
+        hasher.hash("secret", "salt")
+    assert hasher.rejected == 1 and hasher.pending == 0
+
+
+def test_worker_processes_hash_the_same_way():
+    hasher = PasswordHasher(FAST[1], workers=1)
+    try:
+        hasher.start(wait=True)
+        encoded = hasher.hash("secret", "salt")
+    finally:
+        hasher.close()
+
+    assert encoded == PasswordHasher(FAST[1], workers=0).hash("secret", "salt")
@@ -0,0 +1,97 @@
+import socket
+
+import pytest
+
+from MessageTypes import codec
+from MessageTypes.message import EncryptedMessage, Message
+from Server.server import ClientInfo, ThreadedUDPHandler
+
+ALICE = ("127.0.0.1", 40001)
+BOB = ("127.0.0.1", 40002)
+KEY = bytes(range(32))
+
+
+@pytest.fixture(autouse=True)
+def sessions(server):
+    for address, username in ((ALICE, "alice"), (BOB, "bob")):
+        session = ClientInfo(address, key=KEY)
+        session.wire_format = codec.BINARY
+        server.client_list.add(address, session)
+        server.client_list.bind(session, username)
+
+
+def receive(server, address, message: Message):
+    ThreadedUDPHandler((codec.encode(message), server.socket), address, server)
+
+
+def test_relays_messages_from_their_sender(server):
+    message = EncryptedMessage(KEY, "hi bob", recipient="bob", sender="alice")
+    receive(server, ALICE, message)
+
+    assert [recipient for _, recipient in server.sent] == ["bob"]
+    assert codec.decode(server.sent[0][0], KEY).decrypt() == "hi bob"
+
+
+@pytest.mark.parametrize("sender", ["carol", "bob", None])
+def test_drops_messages_claiming_another_sender(server, sender):
+    receive(server, ALICE, EncryptedMessage(KEY, "hi bob", recipient="bob", sender=sender))
+
+    assert server.sent == []
+    assert server.metrics.counters["spoofed"] == 1
+
+
+def test_drops_messages_from_sessions_that_never_logged_in(server):
+    stranger = ("127.0.0.1", 40003)
+    receive(server, stranger, EncryptedMessage(KEY, "hi bob", recipient="bob", sender=None))
+    receive(server, stranger, EncryptedMessage(KEY, "hi bob", recipient="bob", sender="alice"))
+
+    assert server.sent == []
+
+
+@pytest.mark.parametrize("wire_format", [codec.BINARY, codec.YAML])
+def test_decoded_path_checks_the_sender(server, wire_format):
+    # YAML frames and batches skip the header-only fast path and go through route
+    message = EncryptedMessage(KEY, "hi bob", recipient="bob", sender="carol")
+    ThreadedUDPHandler((codec.encode(message, wire_format), server.socket), ALICE, server)
+    assert server.sent == []
+
+    message.sender = "alice"
+    ThreadedUDPHandler((codec.encode(message, wire_format), server.socket), ALICE, server)
+    assert [recipient for _, recipient in server.sent] == ["bob"]
+
+
+@pytest.mark.parametrize("payload", [
+    b"just some text",
+    b"!!python/object:MessageTypes.message.EncryptedMessage {recipient: [bob], sender: alice}",
+    b"!!python/object:MessageTypes.message.Message {text: hi}",
+    b"!!python/object:MessageTypes.message.Message {recipient: bob, sender: 7}",
+    codec.HEADER.pack(codec.MAGIC, codec.VERSION, codec.MESSAGE) + b"\x00\x02\xff\xfe",
+])
+def test_drops_datagrams_that_are_not_messages(server, payload):
+    ThreadedUDPHandler((payload, server.socket), ALICE, server)
+    assert server.sent == []
+
+
+@pytest.mark.parametrize("wire_format", [codec.BINARY, codec.YAML])
+def test_async_server_relays_between_sockets(async_server, wire_format):
+    # Binary frames take the header-only fast path on the event loop, YAML ones are decoded and routed there
+    sockets = {}
+    for username in ("alice", "bob"):
+        sock = sockets[username] = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(("127.0.0.1", 0))
+        sock.settimeout(5)
+        address = sock.getsockname()
+        session = ClientInfo(address, key=KEY)
+        session.wire_format = wire_format
+        async_server.client_list.add(address, session)
+        async_server.client_list.bind(session, username)
+
+    try:
+        message = EncryptedMessage(KEY, "hi bob", recipient="bob", sender="alice")
+        sockets["alice"].sendto(codec.encode(message, wire_format), async_server.server_address)
+        received, _ = sockets["bob"].recvfrom(65536)
+
+        assert codec.decode(received, KEY).decrypt() == "hi bob"
+    finally:
+        for sock in sockets.values():
+            sock.close()
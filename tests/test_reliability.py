@@ -0,0 +1,75 @@
+import pytest
+
+from MessageTypes import reliability
+from MessageTypes.reliability import ReliableEndpoint, ReliabilityError, HEADER, MAGIC
+
+ALICE = ("127.0.0.1", 40001)
+BOB = ("127.0.0.1", 40002)
+
+
+class Link(object):
+    """
+    Two endpoints whose datagrams are collected instead of sent, deliver passes them to the other side
+    """
+
+    def __init__(self):
+        self.queues = {ALICE: [], BOB: []}
+        self.alice = ReliableEndpoint(lambda data, address: self.queues[BOB].append(data))
+        self.bob = ReliableEndpoint(lambda data, address: self.queues[ALICE].append(data))
+
+    def deliver(self, address) -> list:
+        endpoint, sender = (self.bob, ALICE) if address == BOB else (self.alice, BOB)
+        datagrams, self.queues[address] = self.queues[address], []
+        return [data for data in (endpoint.receive(datagram, sender) for datagram in datagrams) if data is not None]
+
+
+def test_sequence_numbers_wrap_around():
+    link = Link()
+    link.alice.send(b"first", BOB)
+    assert link.deliver(BOB) == [b"first"]
+    link.deliver(ALICE)
+
+    # Both sides are about to run out of 32 bit sequence numbers
+    link.alice._channels[BOB].next_seq = 0xFFFFFFFE
+    link.bob._channels[ALICE].expected = 0xFFFFFFFE
+
+    payloads = [b"m%d" % i for i in range(4)]
+    for payload in payloads:
+        link.alice.send(payload, BOB)
+    sent = list(link.queues[BOB])
+    assert link.deliver(BOB) == payloads
+    assert link.bob._channels[ALICE].expected == 2
+
+    # Every acknowledgement lands after the wrap, all four are acknowledged
+    link.deliver(ALICE)
+    assert not link.alice._channels[BOB].unacked
+
+    # Numbers from before the wrap are duplicates, not far ahead
+    link.queues[BOB] = sent
+    assert link.deliver(BOB) == []
+    assert link.bob.duplicates == 4
+
+
+def test_selective_acknowledgement_across_the_wrap():
+    assert reliability._acknowledged(0xFFFFFFFF, 1, 0)
+    assert reliability._acknowledged(2, 0xFFFFFFFF, 0b100)
+    assert not reliability._acknowledged(1, 0xFFFFFFFF, 0b100)
+    assert not reliability._acknowledged(5, 0xFFFFFFF0, 0)
+
+
+@pytest.mark.parametrize("frame", [
+    MAGIC + b"\x01",
+    HEADER.pack(MAGIC, reliability.VERSION + 1, reliability.DATA, 1, 0),
+    HEADER.pack(MAGIC, reliability.VERSION, reliability.ACK, 1, 0),
+    HEADER.pack(MAGIC, reliability.VERSION, 7, 1, 0),
+])
+def test_malformed_frames_are_rejected(frame):
+    with pytest.raises(ReliabilityError):
+        ReliableEndpoint(lambda data, address: None).receive(frame, ALICE)
+
+
+def test_server_drops_malformed_reliability_frames(server):
+    from Server.server import ThreadedUDPHandler
+
+    ThreadedUDPHandler((MAGIC + b"\x01", server.socket), ALICE, server)
+    assert server.sent == []
@@ -0,0 +1,160 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from Client import tickets
+from MessageTypes import codec
+from MessageTypes.message import EAX, GCM
+from Server.server import ClientInfo
+from Server.tickets import TicketStore
+from Util import resumption
+
+SESSION_KEY = bytes(range(32))
+
+
+class FakeHandler(object):
+    """
+    Stands in for the request handler, records what the session sends and binds
+    """
+
+    def __init__(self):
+        self.sent = []
+        self.bound = []
+        self.caught_up = []
+        self.server = SimpleNamespace(
+            tickets=TicketStore(),
+            client_list=SimpleNamespace(bind=lambda client, username: self.bound.append(username) or True),
+            rooms=SimpleNamespace(rooms_of=lambda username: []),
+        )
+
+    def send_object(self, obj, client):
+        self.sent.append(obj)
+
+    def deliver_stored(self, client):
+        self.caught_up.append(client.username)
+
+
+@pytest.fixture
+def issued():
+    handler = FakeHandler()
+    secret = resumption.resumption_secret(SESSION_KEY)
+    ticket_id = handler.server.tickets.issue(secret, "alice", EAX)
+    return handler, secret, ticket_id
+
+
+def resume(handler, ticket_id, nonce, mac):
+    client = ClientInfo(("127.0.0.1", 40000))
+    client.resume(handler, ticket_id, nonce, mac)
+    return client, handler.sent[-1]
+
+
+def test_resume_with_valid_mac(issued):
+    handler, secret, ticket_id = issued
+    nonce = b"\x07" * resumption.NONCE_SIZE
+
+    client, reply = resume(handler, ticket_id, nonce, resumption.resume_mac(secret, ticket_id, nonce, "alice"))
+
+    assert reply.request == "resumed"
+    assert handler.bound == ["alice"]
+    assert client.key == resumption.resumed_key(secret, nonce, bytes(reply.nonce))
+    assert handler.server.tickets.find(ticket_id) is None  # Used once
+
+
+@pytest.mark.parametrize("mac", [
+    None,
+    b"",
+    b"\x00" * 32,
+    resumption.resume_mac(b"\x01" * 32, b"\x02" * 16, b"\x03" * 16, "alice"),
+])
+def test_resume_without_proof_is_rejected(issued, mac):
+    handler, secret, ticket_id = issued
+
+    client, reply = resume(handler, ticket_id, b"\x07" * resumption.NONCE_SIZE, mac)
+
+    assert reply.request == "rejected"
+    assert client.username is None and client.key is None
+    assert not handler.bound and not handler.caught_up
+    # The ticket stays with its owner
+    assert handler.server.tickets.find(ticket_id) is not None
+
+
+def test_mac_binds_nonce_and_username(issued):
+    handler, secret, ticket_id = issued
+    nonce = b"\x07" * resumption.NONCE_SIZE
+
+    # A MAC captured for one nonce or username does not resume with another
+    _, reply = resume(handler, ticket_id, b"\x08" * resumption.NONCE_SIZE,
+                      resumption.resume_mac(secret, ticket_id, nonce, "alice"))
+    assert reply.request == "rejected"
+    _, reply = resume(handler, ticket_id, nonce, resumption.resume_mac(secret, ticket_id, nonce, "mallory"))
+    assert reply.request == "rejected"
+    assert not handler.bound
+
+
+def test_ticket_resumes_once(issued):
+    handler, secret, ticket_id = issued
+    nonce = b"\x07" * resumption.NONCE_SIZE
+    mac = resumption.resume_mac(secret, ticket_id, nonce, "alice")
+
+    assert resume(handler, ticket_id, nonce, mac)[1].request == "resumed"
+    assert resume(handler, ticket_id, nonce, mac)[1].request == "rejected"
+    assert handler.bound == ["alice"]
+
+
+def test_failed_bind_keeps_the_session_key(issued):
+    handler, secret, ticket_id = issued
+    handler.server.client_list.bind = lambda client, username: False
+    nonce = b"\x07" * resumption.NONCE_SIZE
+
+    client = ClientInfo(("127.0.0.1", 40000), key=SESSION_KEY)
+    client.cipher_mode = GCM
+    client.resume(handler, ticket_id, nonce, resumption.resume_mac(secret, ticket_id, nonce, "alice"))
+
+    assert handler.sent[-1].request == "rejected"
+    assert (client.key, client.cipher_mode) == (SESSION_KEY, GCM)
+
+
+def answer(handler, request):
+    """
+    The server's reply to a client's resume request, as the client decodes it
+    """
+    client, reply = resume(handler, request.ticket_id, request.nonce, request.mac)
+    return client, codec.decode(codec.encode(reply))
+
+
+def test_client_resumes_with_its_ticket(issued):
+    handler, secret, ticket_id = issued
+    ticket = ticket_id, secret, "alice"
+
+    request, nonce = tickets.resume_request(ticket)
+    session, reply = answer(handler, request)
+    key, next_ticket = tickets.resumed(reply, ticket, nonce)
+
+    assert key == session.key
+    assert next_ticket[2] == "alice" and next_ticket[1] == resumption.resumption_secret(key)
+    assert handler.server.tickets.find(next_ticket[0]) is not None
+
+
+def test_client_gives_up_on_a_rejected_ticket(issued):
+    handler, _, ticket_id = issued
+    ticket = ticket_id, b"\x01" * 32, "alice"  # Not the secret the ticket was issued with
+
+    request, nonce = tickets.resume_request(ticket)
+    _, reply = answer(handler, request)
+    assert tickets.resumed(reply, ticket, nonce) is None
+
+
+def test_ticket_file_is_private_and_per_server(tmp_path):
+    path = str(tmp_path / "ticket.json")
+    ticket = b"\x02" * 16, b"\x03" * 32, "alice"
+    tickets.write_ticket(path, ("localhost", 9999), ticket)
+
+    assert os.stat(path).st_mode & 0o777 == 0o600
+    assert tickets.read_ticket(path, ("localhost", 9999)) == ticket
+    assert tickets.read_ticket(path, ("localhost", 9998)) is None
+    assert tickets.read_ticket(str(tmp_path / "missing.json"), ("localhost", 9999)) is None
+
+    with open(path, "w") as f:
+        f.write("{not json")
+    assert tickets.read_ticket(path, ("localhost", 9999)) is None
@@ -0,0 +1,134 @@
+import sqlite3
+
+import pytest
+
+from MessageTypes import codec
+from MessageTypes.message import EncryptedMessage, RoomMessage
+from Server.cache import TTLCache
+from Server.room_store import RoomStore
+from Server.server import ClientInfo, ThreadedUDPHandler
+from Util.db import ConnectionPool
+
+KEY = bytes(range(32))
+USERS = {"alice": ("127.0.0.1", 40001), "bob": ("127.0.0.1", 40002), "carol": ("127.0.0.1", 40003)}
+
+
+@pytest.fixture
+def rooms(db_path):
+    pool = ConnectionPool(db_path, 2)
+    store = RoomStore(pool)
+    yield store
+    store.close()
+    pool.close()
+
+
+def reopen(db_path: str) -> RoomStore:
+    return RoomStore(ConnectionPool(db_path, 1))
+
+
+def log_in(server, *usernames):
+    for username in usernames:
+        session = ClientInfo(USERS[username], key=KEY)
+        session.wire_format = codec.BINARY
+        server.client_list.add(USERS[username], session)
+        server.client_list.bind(session, username)
+
+
+def send(server, username: str, message):
+    ThreadedUDPHandler((codec.encode(message), server.socket), USERS[username], server)
+
+
+def received(server) -> list:
+    """
+    Returns and forgets what the server sent, as (recipient, request, text) for room messages
+    """
+    messages = [(recipient, codec.decode(payload)) for payload, recipient in server.sent]
+    server.sent.clear()
+    return [(recipient, message.request, message.text) for recipient, message in messages
+            if type(message) is RoomMessage]
+
+
+def test_join_needs_an_invite(rooms):
+    rooms.create("lobby", "alice")
+
+    assert rooms.join("lobby", "bob") is None
+    assert rooms.join("nowhere", "bob") is None
+    assert not rooms.invite("lobby", "carol", "bob")  # Only members invite
+
+    assert rooms.invite("lobby", "alice", "bob")
+    assert rooms.join("lobby", "bob").members == {"alice", "bob"}
+
+    # The invite is used up once bob leaves
+    assert rooms.leave("lobby", "bob")
+    assert rooms.join("lobby", "bob") is None
+
+
+def test_invites_and_members_persist(rooms, db_path):
+    rooms.create("lobby", "alice")
+    rooms.invite("lobby", "alice", "bob")
+    rooms.invite("lobby", "alice", "carol")
+    rooms.join("lobby", "carol")
+    rooms.submit(None).result()
+
+    other = reopen(db_path)
+    room = other.get("lobby")
+    assert (room.members, room.invites) == ({"alice", "carol"}, {"bob"})
+    other.close()
+
+
+def test_server_never_holds_room_keys(rooms, db_path):
+    rooms.create("lobby", "alice")
+    rooms.submit(None).result()
+
+    connection = sqlite3.connect(db_path)
+    columns = {row[1] for row in connection.execute("PRAGMA table_info(rooms)")}
+    connection.close()
+    assert "key" not in columns
+    assert not hasattr(rooms.get("lobby"), "key")
+
+
+def test_cache_is_bounded(db_path):
+    pool = ConnectionPool(db_path, 1)
+    rooms = RoomStore(pool, cache=TTLCache(max_size=2))
+    for name in ("a", "b", "c"):
+        rooms.create(name, "alice")
+    assert len(rooms.cache) == 2
+
+    # Queued changes to a room that was dropped are written before it is read again
+    rooms.invite("a", "alice", "bob")
+    rooms.cache.clear()
+    assert rooms.get("a").invites == {"bob"}
+    rooms.close()
+    pool.close()
+
+
+def test_members_pass_keys_between_themselves(server):
+    log_in(server, "alice", "bob", "carol")
+
+    # Nobody else is online, the creator makes the key
+    send(server, "alice", RoomMessage("create", "lobby", sender="alice"))
+    assert received(server) == [("alice", "error", "Created room."), ("alice", "rekey", "")]
+
+    # Alice is asked to share her key with bob once he joins
+    send(server, "alice", RoomMessage("invite", "lobby", text="bob", sender="alice"))
+    send(server, "bob", RoomMessage("join", "lobby", sender="bob"))
+    assert received(server)[1:] == [("bob", "error", "Joined room."), ("alice", "share", "bob")]
+
+    # The key goes from member to member and is only relayed between members
+    room_key = EncryptedMessage(KEY, "00" * 32)
+    send(server, "alice", RoomMessage("key", "lobby", room_key, recipient="bob", sender="alice"))
+    send(server, "carol", RoomMessage("key", "lobby", room_key, recipient="bob", sender="carol"))
+    send(server, "alice", RoomMessage("key", "lobby", room_key, recipient="carol", sender="alice"))
+    assert received(server) == [("bob", "key", None)]
+
+
+def test_key_is_rotated_when_a_member_leaves(server):
+    log_in(server, "alice", "bob", "carol")
+    rooms = server.rooms
+    rooms.create("lobby", "alice")
+    for username in ("bob", "carol"):
+        rooms.invite("lobby", "alice", username)
+        rooms.join("lobby", username)
+
+    send(server, "carol", RoomMessage("leave", "lobby", sender="carol"))
+    assert received(server) == [("alice", "rekey", "bob"), ("carol", "error", "Left room.")]
@@ -0,0 +1,42 @@
+import pytest
+
+from Util.safe_prime import (SMALL_PRIMES, WINDOW, _sieve_window, generate_safe_primes, is_probable_prime,
+                             is_safe_prime, safe_prime_root)
+
+
+def test_primality():
+    assert [n for n in range(50) if is_probable_prime(n)] == [2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47]
+    # Carmichael numbers fool the Fermat test but not Miller-Rabin
+    assert not any(is_probable_prime(n) for n in (561, 1105, 1729, 2465))
+    assert is_probable_prime(2 ** 127 - 1)
+
+
+def test_safe_primes_and_their_roots():
+    assert [p for p in range(100) if is_safe_prime(p)] == [7, 11, 23, 47, 59, 83]
+    # The smallest primitive root, checked against the order of every candidate
+    for p in (7, 11, 23, 47, 59, 83):
+        root = safe_prime_root(p)
+        assert len({pow(root, k, p) for k in range(1, p)}) == p - 1
+        assert all(len({pow(g, k, p) for k in range(1, p)}) < p - 1 for g in range(2, root))
+
+
+def test_sieve_marks_exactly_the_candidates_with_small_factors():
+    q0 = 2 ** 40 + 1
+    composite = _sieve_window(q0)
+    for k in range(0, WINDOW, 7):
+        q = q0 + 2 * k
+        has_factor = any(q % s == 0 or (2 * q + 1) % s == 0 for s in SMALL_PRIMES[:500])
+        if has_factor:
+            assert composite[k], q
+    # Every offset left is free of the first few small factors
+    survivors = [q0 + 2 * k for k in range(WINDOW) if not composite[k]]
+    assert survivors and all(q % s and (2 * q + 1) % s for q in survivors for s in SMALL_PRIMES[:50])
+
+
+def test_generate_finds_distinct_safe_primes_of_the_requested_size():
+    primes = generate_safe_primes(64, count=2, workers=2)
+
+    assert len(set(primes)) == 2
+    assert all(p.bit_length() == 64 and is_safe_prime(p) for p in primes)
+    with pytest.raises(ValueError):
+        generate_safe_primes(8)
@@ -0,0 +1,91 @@
+from Server.sessions import SessionRegistry
+from Server.server import ClientInfo
+
+ADDRESS = ("127.0.0.1", 40000)
+
+
+def test_bind_indexes_username():
+    sessions = SessionRegistry()
+    session = ClientInfo(ADDRESS)
+    sessions.add(ADDRESS, session)
+
+    assert sessions.bind(session, "alice")
+    assert sessions.find("alice") is session
+    assert sessions.stats()["anonymous"] == 0
+
+
+def test_bind_refuses_removed_sessions():
+    sessions = SessionRegistry()
+    session = ClientInfo(ADDRESS)
+    sessions.add(ADDRESS, session)
+    sessions.remove(ADDRESS)
+
+    assert not sessions.bind(session, "alice")
+    assert session.username is None
+    assert sessions.find("alice") is None
+
+
+def test_bind_refuses_evicted_sessions():
+    sessions = SessionRegistry(max_sessions=1)
+    session = ClientInfo(ADDRESS)
+    sessions.add(ADDRESS, session)
+    # A login was being checked for the first session when a second one pushed it out
+    sessions.add(("127.0.0.1", 40001), ClientInfo(("127.0.0.1", 40001)))
+
+    assert not sessions.bind(session, "alice")
+    assert sessions.find("alice") is None and len(sessions) == 1
+
+
+def test_bind_refuses_replaced_sessions():
+    sessions = SessionRegistry()
+    old, new = ClientInfo(ADDRESS), ClientInfo(ADDRESS)
+    sessions.add(ADDRESS, old)
+    sessions.add(ADDRESS, new)
+
+    assert not sessions.bind(old, "alice")
+    assert sessions.bind(new, "alice")
+    assert sessions.find("alice") is new
+
+
+def test_login_from_a_new_address_takes_over_the_route():
+    sessions = SessionRegistry()
+    old, new = ClientInfo(ADDRESS), ClientInfo(("127.0.0.1", 40001))
+    sessions.add(old.ip_address, old)
+    sessions.add(new.ip_address, new)
+    sessions.bind(old, "alice")
+    sessions.bind(new, "alice")
+
+    # Removing the old session leaves the route to the new one alone
+    assert sessions.remove(ADDRESS) is old
+    assert sessions.find("alice") is new
+
+
+def test_expire_removes_idle_sessions_only():
+    sessions = SessionRegistry(ttl=60, anonymous_ttl=10)
+    idle, anonymous, active = (ClientInfo(("127.0.0.1", port)) for port in (40000, 40001, 40002))
+    for session in (idle, anonymous, active):
+        sessions.add(session.ip_address, session)
+    sessions.bind(idle, "alice")
+    sessions.bind(active, "bob")
+    now = active.last_seen + 30
+
+    # Anonymous sessions go first
+    assert sessions.expire(now) == 1
+    assert anonymous.ip_address not in sessions
+
+    active.last_seen = idle.last_seen + 45  # Seen since
+    assert sessions.expire(idle.last_seen + 61) == 1
+    assert sessions.find("alice") is None and sessions.find("bob") is active
+
+
+def test_full_registry_evicts_anonymous_sessions_first():
+    sessions = SessionRegistry(max_sessions=2)
+    logged_in, anonymous = ClientInfo(ADDRESS), ClientInfo(("127.0.0.1", 40001))
+    sessions.add(logged_in.ip_address, logged_in)
+    sessions.bind(logged_in, "alice")
+    sessions.add(anonymous.ip_address, anonymous)
+    sessions.add(("127.0.0.1", 40002), ClientInfo(("127.0.0.1", 40002)))
+
+    assert anonymous.ip_address not in sessions
+    assert sessions.find("alice") is logged_in
+    assert sessions.stats()["evicted"] == 1
@@ -0,0 +1,65 @@
+import sqlite3
+from concurrent.futures import Future
+
+import pytest
+
+from Server.user_store import UserStore, _INSERT
+from Util.db import ConnectionPool
+
+
+@pytest.fixture
+def users(db_path):
+    store = UserStore(db_path, pool_size=2)
+    yield store
+    store.close()
+
+
+def usernames(db_path: str) -> list:
+    connection = sqlite3.connect(db_path)
+    try:
+        return [row[0] for row in connection.execute("SELECT username FROM users ORDER BY username")]
+    finally:
+        connection.close()
+
+
+def test_batch_commits_around_a_taken_username(users, db_path):
+    assert users.add_user("alice", "hash", "salt")
+    futures = [users.add_user_async(name, "hash", "salt") for name in ("bob", "alice", "carol")]
+
+    assert [future.result() for future in futures] == [True, False, True]
+    assert usernames(db_path) == ["alice", "bob", "carol"]
+
+
+def test_failed_batch_is_rolled_back(users, db_path):
+    # A statement that fails outright, not just a taken name, rolls back every write in its batch
+    batch = [((_INSERT, ("alice", "hash", "salt")), Future()), ((_INSERT, ("bob", "hash")), Future())]
+    with users.pool.connection() as connection:
+        users._write(connection, batch)
+
+    for _, future in batch:
+        with pytest.raises(sqlite3.Error):
+            future.result()
+    assert usernames(db_path) == []
+    assert users.get_user("alice") is None
+
+
+def test_updates_and_lookups_go_through_the_cache(users):
+    assert users.get_user("alice") is None  # Cached as missing
+    assert users.add_user("alice", "hash", "salt")
+    assert users.get_user("alice")["password"] == "hash"
+
+    assert users.update_password("alice", "new hash", "new salt").result()
+    assert not users.update_password("bob", "hash", "salt").result()
+    assert users.get_user("alice")["salt"] == "new salt"
+
+
+def test_pool_hands_out_at_most_size_connections(db_path):
+    pool = ConnectionPool(db_path, size=1, timeout=0.1)
+    try:
+        with pool.connection() as first:
+            with pytest.raises(TimeoutError):
+                pool.acquire()
+        with pool.connection() as second:
+            assert second is first
+    finally:
+        pool.close()